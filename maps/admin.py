@@ -1,6 +1,8 @@
 from django.contrib import admin
-from .models import Region, PropertyDataFile, Property, PropertyAttribute, MapLayer
+from .models import Region, PropertyDataFile, Property, PropertyAttribute, MapLayer, PropertyLayerFeature
+from .processing import enqueue_layer_processing
 from .services import process_property_file
+from .spatial_join import join_properties_to_layer
 
 # Note: Using standard ModelAdmin instead of OSMGeoAdmin
 
@@ -16,12 +18,20 @@ class PropertyAttributeInline(admin.TabularInline):
     extra = 1
 
 
+class PropertyLayerFeatureInline(admin.TabularInline):
+    model = PropertyLayerFeature
+    extra = 0
+    fields = ('layer', 'feature_id', 'properties')
+    readonly_fields = ('layer', 'feature_id', 'properties')
+    can_delete = False
+
+
 @admin.register(Property)
 class PropertyAdmin(admin.ModelAdmin):
     list_display = ('lot_number', 'address', 'city', 'property_type', 'region')
     list_filter = ('region', 'property_type', 'city')
     search_fields = ('lot_number', 'matricule_number', 'address')
-    inlines = [PropertyAttributeInline]
+    inlines = [PropertyAttributeInline, PropertyLayerFeatureInline]
     readonly_fields = ('predicted_height', 'predicted_quality_score')
 
 
@@ -54,10 +64,11 @@ admin.site.register(PropertyAttribute)
 
 @admin.register(MapLayer)
 class MapLayerAdmin(admin.ModelAdmin):
-    list_display = ('name', 'layer_type', 'region', 'is_active', 'is_base_layer', 'z_index')
-    list_filter = ('layer_type', 'region', 'is_active', 'is_base_layer')
+    list_display = ('name', 'layer_type', 'region', 'is_active', 'is_base_layer', 'z_index', 'processing_status')
+    list_filter = ('layer_type', 'region', 'is_active', 'is_base_layer', 'processing_status')
     search_fields = ('name', 'description')
-    readonly_fields = ('shapefile_dir',)
+    readonly_fields = ('shapefile_dir', 'processing_status', 'processing_stage', 'processing_error', 'stats')
+    actions = ['join_properties', 'reprocess_layers']
     fieldsets = (
         (None, {
             'fields': ('name', 'description', 'layer_type', 'region')
@@ -65,11 +76,32 @@ class MapLayerAdmin(admin.ModelAdmin):
         ('Layer Source', {
             'fields': ('url', 'file', 'shapefile_dir')
         }),
+        ('Processing', {
+            'fields': ('processing_status', 'processing_stage', 'processing_error', 'stats')
+        }),
         ('Display Options', {
             'fields': ('style', 'z_index', 'is_active', 'is_visible_by_default', 'is_base_layer')
         }),
     )
     
+    def join_properties(self, request, queryset):
+        for layer in queryset.filter(layer_type='shapefile'):
+            try:
+                joined = join_properties_to_layer(layer)
+                self.message_user(request, f"Joined {joined} properties to {layer.name}.")
+            except Exception as e:
+                self.message_user(request, f"Error joining properties to {layer.name}: {str(e)}", level='error')
+    
+    join_properties.short_description = "Join properties to the polygons of selected layers"
+    
+    def reprocess_layers(self, request, queryset):
+        layers = queryset.filter(layer_type='shapefile').exclude(file='')
+        for layer in layers:
+            enqueue_layer_processing(layer)
+        self.message_user(request, f"Queued {len(layers)} layers for processing.")
+    
+    reprocess_layers.short_description = "Re-extract and rebuild the indexes of selected layers"
+    
     def save_model(self, request, obj, form, change):
         """Override save_model to set the uploaded_by field"""
         if not change:  # Only set uploaded_by on creation
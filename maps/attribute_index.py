@@ -0,0 +1,440 @@
+"""
+Per-column attribute indexes for filtering shapefile layers on the server.
+
+When a layer is processed, each .dbf column is indexed once and saved next to
+the shapefile (``<name>.attrs/``):
+
+- numeric columns (N, F): the values sorted ascending with the record numbers
+  in the same order, so equality and range conditions are binary searches
+- other columns (C, D, L): an inverted index from each distinct value (sorted)
+  to the sorted record numbers holding it
+
+A ``where`` filter such as ``ZONE IN ('R1', 'R2') AND AREA >= 1000`` is then
+answered by a few searches over memory-mapped arrays, without reading the
+.dbf, and only the matching records are converted.
+"""
+
+import os
+import re
+import json
+import bisect
+import shutil
+import logging
+import threading
+from datetime import date, datetime
+
+import numpy as np
+import shapefile
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Index configuration
+INDEX_SUFFIX = '.attrs'
+NUMERIC_FIELD_TYPES = ('N', 'F')
+CATEGORICAL_FIELD_TYPES = ('C', 'D', 'L')
+
+_TOKEN_PATTERN = re.compile(
+    r"\s*(?:(?P<string>'(?:[^']|'')*')|(?P<op><=|>=|=|<|>)|(?P<punct>[(),])|(?P<word>[^\s'(),<>=]+))"
+)
+
+# Loaded indexes, keyed by index path and modification time
+_index_cache = {}
+_index_cache_lock = threading.Lock()
+
+
+class AttributeFilterError(ValueError):
+    """Raised for a where filter that is malformed or does not fit the layer's columns."""
+
+
+def get_index_path(shapefile_path):
+    """Get the path of the attribute index directory for a shapefile."""
+    return os.path.splitext(shapefile_path)[0] + INDEX_SUFFIX
+
+
+def _tokenize(where):
+    tokens = []
+    position = 0
+    where = where.strip()
+    while position < len(where):
+        match = _TOKEN_PATTERN.match(where, position)
+        if not match or match.end() == position:
+            raise AttributeFilterError(
+                f"Unexpected character at position {position}: {where[position:position + 10]!r}")
+        position = match.end()
+        if match.group('string') is not None:
+            tokens.append(('value', match.group('string')[1:-1].replace("''", "'")))
+        elif match.group('op') is not None:
+            tokens.append(('op', match.group('op')))
+        elif match.group('punct') is not None:
+            tokens.append((match.group('punct'), match.group('punct')))
+        elif match.group('word') is not None:
+            tokens.append(('word', match.group('word')))
+    return tokens
+
+
+def parse_where(where):
+    """
+    Parse a where filter into conditions
+
+    The grammar is a list of conditions joined by AND: ``FIELD op value`` with
+    op one of =, <, <=, >, >=, or ``FIELD IN (value, ...)``. String values are
+    quoted with single quotes; unquoted values are taken as written.
+
+    Args:
+        where: Filter text, e.g. "ZONE = 'R1' AND AREA > 1000"
+
+    Returns:
+        list: (field, operator, values) tuples
+
+    Raises:
+        AttributeFilterError: If the filter is malformed
+    """
+    tokens = _tokenize(where or '')
+    if not tokens:
+        raise AttributeFilterError("Empty filter")
+
+    conditions = []
+    position = 0
+
+    def take(*kinds):
+        nonlocal position
+        if position >= len(tokens) or tokens[position][0] not in kinds:
+            found = tokens[position][1] if position < len(tokens) else 'end of filter'
+            raise AttributeFilterError(f"Expected {' or '.join(kinds)}, found {found!r}")
+        position += 1
+        return tokens[position - 1][1]
+
+    while True:
+        field = take('word')
+        if position < len(tokens) and tokens[position][0] == 'word' and tokens[position][1].upper() == 'IN':
+            position += 1
+            take('(')
+            values = [take('value', 'word')]
+            while take(',', ')') == ',':
+                values.append(take('value', 'word'))
+            conditions.append((field, 'IN', values))
+        else:
+            operator = take('op')
+            conditions.append((field, operator, [take('value', 'word')]))
+
+        if position == len(tokens):
+            return conditions
+        if take('word').upper() != 'AND':
+            raise AttributeFilterError(f"Expected AND, found {tokens[position - 1][1]!r}")
+
+
+def _categorical_value(value):
+    """Convert a .dbf value to the text it is indexed under."""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return str(value)
+    return str(value)
+
+
+class AttributeIndex:
+    """Read-only view over the column indexes of a layer."""
+
+    def __init__(self, path, columns, feature_count):
+        self.path = path
+        self.columns = columns
+        self.feature_count = feature_count
+        self.shapefile_mtime = None
+        self._arrays = {}
+
+    @classmethod
+    def load(cls, path):
+        """Open an index directory; column arrays are memory-mapped on first use."""
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        index = cls(path, meta['columns'], meta['feature_count'])
+        index.shapefile_mtime = meta.get('shapefile_mtime')
+        return index
+
+    def _column(self, field):
+        column = self.columns.get(field)
+        if column is None:
+            raise AttributeFilterError(f"Field {field} is not indexed")
+        arrays = self._arrays.get(field)
+        if arrays is None:
+            base = os.path.join(self.path, str(column['position']))
+            if column['kind'] == 'numeric':
+                arrays = {
+                    'values': np.load(base + '.values.npy', mmap_mode='r'),
+                    'records': np.load(base + '.records.npy', mmap_mode='r'),
+                }
+            else:
+                with open(base + '.terms.json', 'r') as f:
+                    terms = json.load(f)
+                arrays = {
+                    'terms': terms,
+                    'offsets': np.load(base + '.offsets.npy', mmap_mode='r'),
+                    'records': np.load(base + '.records.npy', mmap_mode='r'),
+                }
+            self._arrays[field] = arrays
+        return column['kind'], arrays
+
+    def _numeric_matches(self, field, arrays, operator, values):
+        try:
+            numbers = [float(value) for value in values]
+        except ValueError:
+            raise AttributeFilterError(f"Field {field} is numeric, got {values}")
+
+        sorted_values, records = arrays['values'], arrays['records']
+        if operator == 'IN':
+            parts = [records[np.searchsorted(sorted_values, number, 'left'):
+                             np.searchsorted(sorted_values, number, 'right')] for number in numbers]
+            # Repeated values must not repeat records
+            return np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+
+        number = numbers[0]
+        if operator == '=':
+            start, end = np.searchsorted(sorted_values, number, 'left'), np.searchsorted(sorted_values, number, 'right')
+        elif operator == '<':
+            start, end = 0, np.searchsorted(sorted_values, number, 'left')
+        elif operator == '<=':
+            start, end = 0, np.searchsorted(sorted_values, number, 'right')
+        elif operator == '>':
+            start, end = np.searchsorted(sorted_values, number, 'right'), len(sorted_values)
+        else:
+            start, end = np.searchsorted(sorted_values, number, 'left'), len(sorted_values)
+        return np.sort(records[start:end])
+
+    def _categorical_matches(self, arrays, operator, values):
+        terms, offsets, records = arrays['terms'], arrays['offsets'], arrays['records']
+
+        def postings(first, last):
+            # Records of the terms first..last-1, whose postings are contiguous
+            return records[offsets[first]:offsets[last]]
+
+        if operator in ('=', 'IN'):
+            parts = []
+            for value in values:
+                position = bisect.bisect_left(terms, value)
+                if position < len(terms) and terms[position] == value:
+                    parts.append(postings(position, position + 1))
+            matches = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+            return np.unique(matches) if len(parts) > 1 else matches
+
+        value = values[0]
+        if operator == '<':
+            first, last = 0, bisect.bisect_left(terms, value)
+        elif operator == '<=':
+            first, last = 0, bisect.bisect_right(terms, value)
+        elif operator == '>':
+            first, last = bisect.bisect_right(terms, value), len(terms)
+        else:
+            first, last = bisect.bisect_left(terms, value), len(terms)
+        return np.sort(postings(first, last))
+
+    def select(self, conditions):
+        """
+        Find the records matching every condition
+
+        Args:
+            conditions: (field, operator, values) tuples from parse_where
+
+        Returns:
+            numpy.ndarray: Sorted record numbers
+
+        Raises:
+            AttributeFilterError: If a field is unknown or a value does not fit its column
+        """
+        result = None
+        for field, operator, values in conditions:
+            kind, arrays = self._column(field)
+            if kind == 'numeric':
+                matches = self._numeric_matches(field, arrays, operator, values)
+            else:
+                matches = self._categorical_matches(arrays, operator, values)
+            result = matches if result is None else np.intersect1d(result, matches, assume_unique=True)
+            if not len(result):
+                break
+        return np.asarray(result, dtype=np.int64)
+
+
+def _write_numeric_column(base, numbers):
+    # The values sorted ascending (NaN for missing ones), with the record numbers in the same order
+    records = np.nonzero(~np.isnan(numbers))[0]
+    order = np.argsort(numbers[records], kind='stable')
+    np.save(base + '.values.npy', numbers[records][order])
+    np.save(base + '.records.npy', records[order].astype(np.int64))
+
+
+def _write_categorical_column(base, codes, codes_by_term):
+    # Each record's value is coded by its first appearance (-1 when missing), so only the distinct values are kept
+    terms = sorted(codes_by_term)
+    ranks = np.empty(len(terms), dtype=np.int64)
+    ranks[[codes_by_term[term] for term in terms]] = np.arange(len(terms), dtype=np.int64)
+
+    records = np.nonzero(codes >= 0)[0]
+    inverse = ranks[codes[records]]
+    # Stable, so each term's records stay sorted
+    order = np.argsort(inverse, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(inverse, minlength=len(terms)))]).astype(np.int64)
+    with open(base + '.terms.json', 'w') as f:
+        json.dump(terms, f)
+    np.save(base + '.offsets.npy', offsets)
+    np.save(base + '.records.npy', records[order].astype(np.int64))
+    return len(terms)
+
+
+def build_attribute_index(shapefile_path):
+    """
+    Index every numeric and categorical column of a shapefile's .dbf
+
+    Args:
+        shapefile_path: Path to the .shp file
+
+    Returns:
+        str: Path of the index directory
+    """
+    index_path = get_index_path(shapefile_path)
+    temp_path = index_path + '.tmp'
+    logger.info(f"Building attribute index for {shapefile_path}")
+
+    if os.path.exists(temp_path):
+        shutil.rmtree(temp_path)
+    os.makedirs(temp_path)
+
+    reader = shapefile.Reader(shapefile_path)
+    meta_columns = {}
+    try:
+        fields = [field for field in reader.fields[1:]  # Skip DeletionFlag
+                  if field[1] in NUMERIC_FIELD_TYPES + CATEGORICAL_FIELD_TYPES]
+        feature_count = len(reader)
+        # The .dbf is parsed once, every column filling a numpy array rather than a Python object per value
+        columns = [np.full(feature_count, np.nan) if field[1] in NUMERIC_FIELD_TYPES
+                   else np.full(feature_count, -1, dtype=np.int64) for field in fields]
+        codes_by_term = [None if field[1] in NUMERIC_FIELD_TYPES else {} for field in fields]
+        if fields:
+            for row, record in enumerate(reader.iterRecords(fields=[field[0] for field in fields])):
+                for column, terms, value in zip(columns, codes_by_term, record):
+                    if value is None:
+                        continue
+                    if terms is None:
+                        column[row] = value
+                    else:
+                        column[row] = terms.setdefault(_categorical_value(value), len(terms))
+    finally:
+        reader.close()
+
+    for position, (field, column, terms) in enumerate(zip(fields, columns, codes_by_term)):
+        base = os.path.join(temp_path, str(position))
+        if terms is None:
+            _write_numeric_column(base, column)
+            meta_columns[field[0]] = {'position': position, 'kind': 'numeric'}
+        else:
+            meta_columns[field[0]] = {'position': position, 'kind': 'categorical',
+                                      'terms': _write_categorical_column(base, column, terms)}
+
+    with open(os.path.join(temp_path, 'meta.json'), 'w') as f:
+        json.dump({'shapefile_mtime': os.path.getmtime(shapefile_path), 'feature_count': feature_count,
+                   'columns': meta_columns}, f)
+
+    if os.path.exists(index_path):
+        shutil.rmtree(index_path)
+    os.replace(temp_path, index_path)
+    logger.info(f"Attribute index written to {index_path}: {len(meta_columns)} columns, {feature_count} records")
+    return index_path
+
+
+def get_attribute_index(shapefile_path, build_if_missing=True):
+    """
+    Get the attribute index of a shapefile, loading it once per process
+
+    Layers processed before attribute indexes existed (or whose shapefile has
+    changed since) get their index built on first use.
+
+    Args:
+        shapefile_path: Path to the .shp file
+        build_if_missing: Build the index if it is missing or stale
+
+    Returns:
+        AttributeIndex: The index, or None if it is unavailable
+    """
+    index_path = get_index_path(shapefile_path)
+    meta_path = os.path.join(index_path, 'meta.json')
+    try:
+        index = None
+        if os.path.exists(meta_path):
+            cache_key = (index_path, os.path.getmtime(meta_path))
+            with _index_cache_lock:
+                index = _index_cache.get(cache_key)
+            if index is None:
+                index = AttributeIndex.load(index_path)
+                with _index_cache_lock:
+                    # Drop stale versions of the same index
+                    for key in [k for k in _index_cache if k[0] == index_path]:
+                        del _index_cache[key]
+                    _index_cache[cache_key] = index
+            if index.shapefile_mtime != os.path.getmtime(shapefile_path):
+                logger.info(f"Attribute index is stale: {index_path}")
+                index = None
+
+        if index is None and build_if_missing:
+            build_attribute_index(shapefile_path)
+            return get_attribute_index(shapefile_path, build_if_missing=False)
+        return index
+    except Exception as e:
+        logger.error(f"Error loading attribute index for {shapefile_path}: {e}")
+        return None
+
+
+def check_where(shapefile_path, where):
+    """
+    Check a where filter against a shapefile's .dbf header, without evaluating it
+
+    Args:
+        shapefile_path: Path to the .shp file
+        where: Filter text, see parse_where
+
+    Returns:
+        list: (field, operator, values) tuples
+
+    Raises:
+        AttributeFilterError: If the filter is malformed, names a column that isn't
+            indexed, or compares a numeric column with text
+    """
+    conditions = parse_where(where)
+    reader = shapefile.Reader(shapefile_path)
+    try:
+        field_types = {field[0]: field[1] for field in reader.fields[1:]}  # Skip DeletionFlag
+    finally:
+        reader.close()
+
+    for field, _, values in conditions:
+        field_type = field_types.get(field)
+        if field_type not in NUMERIC_FIELD_TYPES + CATEGORICAL_FIELD_TYPES:
+            raise AttributeFilterError(f"Field {field} is not indexed")
+        if field_type in NUMERIC_FIELD_TYPES:
+            try:
+                [float(value) for value in values]
+            except ValueError:
+                raise AttributeFilterError(f"Field {field} is numeric, got {values}")
+    return conditions
+
+
+def select_records(shapefile_path, where):
+    """
+    Find the records of a shapefile matching a where filter
+
+    Args:
+        shapefile_path: Path to the .shp file
+        where: Filter text (see parse_where)
+
+    Returns:
+        numpy.ndarray: Sorted record numbers of the matching records
+
+    Raises:
+        AttributeFilterError: If the filter is malformed or does not fit the layer
+    """
+    conditions = parse_where(where)
+    index = get_attribute_index(shapefile_path)
+    if index is None:
+        raise AttributeFilterError("Attribute index is unavailable for this layer")
+    return index.select(conditions)
@@ -0,0 +1,178 @@
+"""
+Pre-rendering of shapefile layers into the file cache.
+
+static/js/map.js requests shapefile layers with a simplify/max_features preset
+chosen by zoom band, and reloads them when the map reaches zoom 10, 12, 14 or
+16; the first load happens at the default zoom of a region. Warming converts
+each active layer at those zoom levels with the same cache keys and code path
+as the layer data endpoint, so after a deploy or an upload the first visitors
+read a cache file instead of waiting for a cold conversion. render_layer also
+rebuilds expired entries of the layer data endpoint in the background (see
+maps.revalidation).
+"""
+
+import os
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from maps.caching import get_cache_key, layer_cache
+from maps.pyramid import iter_pyramid_geojson
+from maps.single_flight import KeyLock
+from maps.utils import get_pool_context, setup_pool_worker
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# (highest zoom, simplify, max_features) as requested by map.js, the last band is open-ended
+MAP_ZOOM_PRESETS = [
+    (10, '0.01', 5000),
+    (12, '0.005', 10000),
+    (14, '0.002', 15000),
+    (None, '0.001', 25000),
+]
+MAP_RELOAD_ZOOMS = (10, 12, 14, 16)  # map.js reloads shapefile layers at these zoom levels
+DEFAULT_REGION_ZOOM = 12
+
+
+def get_map_preset(zoom):
+    """
+    Get the parameters map.js requests a shapefile layer with at a zoom level
+
+    Returns:
+        tuple: (simplify, max_features), simplify as the text sent in the URL
+    """
+    for max_zoom, simplify, max_features in MAP_ZOOM_PRESETS:
+        if max_zoom is None or zoom <= max_zoom:
+            return simplify, max_features
+
+
+def get_warm_zooms():
+    """Get the zoom levels map.js loads layers at: its reload levels and the regions' default zooms"""
+    from maps.models import Region
+
+    zooms = set(MAP_RELOAD_ZOOMS) | {DEFAULT_REGION_ZOOM}
+    zooms.update(Region.objects.values_list('default_zoom', flat=True))
+    return sorted(zooms)
+
+
+def render_layer(layer, cache_key, simplify, max_features, zoom, fields=None, where=None, shapefile_path=None):
+    """
+    Stream the GeoJSON of a shapefile layer into the file cache, from the
+    generalization pyramid when it has the zoom level
+
+    Args:
+        layer: Shapefile MapLayer instance
+        cache_key: Cache key of the entry (see get_cache_key)
+        simplify, max_features, zoom, fields, where: Parameters of the layer data endpoint
+        shapefile_path: Path to the .shp file (looked up from the layer when None)
+
+    Returns:
+        int: Bytes written
+    """
+    shapefile_path = shapefile_path or layer.get_local_shapefile()
+    if not shapefile_path:
+        raise ValueError(f"Layer {layer.id} has no shapefile")
+
+    chunks = None
+    if zoom is not None and simplify not in ('', 'none', 'false', '0'):
+        chunks = iter_pyramid_geojson(shapefile_path, zoom, max_features, layer.style, fields, where)
+    if chunks is None:
+        chunks = layer.iter_geojson_data(shapefile_path, simplify=simplify, max_features=max_features, zoom=zoom,
+                                         fields=fields, where=where)
+    return sum(len(block) for block in layer_cache.stream(cache_key, chunks))
+
+
+def warm_layer(layer, zooms, force=False, shapefile_path=None):
+    """
+    Render a shapefile layer into the file cache at the map.js presets of some zoom levels
+
+    Args:
+        layer: Shapefile MapLayer instance
+        zooms: Zoom levels to render
+        force: Render even when the cache file exists
+        shapefile_path: Path to the .shp file (looked up from the layer when None)
+
+    Returns:
+        list: One dict per zoom level with zoom, status ('warmed', 'cached' or
+              'failed'), seconds and bytes
+    """
+    shapefile_path = shapefile_path or layer.get_local_shapefile()
+    if not shapefile_path:
+        raise ValueError(f"Layer {layer.id} has no shapefile")
+
+    version = layer.get_content_version()
+    results = []
+    for zoom in zooms:
+        simplify, max_features = get_map_preset(zoom)
+        # The endpoint keys on the query string values: simplify and zoom as sent, max_features parsed
+        cache_key = get_cache_key(layer.id, version, simplify, max_features, str(zoom))
+        if not force and layer_cache.file.contains(cache_key):
+            results.append({'zoom': zoom, 'status': 'cached', 'seconds': 0.0, 'bytes': None})
+            continue
+
+        started = time.monotonic()
+        try:
+            # A request converting the same entry right now is waited for, not duplicated
+            with KeyLock(cache_key) as flight:
+                if flight.waited and not force and layer_cache.file.contains(cache_key):
+                    results.append({'zoom': zoom, 'status': 'cached', 'seconds': 0.0, 'bytes': None})
+                    continue
+                size = render_layer(layer, cache_key, simplify, max_features, zoom, shapefile_path=shapefile_path)
+            results.append({'zoom': zoom, 'status': 'warmed', 'seconds': round(time.monotonic() - started, 3),
+                            'bytes': size})
+        except Exception as e:
+            logger.exception(f"Error warming layer {layer.id} at zoom {zoom}: {str(e)}")
+            results.append({'zoom': zoom, 'status': 'failed', 'seconds': round(time.monotonic() - started, 3),
+                            'bytes': 0, 'error': str(e)})
+
+    warmed = sum(1 for result in results if result['status'] == 'warmed')
+    logger.info(f"Warmed {warmed} of {len(results)} zoom levels of layer {layer.id}")
+    return results
+
+
+def warm_layers(layers, zooms=None, force=False, workers=None):
+    """
+    Warm several shapefile layers, in parallel across a process pool
+
+    Args:
+        layers: Shapefile MapLayer instances
+        zooms: Zoom levels to render (see get_warm_zooms when None)
+        force: Render even when the cache files exist
+        workers: Number of worker processes (all CPUs when None, 1 to stay in process)
+
+    Yields:
+        tuple: (layer, results or None, error or None), in the order of the layers
+    """
+    zooms = zooms or get_warm_zooms()
+    # Shapefiles are resolved here, so OneDrive downloads and database access stay in this process
+    jobs = []
+    for layer in layers:
+        try:
+            jobs.append((layer, layer.get_local_shapefile(), None))
+        except Exception as e:
+            jobs.append((layer, None, str(e)))
+
+    workers = min(workers or os.cpu_count() or 1, max(1, len(jobs)))
+    logger.info(f"Warming {len(jobs)} layers at zoom levels {zooms} with {workers} workers")
+
+    if workers <= 1:
+        for layer, shapefile_path, error in jobs:
+            if not shapefile_path:
+                yield layer, None, error or "No shapefile available"
+                continue
+            yield layer, warm_layer(layer, zooms, force, shapefile_path), None
+        return
+
+    # Workers start from a fork server with their own Django setup, nothing is inherited from this process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_pool_context(), initializer=setup_pool_worker) as pool:
+        futures = [pool.submit(warm_layer, layer, zooms, force, shapefile_path) if shapefile_path else None
+                   for layer, shapefile_path, _ in jobs]
+        for (layer, _, error), future in zip(jobs, futures):
+            if future is None:
+                yield layer, None, error or "No shapefile available"
+                continue
+            try:
+                yield layer, future.result(), None
+            except Exception as e:
+                yield layer, None, str(e)
@@ -6,25 +6,49 @@ allow the system to handle very large shapefiles and many map layers efficiently
 """
 import os
 import io
+import re
 import json
+import zlib
+import struct
 import logging
 import hashlib
 import time
 import threading
 import multiprocessing
 import zipfile
+from collections import OrderedDict, namedtuple
 from functools import lru_cache
 from pathlib import Path
-from django.core.cache import cache
 from django.conf import settings
 
+from maps.shared_cache import SQLiteStore
+
+try:
+    import brotli
+except ImportError:  # Brotli variants are only written when the package is installed
+    brotli = None
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
 # Cache configuration
-MEMORY_CACHE_SIZE_LIMIT = 1024 * 1024 * 10  # 10MB max size for memory cache
+MEMORY_CACHE_SIZE_LIMIT = 1024 * 1024  # 1MB max size of a memory cache entry, larger ones are shared
+MEMORY_CACHE_BUDGET = 1024 * 1024 * 64  # Total bytes of the memory cache, per process
+SHARED_CACHE_SIZE_LIMIT = 1024 * 1024 * 32  # 32MB max size of a shared cache entry
+SHARED_CACHE_BUDGET = 1024 * 1024 * 512  # Total bytes of the shared cache, for all processes
+SHARED_CACHE_NAME = 'shared.sqlite3'  # Database of the shared cache, in FILE_CACHE_DIR
+FILE_CACHE_BUDGET = 1024 * 1024 * 1024 * 10  # Total bytes of the file cache
 FILE_CACHE_DIR = os.path.join('media', 'cache', 'shapefiles')
 FILE_CACHE_EXPIRY = 60 * 60 * 24 * 7  # 7 days
+CACHE_STALE_WINDOW = 60 * 60 * 24 * 7  # Seconds past their expiry entries are still served while being rebuilt
+FILE_CACHE_SWEEP_INTERVAL = 60 * 10  # Seconds between background sweeps of the file cache
+FILE_CACHE_SWEEP_TARGET = 0.9  # Sweeps evict down to this share of the budget, leaving room for new entries
+TEMP_FILE_MAX_AGE = 60 * 60  # Unfinished cache writes older than this are left over from crashes
+STREAMING_SIZE_THRESHOLD = 1024 * 1024 * 20  # Stream layers whose .shp is larger than 20MB
+STREAM_WRITE_BUFFER = 1024 * 64  # Bytes collected before each streamed write
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 6
+COMPRESSED_SUFFIXES = {'br': '.br', 'gzip': '.gz'}  # In order of preference
 MEMORY_CACHE_EXPIRY = {
     # Different expiry times based on zoom levels (in seconds)
     'far': 60 * 60 * 24,     # 24 hours for far zoom levels (< 8)
@@ -60,10 +84,40 @@ def get_cache_expiry(zoom_level):
     return MEMORY_CACHE_EXPIRY.get(category, MEMORY_CACHE_EXPIRY['default'])
 
 
-def get_cache_key(layer_id, simplify, max_features, zoom=None):
-    """Generate a cache key for layer data with specific parameters."""
+def get_cache_key(layer_id, version, simplify, max_features, zoom=None, fields=None, where=None):
+    """
+    Generate a cache key for layer data with specific parameters
+    
+    The layer id and content version stay readable in the key, so a new
+    version never reads the entries of the previous one, and entries can be
+    accounted and removed per layer and version without an index.
+    """
     params = f"{layer_id}:{simplify}:{max_features}:{zoom}"
-    return f"shapefile_data_{hashlib.md5(params.encode()).hexdigest()}"
+    if fields:
+        params += f":{','.join(fields)}"
+    if where:
+        params += f":where={where}"
+    return f"shapefile_data_{layer_id}_{version}_{hashlib.md5(params.encode()).hexdigest()}"
+
+
+def get_tile_cache_key(layer_id, version, z, x, y):
+    """Generate a cache key for a vector tile of a layer."""
+    return f"mvt_{layer_id}_{version}_{z}_{x}_{y}"
+
+
+# Keys derived from get_cache_key (TopoJSON, Geobuf and chunk keys wrap it) or get_tile_cache_key
+CACHE_KEY_LAYER_RE = re.compile(r'(?:^|_)(?:shapefile_data|mvt)_(\d+)_([0-9a-f]+)_')
+
+
+def parse_cache_key(cache_key):
+    """
+    Get the layer a cache key belongs to
+    
+    Returns:
+        tuple: (layer id, content version), or (None, None) for keys of no layer
+    """
+    match = CACHE_KEY_LAYER_RE.search(cache_key)
+    return (int(match.group(1)), match.group(2)) if match else (None, None)
 
 
 def get_file_cache_path(cache_key):
@@ -71,134 +125,877 @@ def get_file_cache_path(cache_key):
     return os.path.join(FILE_CACHE_DIR, f"{cache_key}.geojson")
 
 
-def is_in_memory_cache(cache_key):
-    """Check if a key is in the memory cache."""
-    return cache.get(cache_key) is not None
+def get_compressed_cache_path(cache_key, encoding):
+    """Get the path to the precompressed variant of a file cache entry."""
+    return get_file_cache_path(cache_key) + COMPRESSED_SUFFIXES[encoding]
 
 
-def is_in_file_cache(cache_key):
-    """Check if a key is in the file cache."""
-    cache_file = get_file_cache_path(cache_key)
-    if os.path.exists(cache_file):
-        # Check if file is not too old
-        file_age = time.time() - os.path.getmtime(cache_file)
-        if file_age < FILE_CACHE_EXPIRY:
-            return True
-        else:
-            # File exists but is expired, remove it
-            try:
-                os.remove(cache_file)
-            except OSError:
-                logger.error(f"Failed to remove expired cache file: {cache_file}")
-    return False
+def get_available_encodings():
+    """Get the content encodings cache entries are compressed with."""
+    return [encoding for encoding in COMPRESSED_SUFFIXES if encoding != 'br' or brotli is not None]
+
 
+def get_accepted_encodings(accept_encoding):
+    """
+    Get the available content encodings a client accepts, in order of preference
+    
+    Args:
+        accept_encoding: Value of the Accept-Encoding request header
+        
+    Returns:
+        list: Encodings such as ['br', 'gzip']
+    """
+    accepted = set()
+    for coding in (accept_encoding or '').split(','):
+        name, _, params = coding.strip().partition(';')
+        if 'q=0' in params.replace(' ', '').split(';'):
+            continue
+        accepted.add(name.strip().lower())
+    return [encoding for encoding in get_available_encodings() if encoding in accepted]
 
-def get_from_memory_cache(cache_key):
-    """Get data from memory cache."""
-    return cache.get(cache_key)
 
+def _compressor(encoding):
+    """Get an object compressing a stream with a content encoding."""
+    if encoding == 'br':
+        return brotli.Compressor(quality=BROTLI_QUALITY)
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31 writes the gzip container
 
-def get_from_file_cache(cache_key):
-    """Get data from file cache."""
-    cache_file = get_file_cache_path(cache_key)
-    if os.path.exists(cache_file):
+
+def compress_data(data, encoding):
+    """Compress bytes with a content encoding ('gzip' or 'br')."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    compressor = _compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+class _CacheFileWriter:
+    """
+    Writes a file cache entry, optionally compressed, to a temporary file
+    that replaces the entry on commit.
+    """
+    
+    def __init__(self, path, encoding=None):
+        self.path = path
+        self.temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self.encoding = encoding
+        self.compressor = _compressor(encoding) if encoding else None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(self.temp_path, 'wb')
+    
+    def write(self, data):
+        if self.encoding == 'br':
+            data = self.compressor.process(data)
+        elif self.encoding:
+            data = self.compressor.compress(data)
+        self.file.write(data)
+    
+    def commit(self):
+        if self.encoding == 'br':
+            self.file.write(self.compressor.finish())
+        elif self.encoding:
+            self.file.write(self.compressor.flush())
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+    
+    def discard(self):
+        self.file.close()
         try:
-            with open(cache_file, 'r') as f:
-                return f.read()
-        except Exception as e:
-            logger.error(f"Error reading cache file {cache_file}: {e}")
-    return None
+            os.remove(self.temp_path)
+        except OSError:
+            pass
 
 
-def save_to_memory_cache(cache_key, data, expiry):
-    """Save data to memory cache."""
-    cache.set(cache_key, data, expiry)
+def _open_cache_writers(cache_key, compress=True):
+    """Open writers for a file cache entry and, with compress, each of its compressed variants."""
+    writers = []
+    targets = [(get_file_cache_path(cache_key), None)]
+    if compress:
+        targets += [(get_compressed_cache_path(cache_key, encoding), encoding)
+                    for encoding in get_available_encodings()]
+    for path, encoding in targets:
+        try:
+            writers.append(_CacheFileWriter(path, encoding))
+        except OSError as e:
+            logger.error(f"Error opening cache file {path}: {e}")
+    return writers
+
+
+CacheEntry = namedtuple('CacheEntry', ['tier', 'encoding', 'data', 'file', 'stale'], defaults=(False,))
+CacheEntry.__doc__ = """
+A cache hit: tier is 'memory', 'shared' or 'file', encoding the content
+encoding of the variant (None for plain data), either data (bytes, memory and
+shared tiers) or file (binary file opened on the entry, file tier; the caller
+closes it), and stale whether the entry is past its expiry (see TieredCache.get).
+"""
 
 
-def save_to_file_cache(cache_key, data):
-    """Save data to file cache."""
-    cache_file = get_file_cache_path(cache_key)
+def _pack_variants(variants):
+    """
+    Serialize the variants of an entry for the shared tier
+    
+    A JSON header listing each (encoding, size), prefixed by its length, is
+    followed by the variants' bytes, so reading an entry never runs code.
+    """
+    header = json.dumps([[encoding, len(data)] for encoding, data in variants.items()]).encode()
+    return b''.join([struct.pack('>I', len(header)), header, *variants.values()])
+
+
+def _unpack_variants(blob):
+    """Get the variants of an entry serialized by _pack_variants; raises ValueError if it is malformed."""
+    view = memoryview(blob)
     try:
-        with open(cache_file, 'w') as f:
-            f.write(data)
-        return True
-    except Exception as e:
-        logger.error(f"Error writing to cache file {cache_file}: {e}")
-        return False
+        (header_size,) = struct.unpack_from('>I', view)
+        offset = 4 + header_size
+        variants = {}
+        for encoding, size in json.loads(bytes(view[4:offset])):
+            variants[encoding] = bytes(view[offset:offset + size])
+            offset += size
+    except (struct.error, TypeError) as e:
+        raise ValueError(f"Malformed cache entry: {e}")
+    if offset != len(view) or None not in variants:
+        raise ValueError("Malformed cache entry")
+    return variants
+
+
+def _pick_variant(variants, encodings):
+    """Get the (encoding, data) of the best accepted variant of an entry, the plain data by default."""
+    for encoding in encodings:
+        if encoding in variants:
+            return encoding, variants[encoding]
+    return None, variants[None]
+
+
+class _MemoryTier:
+    """Size-aware LRU of cache entries held in this process, within a byte budget."""
+    
+    def __init__(self, budget, max_entry_size, stale_window=0):
+        self.budget = budget
+        self.max_entry_size = max_entry_size
+        self.stale_window = stale_window
+        self._entries = OrderedDict()  # key -> (variants by encoding, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+    
+    def get(self, key, encodings=(), stale=False):
+        with self._lock:
+            entry = self._entries.get(key)
+            expired = entry is not None and entry[2] is not None and entry[2] <= time.monotonic()
+            if expired and entry[2] + self.stale_window <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None or (expired and not stale):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return _pick_variant(entry[0], encodings) + (expired,)
+    
+    def contains(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[2] is None or entry[2] > time.monotonic())
+    
+    def fits(self, size):
+        return size <= min(self.max_entry_size, self.budget)
+    
+    def set(self, key, variants, timeout=None):
+        size = sum(len(data) for data in variants.values())
+        with self._lock:
+            self._remove(key)
+            if not self.fits(size):
+                return False
+            while self._bytes + size > self.budget:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            expires_at = time.monotonic() + timeout if timeout else None
+            self._entries[key] = (variants, size, expires_at)
+            self._bytes += size
+            return True
+    
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+    
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+    
+    def delete_matching(self, test):
+        with self._lock:
+            keys = [key for key in self._entries if test(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self._bytes, 'budget': self.budget}
+
+
+class _SharedTier:
+    """
+    Cache entries (each with its compressed variants) in a SQLiteStore shared
+    by all processes of the node, within a byte budget (see maps.shared_cache).
+    
+    The database lives in FILE_CACHE_DIR and follows it, like the file tier.
+    """
+    
+    def __init__(self, budget, max_entry_size, stale_window=0):
+        self.budget = budget
+        self.max_entry_size = max_entry_size
+        self.stale_window = stale_window
+        self._stores = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+    
+    def _store(self):
+        path = os.path.join(FILE_CACHE_DIR, SHARED_CACHE_NAME)
+        with self._lock:
+            if path not in self._stores:
+                self._stores[path] = SQLiteStore(path, self.budget)
+            return self._stores[path]
+    
+    def get(self, key, stale=False):
+        """Get the variants of an entry and whether it is past its expiry, or None on a miss."""
+        try:
+            entry = self._store().get_entry(key, self.stale_window if stale else 0)
+        except Exception as e:
+            logger.error(f"Error reading {key} from the shared cache: {e}")
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        blob, expires = entry
+        try:
+            variants = _unpack_variants(blob)
+        except ValueError as e:
+            logger.error(f"Error reading {key} from the shared cache: {e}")
+            return None
+        return variants, expires is not None and expires <= time.time()
+    
+    def fits(self, size):
+        return size <= min(self.max_entry_size, self.budget)
+    
+    def set(self, key, variants, timeout=None):
+        blob = _pack_variants(variants)
+        if not self.fits(len(blob)):
+            return False
+        store = self._store()
+        evictions = store.evictions
+        try:
+            stored = store.set(key, blob, time.time() + timeout if timeout else None)
+        except Exception as e:
+            logger.error(f"Error writing {key} to the shared cache: {e}")
+            return False
+        with self._lock:
+            self.evictions += store.evictions - evictions
+        return stored
+    
+    def contains(self, key):
+        return self._store().contains(key)
+    
+    def delete(self, key):
+        self._store().delete(key)
+    
+    def delete_matching(self, test):
+        return self._store().delete_matching(test)
+    
+    def sweep(self):
+        return self._store().sweep(self.stale_window)
+    
+    def clear(self):
+        self._store().clear()
+    
+    def stats(self):
+        usage = self._store().stats()
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': usage['entries'], 'bytes': usage['bytes'], 'budget': self.budget}
 
 
-def get_cached_layer_data(layer_id, simplify, max_features, zoom=None):
-    """Get layer data from cache if available."""
-    cache_key = get_cache_key(layer_id, simplify, max_features, zoom)
+class _FileTier:
+    """
+    Size-aware LRU of cache files (each entry with its compressed variants) in
+    FILE_CACHE_DIR, within a byte budget (the disk quota of the cache).
     
-    # Try memory cache first (fastest)
-    data = get_from_memory_cache(cache_key)
-    if data:
-        logger.info(f"Memory cache hit for layer {layer_id}")
-        return data, 'memory'
+    Recency is the access time of an entry's plain file, which hits set
+    explicitly (noatime and relatime mounts don't record reads), so every
+    process sees the same order; the modification time stays the write time
+    that expiry is measured from. The index of entries is built from a scan of
+    the directory the first time it is needed and kept up to date with this
+    process's reads and writes; sweeps rescan it, dropping expired entries,
+    leftover temporary files and, over the budget, the least recently used ones.
+    """
     
-    # Try file cache next
-    data = get_from_file_cache(cache_key)
-    if data:
-        logger.info(f"File cache hit for layer {layer_id}")
+    def __init__(self, budget, expiry=FILE_CACHE_EXPIRY, sweep_interval=None, stale_window=0):
+        self.budget = budget
+        self.expiry = expiry
+        self.stale_window = stale_window
+        self.sweep_interval = sweep_interval
+        self._entries = OrderedDict()  # key -> size of the entry's files, least recently used first
+        self._bytes = 0
+        self._directory = None
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self.hits = self.misses = self.evictions = 0
+    
+    def scan(self):
+        """
+        Read the entries in FILE_CACHE_DIR from the disk
+        
+        Returns:
+            tuple: ({key: (bytes, last used, written or None when the plain file is missing)},
+                    [(path, modified) of temporary files])
+        """
+        entries = {}
+        temp_files = []
+        try:
+            scan = list(os.scandir(FILE_CACHE_DIR))
+        except OSError:
+            scan = []
+        for item in scan:
+            try:
+                stat = item.stat()
+            except OSError:
+                continue
+            if item.name.endswith('.tmp'):
+                temp_files.append((item.path, stat.st_mtime))
+                continue
+            key, suffix, variant = item.name.partition('.geojson')
+            if not suffix:
+                continue
+            size, last_used, written = entries.get(key, (0, 0, None))
+            if not variant:
+                written = stat.st_mtime
+            entries[key] = (size + stat.st_size, max(last_used, stat.st_atime), written)
+        return entries, temp_files
+    
+    def _load(self, force=False):
+        # The index follows FILE_CACHE_DIR, which tests point elsewhere
+        if self._directory == FILE_CACHE_DIR and not force:
+            return None
+        entries, temp_files = self.scan()
+        ordered = sorted(entries.items(), key=lambda entry: entry[1][1])
+        self._entries = OrderedDict((key, size) for key, (size, _, _) in ordered)
+        self._bytes = sum(self._entries.values())
+        self._directory = FILE_CACHE_DIR
+        return entries, temp_files
+    
+    def _paths(self, key):
+        cache_file = get_file_cache_path(key)
+        return [cache_file] + [cache_file + suffix for suffix in COMPRESSED_SUFFIXES.values()]
+    
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key, 0)
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Failed to remove cache file {path}: {e}")
+    
+    def _touch(self, cache_file, modified):
+        # Record the access for the LRU order shared by all processes, keeping the write time
+        try:
+            os.utime(cache_file, (time.time(), modified))
+        except OSError:
+            pass
+    
+    def open(self, key, encodings=(), stale=False):
+        """Open the best accepted variant of an entry: (encoding, file, whether it is past its expiry), or None."""
+        with self._lock:
+            self._load()
+            cache_file = get_file_cache_path(key)
+            try:
+                modified = os.path.getmtime(cache_file)
+                age = time.time() - modified
+                if age >= self.expiry + self.stale_window:
+                    self._remove(key)
+                    raise FileNotFoundError(cache_file)
+                if age >= self.expiry and not stale:
+                    # Kept for the callers serving stale entries until the sweeps remove it
+                    self.misses += 1
+                    return None
+                for encoding in encodings:
+                    try:
+                        file = open(get_compressed_cache_path(key, encoding), 'rb')
+                        break
+                    except FileNotFoundError:
+                        continue
+                else:
+                    encoding, file = None, open(cache_file, 'rb')
+            except FileNotFoundError:
+                self._bytes -= self._entries.pop(key, 0)
+                self.misses += 1
+                return None
+            self._touch(cache_file, modified)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                # Written by another process since the scan
+                self._entries[key] = sum(os.path.getsize(path) for path in self._paths(key) if os.path.exists(path))
+                self._bytes += self._entries[key]
+            self.hits += 1
+            return encoding, file, age >= self.expiry
+    
+    def contains(self, key):
+        cache_file = get_file_cache_path(key)
+        return os.path.exists(cache_file) and time.time() - os.path.getmtime(cache_file) < self.expiry
+    
+    def added(self, key):
+        """Account for an entry just written, evicting the least recently used ones over the budget."""
+        self.start_sweeper()
+        size = sum(os.path.getsize(path) for path in self._paths(key) if os.path.exists(path))
+        with self._lock:
+            self._load()
+            self._bytes -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._bytes += size
+            while self._bytes > self.budget and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+                logger.info(f"Evicted {oldest} from the file cache")
+            if self._bytes > self.budget:
+                # A single entry larger than the whole budget isn't kept
+                self._remove(key)
+                self.evictions += 1
+                return False
+            return True
+    
+    def sweep(self, target=None):
+        """
+        Rescan the cache directory and remove expired entries, compressed
+        variants without their plain file, leftover temporary files and, over
+        the target size, the least recently used entries
         
-        # Put in memory cache for faster access next time
-        expiry = get_cache_expiry(zoom)
-        save_to_memory_cache(cache_key, data, expiry)
+        Args:
+            target: Bytes to evict down to (FILE_CACHE_SWEEP_TARGET of the budget when None)
+            
+        Returns:
+            dict: Numbers of expired, orphaned, evicted entries and temp_files removed,
+                  bytes freed, and the entries and bytes left
+        """
+        target = self.budget * FILE_CACHE_SWEEP_TARGET if target is None else target
+        removed = {'expired': 0, 'orphaned': 0, 'evicted': 0, 'temp_files': 0}
+        with self._lock:
+            entries, temp_files = self._load(force=True)
+            before = self._bytes
+            now = time.time()
+            for path, modified in temp_files:
+                if now - modified >= TEMP_FILE_MAX_AGE:
+                    try:
+                        before += os.path.getsize(path)
+                        os.remove(path)
+                        removed['temp_files'] += 1
+                    except OSError:
+                        pass
+            for key, (_, _, written) in entries.items():
+                if written is None:
+                    self._remove(key)
+                    removed['orphaned'] += 1
+                elif now - written >= self.expiry + self.stale_window:
+                    self._remove(key)
+                    removed['expired'] += 1
+            while self._bytes > target and self._entries:
+                self._remove(next(iter(self._entries)))
+                removed['evicted'] += 1
+            self.evictions += removed['evicted']
+            result = dict(removed, bytes_freed=before - self._bytes, entries=len(self._entries), bytes=self._bytes)
         
-        return data, 'file'
+        if any(removed.values()):
+            logger.info(f"Swept the file cache: {removed['expired']} expired, {removed['orphaned']} orphaned and "
+                        f"{removed['evicted']} evicted entries, {removed['temp_files']} temporary files, "
+                        f"{result['bytes_freed'] / (1024*1024):.2f} MB freed")
+        return result
     
-    # Not in any cache
-    return None, None
+    def _sweep_periodically(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.exception(f"Error sweeping the file cache: {str(e)}")
+    
+    def start_sweeper(self):
+        """Start the thread sweeping every sweep_interval seconds, once per process (forked children restart it)."""
+        if not self.sweep_interval:
+            return
+        with self._lock:
+            if self._sweeper is None or not self._sweeper.is_alive():
+                self._sweeper = threading.Thread(target=self._sweep_periodically, name='file-cache-sweeper',
+                                                 daemon=True)
+                self._sweeper.start()
+                logger.info(f"Sweeping the file cache every {self.sweep_interval}s")
+    
+    def delete(self, key):
+        with self._lock:
+            self._load()
+            self._remove(key)
+    
+    def delete_matching(self, test):
+        # Rescanned, so entries written by other processes are included
+        with self._lock:
+            self._load(force=True)
+            keys = [key for key in self._entries if test(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+    
+    def clear(self):
+        with self._lock:
+            self._load()
+            for key in list(self._entries):
+                self._remove(key)
+    
+    def stats(self):
+        with self._lock:
+            self._load()
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self._bytes, 'budget': self.budget}
 
 
-def cache_layer_data(layer_id, data, simplify, max_features, zoom=None):
-    """Cache layer data in appropriate caches based on size."""
-    cache_key = get_cache_key(layer_id, simplify, max_features, zoom)
-    data_size = len(data)
+class TieredCache:
+    """
+    Three-tier cache of layer responses: a small in-process memory tier in
+    front of two tiers shared by all processes of the node, a SQLite store for
+    derived responses and a file tier, each with its own byte budget and
+    size-aware LRU eviction.
     
-    # Log caching operation
-    logger.info(f"Caching {data_size / (1024*1024):.2f} MB of data for layer {layer_id}")
+    Data is written to the file tier, or with persist=False (TopoJSON, Geobuf,
+    tiles) to the shared store, and also kept in memory when it is no larger
+    than the memory tier's entry limit, so each worker only holds its own copy
+    of small entries. Entries can carry precompressed variants (gzip, and
+    brotli when available), served as they are to clients that accept them.
+    """
     
-    # Always cache in file for persistence
-    file_cached = save_to_file_cache(cache_key, data)
+    def __init__(self, memory_budget=MEMORY_CACHE_BUDGET, memory_max_entry_size=MEMORY_CACHE_SIZE_LIMIT,
+                 shared_budget=SHARED_CACHE_BUDGET, shared_max_entry_size=SHARED_CACHE_SIZE_LIMIT,
+                 file_budget=FILE_CACHE_BUDGET, file_expiry=FILE_CACHE_EXPIRY, sweep_interval=None,
+                 stale_window=CACHE_STALE_WINDOW):
+        self.memory = _MemoryTier(memory_budget, memory_max_entry_size, stale_window)
+        self.shared = _SharedTier(shared_budget, shared_max_entry_size, stale_window)
+        self.file = _FileTier(file_budget, file_expiry, sweep_interval, stale_window)
+    
+    def get(self, key, encodings=(), stale=False):
+        """
+        Look up an entry, memory tier first, then the shared store and the files
+        
+        Expired entries are kept for stale_window seconds. With stale=True, one
+        of them is returned (flagged stale) when no tier holds a fresh copy, so
+        the caller can serve it right away and rebuild it in the background.
+        
+        Args:
+            key: Cache key
+            encodings: Accepted content encodings, in order of preference
+            stale: Return an expired entry rather than missing
+            
+        Returns:
+            CacheEntry: The hit in the best accepted encoding, or None on a miss
+        """
+        fallback = None
+        hit = self.memory.get(key, encodings, stale)
+        if hit is not None:
+            fallback = CacheEntry('memory', hit[0], hit[1], None, hit[2])
+            if not fallback.stale:
+                return fallback
+        hit = self.shared.get(key, stale)
+        if hit is not None:
+            encoding, data = _pick_variant(hit[0], encodings)
+            entry = CacheEntry('shared', encoding, data, None, hit[1])
+            if not entry.stale:
+                if fallback is not None:
+                    self.memory.delete(key)
+                return entry
+            fallback = fallback or entry
+        hit = self.file.open(key, encodings, stale)
+        if hit is not None:
+            entry = CacheEntry('file', hit[0], None, hit[1], hit[2])
+            if not entry.stale:
+                if fallback is not None:
+                    # Memory entries expire sooner than the files, which replace them
+                    self.memory.delete(key)
+                return entry
+            if fallback is None:
+                return entry
+            entry.file.close()
+        return fallback
     
-    # Only cache in memory if not too large
-    if data_size <= MEMORY_CACHE_SIZE_LIMIT:
-        expiry = get_cache_expiry(zoom)
-        save_to_memory_cache(cache_key, data, expiry)
-        if file_cached:
-            logger.info(f"Layer {layer_id} cached in both memory and file")
-            return 'both'
+    def get_text(self, key, timeout=None):
+        """
+        Get the plain text of an entry, promoting file hits to the memory tier
+        
+        Returns:
+            str: The cached text, or None on a miss
+        """
+        entry = self.get(key)
+        if entry is None:
+            return None
+        if entry.tier != 'file':
+            data = entry.data
         else:
-            logger.info(f"Layer {layer_id} cached in memory only")
-            return 'memory'
-    else:
-        logger.info(f"Layer {layer_id} cached in file only (too large for memory)")
-        return 'file' if file_cached else None
-
-
-def clear_layer_cache(layer_id=None):
-    """Clear cache for a specific layer or all layers."""
-    # Clear memory cache for the layer
-    if layer_id:
-        pattern = f"shapefile_data_{layer_id}_*"
-        # Django cache doesn't support pattern deletion natively, so we'd need
-        # a different cache backend or another approach for this
-        logger.info(f"Memory cache pattern clearing not supported - layer {layer_id}")
-        
-        # Clear file cache for the layer
-        for file in os.listdir(FILE_CACHE_DIR):
-            if file.startswith(f"shapefile_data_{layer_id}_"):
-                os.remove(os.path.join(FILE_CACHE_DIR, file))
-        logger.info(f"File cache cleared for layer {layer_id}")
-    else:
-        # Clear all shapefile data from memory cache
-        # This is a simplification - in production we'd need a more targeted approach
-        logger.info("Full memory cache clearing not supported")
-        
-        # Clear all file cache
-        for file in os.listdir(FILE_CACHE_DIR):
-            if file.startswith("shapefile_data_"):
-                os.remove(os.path.join(FILE_CACHE_DIR, file))
-        logger.info("All file cache cleared")
\ No newline at end of file
+            with entry.file:
+                data = entry.file.read()
+            if self.memory.fits(len(data)):
+                self.memory.set(key, {None: data}, timeout)
+        return data.decode('utf-8') if isinstance(data, bytes) else data
+    
+    def contains(self, key):
+        """Check whether a key is cached in any tier, without counting a hit or miss."""
+        return self.memory.contains(key) or self.shared.contains(key) or self.file.contains(key)
+    
+    def set(self, key, data, timeout=None, encodings=(), compress=True, persist=True):
+        """
+        Cache data in the memory tier when it fits, and in the file tier or the shared store
+        
+        Args:
+            key: Cache key
+            data: str or bytes
+            timeout: Seconds the entry stays fresh in the memory tier and the shared store (files expire
+                     after FILE_CACHE_EXPIRY), then it is stale for stale_window seconds
+            encodings: Accepted content encodings of the entry to return, in order of preference
+            compress: Also store the precompressed variants
+            persist: Write the file tier, otherwise the shared store
+            
+        Returns:
+            CacheEntry: The stored entry in the best of encodings, or None if it wasn't stored
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        
+        stored = None
+        variants = None
+        if self.memory.fits(len(data)) or (not persist and self.shared.fits(len(data))):
+            variants = {None: data}
+            if compress:
+                variants.update((encoding, compress_data(data, encoding)) for encoding in get_available_encodings())
+            if self.memory.fits(len(data)) and self.memory.set(key, variants, timeout):
+                encoding, blob = _pick_variant(variants, encodings)
+                stored = CacheEntry('memory', encoding, blob, None)
+        
+        if not persist:
+            if variants is not None and self.shared.set(key, variants, timeout) and stored is None:
+                encoding, blob = _pick_variant(variants, encodings)
+                stored = CacheEntry('shared', encoding, blob, None)
+        else:
+            writers = []
+            try:
+                if variants is None:
+                    writers = [(writer, data) for writer in _open_cache_writers(key, compress)]
+                else:
+                    # The variants compressed for the memory tier are written as they are
+                    for encoding, blob in variants.items():
+                        path = get_compressed_cache_path(key, encoding) if encoding else get_file_cache_path(key)
+                        writers.append((_CacheFileWriter(path), blob))
+                for writer, blob in writers:
+                    writer.write(blob)
+                for writer, _ in writers:
+                    writer.commit()
+            except Exception as e:
+                logger.error(f"Error writing to cache file {get_file_cache_path(key)}: {e}")
+                for writer, _ in writers:
+                    writer.discard()
+            else:
+                if self.file.added(key) and stored is None:
+                    hit = self.file.open(key, encodings)
+                    if hit is not None:
+                        # Not a lookup, so it doesn't count as a hit
+                        self.file.hits -= 1
+                        stored = CacheEntry('file', hit[0], None, hit[1])
+        
+        logger.info(f"Cached {len(data) / (1024*1024):.2f} MB under {key} in "
+                    f"{stored.tier if stored else 'no'} tier")
+        return stored
+    
+    def stream(self, key, chunks, compress=True):
+        """
+        Pass a stream of text pieces through while writing it to the file tier
+        
+        The pieces are written (plain and precompressed) to temporary files that
+        only replace the cache entry once the stream is complete, so an
+        interrupted or failed response never leaves a truncated entry behind.
+        
+        Args:
+            key: Cache key of the entry being written
+            chunks: Iterable of str pieces
+            compress: Also write the precompressed variants
+            
+        Yields:
+            bytes: The UTF-8 encoded pieces, buffered into blocks of about STREAM_WRITE_BUFFER
+        """
+        cache_file = get_file_cache_path(key)
+        writers = _open_cache_writers(key, compress)
+        
+        def write(block):
+            for writer in list(writers):
+                try:
+                    writer.write(block)
+                except OSError as e:
+                    logger.error(f"Error writing cache file {writer.path}: {e}")
+                    writer.discard()
+                    writers.remove(writer)
+        
+        completed = False
+        try:
+            buffer = []
+            buffered = 0
+            for chunk in chunks:
+                data = chunk.encode('utf-8')
+                buffer.append(data)
+                buffered += len(data)
+                if buffered >= STREAM_WRITE_BUFFER:
+                    block = b''.join(buffer)
+                    buffer, buffered = [], 0
+                    write(block)
+                    yield block
+            if buffer:
+                block = b''.join(buffer)
+                write(block)
+                yield block
+            completed = True
+        finally:
+            for writer in writers:
+                if completed:
+                    writer.commit()
+                else:
+                    writer.discard()
+            if completed and os.path.exists(cache_file):
+                self.file.added(key)
+                logger.info(f"Streamed {os.path.getsize(cache_file) / (1024*1024):.2f} MB to cache file: {cache_file}")
+    
+    def delete(self, key):
+        """Remove an entry from every tier."""
+        self.memory.delete(key)
+        self.shared.delete(key)
+        self.file.delete(key)
+    
+    def delete_matching(self, test):
+        """
+        Remove the entries of every tier whose key passes a test
+        
+        Args:
+            test: Function of a cache key returning True for the entries to remove
+            
+        Returns:
+            int: Number of shared and file entries removed
+        """
+        self.memory.delete_matching(test)
+        return self.shared.delete_matching(test) + self.file.delete_matching(test)
+    
+    def clear(self):
+        """Remove every entry from every tier."""
+        self.memory.clear()
+        self.shared.clear()
+        self.file.clear()
+    
+    def sweep(self, target=None):
+        """
+        Sweep the file tier (see _FileTier.sweep) and remove the expired
+        entries of the shared store; the memory tier evicts as it goes
+        """
+        swept = self.file.sweep(target)
+        swept['expired'] += self.shared.sweep()
+        return swept
+    
+    def stats(self):
+        """
+        Get the counters of each tier
+        
+        Returns:
+            dict: For 'memory', 'shared' and 'file': hits, misses, evictions, entries, bytes and budget
+        """
+        return {'memory': self.memory.stats(), 'shared': self.shared.stats(), 'file': self.file.stats()}
+    
+    def reset_stats(self):
+        """Reset the hit, miss and eviction counters of every tier."""
+        for tier in (self.memory, self.shared, self.file):
+            with tier._lock:
+                tier.hits = tier.misses = tier.evictions = 0
+
+
+# The cache shared by the layer endpoints of this process
+layer_cache = TieredCache(
+    memory_budget=getattr(settings, 'LAYER_CACHE_MEMORY_BYTES', MEMORY_CACHE_BUDGET),
+    memory_max_entry_size=getattr(settings, 'LAYER_CACHE_MEMORY_MAX_ENTRY_BYTES', MEMORY_CACHE_SIZE_LIMIT),
+    shared_budget=getattr(settings, 'LAYER_CACHE_SHARED_BYTES', SHARED_CACHE_BUDGET),
+    shared_max_entry_size=getattr(settings, 'LAYER_CACHE_SHARED_MAX_ENTRY_BYTES', SHARED_CACHE_SIZE_LIMIT),
+    file_budget=getattr(settings, 'LAYER_CACHE_FILE_BYTES', FILE_CACHE_BUDGET),
+    sweep_interval=getattr(settings, 'LAYER_CACHE_SWEEP_INTERVAL', FILE_CACHE_SWEEP_INTERVAL),
+    stale_window=getattr(settings, 'LAYER_CACHE_STALE_SECONDS', CACHE_STALE_WINDOW),
+)
+
+
+def get_file_cache_usage():
+    """
+    Get the disk footprint of the file cache per layer
+    
+    Returns:
+        dict: {layer id (None for entries of no layer): {'entries', 'bytes', 'versions', 'last_used', 'oldest'}},
+              versions mapping content versions to bytes, last_used being the
+              latest access and oldest the earliest write (timestamps)
+    """
+    entries, _ = layer_cache.file.scan()
+    usage = {}
+    for key, (size, last_used, written) in entries.items():
+        layer_id, version = parse_cache_key(key)
+        layer = usage.setdefault(layer_id, {'entries': 0, 'bytes': 0, 'versions': {}, 'last_used': 0, 'oldest': None})
+        layer['entries'] += 1
+        layer['bytes'] += size
+        layer['versions'][version] = layer['versions'].get(version, 0) + size
+        layer['last_used'] = max(layer['last_used'], last_used)
+        if written is not None:
+            layer['oldest'] = written if layer['oldest'] is None else min(layer['oldest'], written)
+    return usage
+
+
+def clear_layer_cache(layer_id=None, keep_version=None):
+    """
+    Clear the cached entries of a layer, or of all layers
+    
+    Args:
+        layer_id: Layer whose entries are removed (all entries when None)
+        keep_version: Content version of the layer whose entries are kept
+    """
+    if layer_id is None:
+        layer_cache.clear()
+        logger.info("All layer cache cleared")
+        return
+    
+    def test(key):
+        key_layer, version = parse_cache_key(key)
+        return key_layer == layer_id and version != keep_version
+    
+    removed = layer_cache.delete_matching(test)
+    logger.info(f"Cleared {removed} cache files of layer {layer_id}" +
+                (f", keeping version {keep_version}" if keep_version else ""))
+
+
+def remove_stale_entries(versions):
+    """
+    Remove the cached entries of deleted layers and of versions layers no longer have
+    
+    Args:
+        versions: Current content version of each existing layer, {layer id: version}
+        
+    Returns:
+        int: Number of file entries removed
+    """
+    def test(key):
+        layer_id, version = parse_cache_key(key)
+        return layer_id is not None and versions.get(layer_id) != version
+    
+    removed = layer_cache.delete_matching(test)
+    logger.info(f"Removed {removed} stale cache files")
+    return removed
@@ -11,10 +11,18 @@ import os
 import math
 import json
 import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import shapefile
 import numpy as np
 from django.conf import settings
-from maps.caching import get_cached_layer_data, cache_layer_data
+from maps.caching import get_cache_expiry, get_cache_key, layer_cache
+from maps.spatial_index import get_spatial_index
+from maps.attribute_index import select_records
+from maps.geometry_store import get_geometry_store
+from maps.simplification import resolve_tolerance, simplify_geometry
+from maps.utils import get_pool_context, setup_pool_worker
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -22,6 +30,13 @@ logger = logging.getLogger(__name__)
 # Constants for chunking
 MAX_FEATURES_PER_CHUNK = 5000
 MAX_CHUNKS = 20
+DEFAULT_CHUNK_WORKERS = 2  # Extraction processes per web process, bounded since every web worker has its pool
+CHUNK_MANIFEST_SUFFIX = '.chunks.json'
+CHUNK_CELLS_PER_SIDE = 4  # Viewports are served from a fixed grid of cells in each chunk, cached whole
+
+# Uncached chunks of a request are extracted in parallel by this pool
+_chunk_pool = None
+_chunk_pool_lock = threading.Lock()
 
 def chunk_shapefile(shapefile_path, max_features_per_chunk=MAX_FEATURES_PER_CHUNK):
     """
@@ -39,8 +54,10 @@ def chunk_shapefile(shapefile_path, max_features_per_chunk=MAX_FEATURES_PER_CHUN
     # Open the shapefile
     reader = shapefile.Reader(shapefile_path)
     
-    # Get total number of shapes
-    total_shapes = len(reader.shapes())
+    # Get total number of shapes (from the header, without reading any shape)
+    total_shapes = len(reader)
+    full_bbox = list(reader.bbox)
+    reader.close()
     logger.info(f"Total shapes in file: {total_shapes}")
     
     if total_shapes <= max_features_per_chunk:
@@ -48,15 +65,17 @@ def chunk_shapefile(shapefile_path, max_features_per_chunk=MAX_FEATURES_PER_CHUN
         logger.info("Shapefile small enough, no chunking needed")
         return [{
             'chunk_id': 'full',
-            'bbox': reader.bbox,
+            'bbox': full_bbox,
             'feature_count': total_shapes,
             'shapefile_path': shapefile_path
         }]
     
     # Get bounding box for the entire shapefile
-    full_bbox = reader.bbox
     x_min, y_min, x_max, y_max = full_bbox
     
+    # With a spatial index, exact per-chunk counts are cheap
+    index = get_spatial_index(shapefile_path)
+    
     # Calculate how many chunks we need in each dimension
     # We aim for roughly square chunks
     total_chunks_needed = math.ceil(total_shapes / max_features_per_chunk)
@@ -80,21 +99,85 @@ def chunk_shapefile(shapefile_path, max_features_per_chunk=MAX_FEATURES_PER_CHUN
             
             chunk_bbox = (chunk_x_min, chunk_y_min, chunk_x_max, chunk_y_max)
             
-            # Count features in this chunk (approximate approach)
-            # This is an estimate only - exact count would be too expensive
+            # Count features in this chunk (estimate unless the index is available)
             chunk_id = f"chunk_{i}_{j}"
             
-            chunks.append({
+            chunk = {
                 'chunk_id': chunk_id,
                 'bbox': chunk_bbox,
                 'estimated_feature_count': total_shapes // (chunks_per_side * chunks_per_side),
                 'shapefile_path': shapefile_path
-            })
+            }
+            if index is not None:
+                chunk['feature_count'] = int(len(index.query(chunk_bbox)))
+                if chunk['feature_count'] == 0:
+                    # Nothing to load here, leave the chunk out of the manifest
+                    continue
+            chunks.append(chunk)
     
     logger.info(f"Created {len(chunks)} geographic chunks")
     return chunks
 
-def extract_chunk_features(shapefile_path, bbox, max_features=None, simplify_factor=None):
+def get_chunk_manifest_path(shapefile_path):
+    """Get the path of the chunk manifest saved next to a shapefile."""
+    return os.path.splitext(shapefile_path)[0] + CHUNK_MANIFEST_SUFFIX
+
+def build_chunk_manifest(shapefile_path):
+    """
+    Chunk a shapefile and persist the chunk list next to it
+    
+    Args:
+        shapefile_path: Path to the source shapefile
+        
+    Returns:
+        list: List of dictionaries with chunk info
+    """
+    chunks = chunk_shapefile(shapefile_path)
+    manifest = {
+        'shapefile_mtime': os.path.getmtime(shapefile_path),
+        'chunks': chunks
+    }
+    
+    manifest_path = get_chunk_manifest_path(shapefile_path)
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, manifest_path)
+    
+    logger.info(f"Saved chunk manifest with {len(chunks)} chunks: {manifest_path}")
+    return chunks
+
+def get_chunk_manifest(shapefile_path):
+    """
+    Get the chunks of a shapefile from its persisted manifest
+    
+    The manifest is (re)built when missing or older than the shapefile, so the
+    shapefile is only scanned once instead of on every request.
+    
+    Args:
+        shapefile_path: Path to the source shapefile
+        
+    Returns:
+        list: List of dictionaries with chunk info
+    """
+    manifest_path = get_chunk_manifest_path(shapefile_path)
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('shapefile_mtime') == os.path.getmtime(shapefile_path):
+                chunks = manifest['chunks']
+                # The layer directory may have moved since the manifest was written
+                for chunk in chunks:
+                    chunk['shapefile_path'] = shapefile_path
+                return chunks
+            logger.info(f"Chunk manifest is stale, rebuilding: {manifest_path}")
+        except (ValueError, KeyError, OSError) as e:
+            logger.error(f"Error reading chunk manifest {manifest_path}: {e}")
+    
+    return build_chunk_manifest(shapefile_path)
+
+def extract_chunk_features(shapefile_path, bbox, max_features=None, simplify_factor=None, fields=None, where=None):
     """
     Extract features from a shapefile that are within a specific bounding box
     
@@ -102,10 +185,12 @@ def extract_chunk_features(shapefile_path, bbox, max_features=None, simplify_fac
         shapefile_path: Path to the shapefile
         bbox: Bounding box (x_min, y_min, x_max, y_max)
         max_features: Maximum number of features to extract
-        simplify_factor: Factor for simplification (0.0-1.0)
+        simplify_factor: Simplification tolerance in coordinate units
+        fields: Attribute names to include (all when None)
+        where: Attribute filter selecting the records to include (all when None)
         
     Returns:
-        dict: GeoJSON FeatureCollection
+        dict: GeoJSON FeatureCollection, each feature with its bbox
     """
     logger.info(f"Extracting features from {shapefile_path} within bbox {bbox}")
     
@@ -118,11 +203,30 @@ def extract_chunk_features(shapefile_path, bbox, max_features=None, simplify_fac
         "features": []
     }
     
-    # Get shapes, records, and fields
-    shapes = reader.shapes()
-    records = reader.records()
-    fields = reader.fields[1:]  # Skip the deletion flag field
-    field_names = [field[0] for field in fields]
+    # Geometries come from the memory-mapped store when the layer has one
+    store = get_geometry_store(shapefile_path)
+    
+    # Find candidate records through the spatial index so only they are read
+    index = get_spatial_index(shapefile_path)
+    if index is not None:
+        candidate_ids = index.query(bbox)
+    elif store is not None:
+        candidate_ids = store.query_bbox(bbox)
+    else:
+        candidate_ids = range(len(reader))
+    
+    # Keep the candidates passing the attribute filter, in their original order
+    if where:
+        candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+        candidate_ids = candidate_ids[np.isin(candidate_ids, select_records(shapefile_path, where))]
+    
+    # Over the limit, sample the candidates evenly across the bbox instead of keeping the first records
+    if max_features and (index is not None or store is not None) and len(candidate_ids) > max_features:
+        positions = np.linspace(0, len(candidate_ids) - 1, max_features).astype(np.int64)
+        candidate_ids = np.asarray(candidate_ids, dtype=np.int64)[positions]
+    
+    # Only the requested columns are decoded from the .dbf
+    field_names = [field[0] for field in reader.fields[1:] if fields is None or field[0] in fields]
     
     # Function to convert shapefile record to a property dict
     def record_to_properties(record):
@@ -132,90 +236,68 @@ def extract_chunk_features(shapefile_path, bbox, max_features=None, simplify_fac
                 properties[field_names[i]] = value
         return properties
     
-    # Function to check if a point is within the bbox
-    def point_in_bbox(point, bbox):
-        x, y = point
+    # Function to check if the bounding box of a shape overlaps the bbox
+    def shape_intersects_bbox(shape, bbox):
+        if hasattr(shape, 'bbox'):
+            s_x_min, s_y_min, s_x_max, s_y_max = shape.bbox
+        else:
+            # Point shapes have no bbox attribute
+            s_x_min, s_y_min = s_x_max, s_y_max = shape.points[0][:2]
         x_min, y_min, x_max, y_max = bbox
-        return x_min <= x <= x_max and y_min <= y <= y_max
-    
-    # Function to check if any point of a shape is within the bbox
-    def shape_intersects_bbox(shape_points, bbox):
-        return any(point_in_bbox(point, bbox) for point in shape_points)
+        return s_x_min <= x_max and s_x_max >= x_min and s_y_min <= y_max and s_y_max >= y_min
     
     # Process shapes
     feature_count = 0
-    for i, shape in enumerate(shapes):
+    for i in candidate_ids:
         # Skip if we've reached our limit
         if max_features and feature_count >= max_features:
             break
         
-        # Skip null shapes
-        if not shape.points:
-            continue
-        
-        # Check if shape intersects with the bbox
-        if not shape_intersects_bbox(shape.points, bbox):
-            continue
-        
-        # Apply simplification if needed
-        shape_points = shape.points
-        if simplify_factor and simplify_factor > 0:
-            # Simple simplification algorithm (similar to Douglas-Peucker)
-            if len(shape_points) > 10:
-                # Calculate number of points to keep based on simplification factor
-                keep_count = max(3, int(len(shape_points) * (1 - simplify_factor)))
-                
-                # Keep key points (start, end, and evenly distributed points)
-                simplified_points = [shape_points[0]]
-                if keep_count < len(shape_points):
-                    step = len(shape_points) / keep_count
-                    for j in range(1, keep_count - 1):
-                        idx = min(int(j * step), len(shape_points) - 1)
-                        simplified_points.append(shape_points[idx])
-                else:
-                    simplified_points = shape_points
-                
-                # Add last point
-                if len(shape_points) > 1:
-                    simplified_points.append(shape_points[-1])
-                
-                shape_points = simplified_points
+        i = int(i)
+        if store is not None:
+            # Slices of the memory-mapped arrays, simplified while they are assembled
+            geometry = store.geometry(i, simplify_factor if simplify_factor and simplify_factor > 0 else None)
+            if geometry is None:
+                continue
+            feature_bbox = [float(value) for value in store.bboxes[i]]
+        else:
+            shape = reader.shape(i)
+            
+            # Skip null shapes
+            if not shape.points:
+                continue
+            
+            # The index already guarantees overlap, only check when scanning
+            if index is None and not shape_intersects_bbox(shape, bbox):
+                continue
+            
+            if hasattr(shape, 'bbox'):
+                feature_bbox = list(shape.bbox)
+            else:
+                feature_bbox = list(shape.points[0][:2]) * 2
+            
+            # Build the geometry (pyshp sorts the rings into Polygon/MultiPolygon parts)
+            try:
+                geometry = shape.__geo_interface__
+            except Exception as e:
+                logger.error(f"Error reading geometry of feature {i}: {e}")
+                continue
+            
+            # Apply tolerance-based simplification to every ring and part
+            if simplify_factor and simplify_factor > 0:
+                geometry = simplify_geometry(geometry, simplify_factor)
+                if geometry is None:
+                    continue
         
-        # Create GeoJSON feature
+        # Create GeoJSON feature (the record number identifies it across chunks)
         feature = {
             "type": "Feature",
-            "properties": record_to_properties(records[i]),
-            "geometry": {
-                "type": None,
-                "coordinates": None
-            }
+            "id": i,
+            "bbox": feature_bbox,
+            "properties": record_to_properties(reader.record(i, fields=fields)),
+            "geometry": geometry
         }
         
-        # Determine geometry type and format coordinates
-        if shape.shapeType == shapefile.POINT:
-            feature["geometry"]["type"] = "Point"
-            feature["geometry"]["coordinates"] = shape_points[0]
-        elif shape.shapeType == shapefile.POLYLINE:
-            feature["geometry"]["type"] = "LineString"
-            feature["geometry"]["coordinates"] = shape_points
-        elif shape.shapeType == shapefile.POLYGON:
-            feature["geometry"]["type"] = "Polygon"
-            # Handle polygon parts correctly
-            if hasattr(shape, 'parts') and len(shape.parts) > 1:
-                # Multiple parts - need to separate
-                parts = []
-                for j in range(len(shape.parts)):
-                    start = shape.parts[j]
-                    end = shape.parts[j+1] if j+1 < len(shape.parts) else len(shape_points)
-                    parts.append(shape_points[start:end])
-                feature["geometry"]["coordinates"] = parts
-            else:
-                # Single part polygon
-                feature["geometry"]["coordinates"] = [shape_points]
-        else:
-            # Skip unsupported shape types
-            continue
-        
         # Add feature to collection
         geojson["features"].append(feature)
         feature_count += 1
@@ -231,6 +313,40 @@ def extract_chunk_features(shapefile_path, bbox, max_features=None, simplify_fac
     
     return geojson
 
+def bboxes_overlap(bbox1, bbox2):
+    """Check whether two bounding boxes overlap (touching counts)."""
+    return bbox1[0] <= bbox2[2] and bbox1[2] >= bbox2[0] and bbox1[1] <= bbox2[3] and bbox1[3] >= bbox2[1]
+
+def get_chunk_cells(chunk, cells_per_side=CHUNK_CELLS_PER_SIDE):
+    """
+    Split a chunk into a fixed grid of cells
+    
+    The grid only depends on the chunk, so panning the view keeps hitting the
+    same cached cells.
+    
+    Args:
+        chunk: Chunk from the manifest
+        cells_per_side: Number of cells along each side of the chunk
+        
+    Returns:
+        list: Cells, each a chunk with its own chunk_id and bbox
+    """
+    x_min, y_min, x_max, y_max = chunk['bbox']
+    width = (x_max - x_min) / cells_per_side
+    height = (y_max - y_min) / cells_per_side
+    cells = []
+    for row in range(cells_per_side):
+        for col in range(cells_per_side):
+            # The last row and column end exactly on the chunk bbox
+            cell_bbox = (
+                x_min + col * width,
+                y_min + row * height,
+                x_max if col == cells_per_side - 1 else x_min + (col + 1) * width,
+                y_max if row == cells_per_side - 1 else y_min + (row + 1) * height,
+            )
+            cells.append(dict(chunk, chunk_id=f"{chunk['chunk_id']}_{row}_{col}", bbox=cell_bbox))
+    return cells
+
 def get_visible_chunks_for_bbox(chunks, view_bbox, zoom_level):
     """
     Get chunks that are visible within the current map view
@@ -243,16 +359,6 @@ def get_visible_chunks_for_bbox(chunks, view_bbox, zoom_level):
     Returns:
         list: List of visible chunks
     """
-    # Function to check if bboxes overlap
-    def bboxes_overlap(bbox1, bbox2):
-        x1_min, y1_min, x1_max, y1_max = bbox1
-        x2_min, y2_min, x2_max, y2_max = bbox2
-        
-        # Check if one bbox is completely to the left/right/above/below the other
-        if x1_max < x2_min or x1_min > x2_max or y1_max < y2_min or y1_min > y2_max:
-            return False
-        return True
-    
     visible_chunks = []
     for chunk in chunks:
         if bboxes_overlap(chunk['bbox'], view_bbox):
@@ -267,11 +373,73 @@ def get_visible_chunks_for_bbox(chunks, view_bbox, zoom_level):
     logger.info(f"Found {len(visible_chunks)} visible chunks of {len(chunks)} total")
     return visible_chunks
 
-def get_chunk_key(layer_id, chunk_id, simplify, max_features, zoom=None):
-    """Generate a cache key for a specific chunk."""
-    return f"chunk_{layer_id}_{chunk_id}_{simplify}_{max_features}_{zoom}"
+def get_chunk_key(layer_id, version, chunk_id, simplify, max_features, zoom=None, fields=None, where=None):
+    """Generate a cache key for a specific chunk (or chunk cell), under the layer's key prefix"""
+    return f"{get_cache_key(layer_id, version, simplify, max_features, zoom, fields, where)}_{chunk_id}"
+
+def get_chunk_workers():
+    """Get the number of processes extracting chunks (CHUNK_EXTRACTION_WORKERS, at most DEFAULT_CHUNK_WORKERS by default)"""
+    workers = getattr(settings, 'CHUNK_EXTRACTION_WORKERS', None)
+    return workers or min(DEFAULT_CHUNK_WORKERS, os.cpu_count() or 1)
+
+def _get_chunk_pool():
+    global _chunk_pool
+    with _chunk_pool_lock:
+        if _chunk_pool is None:
+            # Kept for the life of the web process, so requests don't pay for starting workers
+            _chunk_pool = ProcessPoolExecutor(max_workers=get_chunk_workers(), mp_context=get_pool_context(),
+                                              initializer=setup_pool_worker)
+        return _chunk_pool
+
+def _reset_chunk_pool():
+    global _chunk_pool
+    with _chunk_pool_lock:
+        if _chunk_pool is not None:
+            _chunk_pool.shutdown(wait=False, cancel_futures=True)
+        _chunk_pool = None
+
+def _extract_chunk_json(shapefile_path, bbox, max_features, simplify_factor, fields, where):
+    # Serialized in the worker, so the parent receives one string to cache
+    return json.dumps(extract_chunk_features(shapefile_path, bbox, max_features, simplify_factor, fields, where))
+
+def extract_chunks(chunks, max_features, simplify_factor, fields=None, where=None):
+    """
+    Extract several chunks, in parallel across the chunk pool when there are more than one
+    
+    Each worker only reads the records its chunk's spatial index query returns.
+    
+    Args:
+        chunks: Chunks to extract
+        max_features, simplify_factor, fields, where: See extract_chunk_features
+        
+    Returns:
+        list: GeoJSON strings, in the order of the chunks
+    """
+    jobs = [(chunk['shapefile_path'], chunk['bbox'], max_features, simplify_factor, fields, where) for chunk in chunks]
+    if len(jobs) > 1 and get_chunk_workers() > 1:
+        try:
+            pool = _get_chunk_pool()
+            futures = [pool.submit(_extract_chunk_json, *job) for job in jobs]
+            return [future.result() for future in futures]
+        except BrokenProcessPool as e:
+            # A worker died (e.g. killed for memory), start a new pool next time
+            logger.error(f"Chunk pool failed, extracting {len(jobs)} chunks in process: {e}")
+            _reset_chunk_pool()
+    return [_extract_chunk_json(*job) for job in jobs]
+
+def count_layer_features(shapefile_path):
+    """Count the features of a shapefile, from its spatial index or else its header."""
+    index = get_spatial_index(shapefile_path, build_if_missing=False)
+    if index is not None:
+        return len(index)
+    reader = shapefile.Reader(shapefile_path)
+    try:
+        return len(reader)
+    finally:
+        reader.close()
 
-def process_layer_in_chunks(layer, view_bbox, zoom_level, simplify='auto', max_features=None):
+def process_layer_in_chunks(layer, view_bbox, zoom_level, simplify='auto', max_features=None, fields=None,
+                            where=None):
     """
     Process a MapLayer by chunking it and only loading visible chunks
     
@@ -281,6 +449,8 @@ def process_layer_in_chunks(layer, view_bbox, zoom_level, simplify='auto', max_f
         zoom_level: Current zoom level
         simplify: Simplification factor or 'auto'
         max_features: Maximum features to include
+        fields: Attribute names to include (all when None)
+        where: Attribute filter selecting the records to include (all when None)
         
     Returns:
         str: GeoJSON string with visible chunks
@@ -290,91 +460,82 @@ def process_layer_in_chunks(layer, view_bbox, zoom_level, simplify='auto', max_f
         logger.error(f"No valid shapefile directory for layer {layer.id}")
         return None
     
-    shp_files = [f for f in os.listdir(layer.shapefile_dir) if f.lower().endswith('.shp')]
-    if not shp_files:
+    shapefile_path = layer.get_shapefile_path()
+    if not shapefile_path:
         logger.error(f"No .shp files found in {layer.shapefile_dir}")
         return None
     
-    shapefile_path = os.path.join(layer.shapefile_dir, shp_files[0])
-    
-    # Generate chunks if not already done
-    chunks = chunk_shapefile(shapefile_path)
+    # Load the persisted chunks (built once per shapefile)
+    chunks = get_chunk_manifest(shapefile_path)
     
-    # Get visible chunks
+    # Get the cells of the visible chunks that overlap the view; cells are extracted and cached whole
     visible_chunks = get_visible_chunks_for_bbox(chunks, view_bbox, zoom_level)
-    
-    # Calculate simplification factor (if auto)
-    if simplify == 'auto':
-        if zoom_level < 8:
-            simplify_factor = 0.05  # Very zoomed out
-        elif zoom_level < 10:
-            simplify_factor = 0.02
-        elif zoom_level < 12:
-            simplify_factor = 0.01
-        elif zoom_level < 14:
-            simplify_factor = 0.005
-        elif zoom_level < 16:
-            simplify_factor = 0.002
-        else:
-            simplify_factor = 0.0  # No simplification when zoomed in
-    else:
-        try:
-            simplify_factor = float(simplify)
-        except ValueError:
-            simplify_factor = 0.0
-    
-    # Determine max features per chunk based on zoom
-    if max_features is None:
-        if zoom_level < 8:
-            chunk_max_features = 1000
-        elif zoom_level < 10:
-            chunk_max_features = 2000
-        elif zoom_level < 12:
-            chunk_max_features = 3000
-        elif zoom_level < 14:
-            chunk_max_features = 4000
-        else:
-            chunk_max_features = 5000
-    else:
-        # If total max features specified, divide among chunks
-        chunk_max_features = max(1000, max_features // max(1, len(visible_chunks)))
-    
-    # Process each visible chunk
+    visible_cells = [cell for chunk in visible_chunks for cell in get_chunk_cells(chunk)
+                     if bboxes_overlap(cell['bbox'], view_bbox)]
+    
+    # Resolve the simplification tolerance like the other layer paths (the zoom level takes precedence)
+    total_features = count_layer_features(shapefile_path)
+    view_latitude = (view_bbox[1] + view_bbox[3]) / 2
+    simplify_factor = resolve_tolerance(simplify, total_features, zoom_level, view_latitude)
+    
+    # Every feature in the view is included (simplified for the zoom level), unless max features is
+    # specified: then each cell samples its features evenly, with a limit rounded up to a power of two
+    # so panning keeps the same cache keys, and the view is sampled down to the limit once merged
+    cell_max_features = None
+    if max_features:
+        cell_max_features = 1 << math.ceil(math.log2(max(1, max_features // max(1, len(visible_cells)))))
+    
+    # Process each visible cell
     all_features = []
-    
-    for chunk in visible_chunks:
-        # Check for cached chunk
-        chunk_key = get_chunk_key(
-            layer.id, chunk['chunk_id'], simplify_factor, chunk_max_features, zoom_level
-        )
-        
-        cached_chunk, cache_type = get_cached_layer_data(chunk_key, simplify_factor, chunk_max_features, zoom_level)
-        
-        if cached_chunk:
-            # Use cached chunk
-            chunk_data = json.loads(cached_chunk)
-            all_features.extend(chunk_data["features"])
-        else:
-            # Process chunk
-            chunk_data = extract_chunk_features(
-                chunk['shapefile_path'], 
-                chunk['bbox'],
-                max_features=chunk_max_features,
-                simplify_factor=simplify_factor
-            )
-            
-            # Cache chunk for future use
-            cache_layer_data(chunk_key, json.dumps(chunk_data), simplify_factor, chunk_max_features, zoom_level)
-            
-            # Add features to result
-            all_features.extend(chunk_data["features"])
+    seen_ids = set()
+    
+    def add_features(features):
+        for feature in features:
+            # Cells are cached whole, only their features overlapping the view are included
+            if not bboxes_overlap(feature.pop("bbox"), view_bbox):
+                continue
+            # Features overlapping several cells are only included once
+            feature_id = feature.get("id")
+            if feature_id is not None:
+                if feature_id in seen_ids:
+                    continue
+                seen_ids.add(feature_id)
+            all_features.append(feature)
+    
+    # Look up the cached cells, the others are extracted together
+    expiry = get_cache_expiry(zoom_level)
+    version = layer.get_content_version()
+    cell_keys = [
+        get_chunk_key(layer.id, version, cell['chunk_id'], simplify_factor, cell_max_features, zoom_level, fields,
+                      where)
+        for cell in visible_cells
+    ]
+    cell_json = [layer_cache.get_text(cell_key, expiry) for cell_key in cell_keys]
+    missing = [position for position, data in enumerate(cell_json) if not data]
+    if missing:
+        logger.info(f"Extracting {len(missing)} uncached chunk cells of layer {layer.id}")
+        extracted = extract_chunks([visible_cells[position] for position in missing], cell_max_features,
+                                   simplify_factor, fields, where)
+        for position, data in zip(missing, extracted):
+            # Cache cell for future use (only ever read back as text, so without compressed variants)
+            layer_cache.set(cell_keys[position], data, expiry, compress=False)
+            cell_json[position] = data
+    
+    # Merge in cell order, so the response doesn't depend on which cells were cached
+    for data in cell_json:
+        add_features(json.loads(data)["features"])
+    
+    # Over the limit, sample the view evenly
+    if max_features and len(all_features) > max_features:
+        positions = np.linspace(0, len(all_features) - 1, max_features).astype(np.int64)
+        all_features = [all_features[position] for position in positions]
     
     # Create combined GeoJSON
     combined = {
         "type": "FeatureCollection",
         "features": all_features,
         "info": {
-            "total_features": sum(c.get('estimated_feature_count', 0) for c in chunks),
+            "total_features": total_features,
             "included_features": len(all_features),
             "visible_chunks": len(visible_chunks),
             "total_chunks": len(chunks),
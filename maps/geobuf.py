@@ -0,0 +1,217 @@
+"""
+Geobuf encoding of shapefile layers.
+
+Geobuf is a compact protobuf encoding of GeoJSON: coordinates are stored as
+delta- and zigzag-encoded integers (fixed precision) and property keys are
+written once in a dictionary that features refer to by index. Layers are
+encoded straight from the geometry store's arrays (or the shapefile's points),
+and coordinate runs are packed with NumPy instead of being formatted as JSON
+text.
+
+The output follows the geobuf.proto schema (https://github.com/mapbox/geobuf),
+so clients can decode it with the geobuf JavaScript library.
+"""
+
+import json
+import struct
+import logging
+from datetime import date, datetime
+
+import numpy as np
+import shapefile
+
+from maps.attribute_index import select_records
+from maps.geometry_store import geometry_coordinates, get_geometry_store, shape_rings
+from maps.protobuf import (
+    WIRE_FIXED64, WIRE_VARINT, bytes_field, field_key, pack_varints, varint, zigzag, zigzag_array,
+)
+from maps.simplification import resolve_tolerance
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Encoding configuration
+GEOBUF_CONTENT_TYPE = 'application/x-geobuf'
+GEOBUF_MEDIA_TYPES = (GEOBUF_CONTENT_TYPE, 'application/x-protobuf')
+PRECISION = 6  # Decimal digits kept, about 0.1m for lon/lat data (geobuf default)
+
+GEOMETRY_TYPES = {
+    'Point': 0, 'MultiPoint': 1, 'LineString': 2, 'MultiLineString': 3,
+    'Polygon': 4, 'MultiPolygon': 5,
+}
+
+
+def accepts_geobuf(accept_header):
+    """Check whether an Accept header asks for the Geobuf encoding."""
+    for media_range in (accept_header or '').split(','):
+        media_type, _, params = media_range.strip().partition(';')
+        if media_type.strip().lower() in GEOBUF_MEDIA_TYPES and 'q=0' not in params.replace(' ', '').split(';'):
+            return True
+    return False
+
+
+def _line_deltas(line, scale, closed=False):
+    """Quantize a line and delta-encode it, restarting from zero like geobuf does."""
+    points = np.asarray(line, dtype=np.float64)[:, :2]
+    if closed:
+        points = points[:-1]  # The closing point is implied
+    quantized = np.round(points * scale).astype(np.int64)
+    deltas = np.diff(quantized, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    return deltas.reshape(-1)
+
+
+def encode_geometry(geometry, precision=PRECISION):
+    """
+    Encode a GeoJSON geometry as a Geobuf Geometry message
+
+    Returns:
+        bytes: Encoded message, or None for unsupported geometry types
+    """
+    return encode_coordinates(geometry.get('type'), geometry.get('coordinates'), precision)
+
+
+def encode_coordinates(geom_type, coordinates, precision=PRECISION):
+    """
+    Encode a geometry given as its GeoJSON type and coordinates as a Geobuf Geometry message
+
+    Positions and rings can be lists or NumPy arrays.
+
+    Returns:
+        bytes: Encoded message, or None for unsupported geometry types
+    """
+    if geom_type not in GEOMETRY_TYPES:
+        return None
+    scale = 10 ** precision
+    lengths = None
+
+    if geom_type == 'Point':
+        coords = np.round(np.asarray(coordinates[:2], dtype=np.float64) * scale).astype(np.int64)
+    elif geom_type in ('MultiPoint', 'LineString'):
+        coords = _line_deltas(coordinates, scale)
+    elif geom_type in ('MultiLineString', 'Polygon'):
+        closed = geom_type == 'Polygon'
+        if len(coordinates) != 1:
+            lengths = [len(line) - (1 if closed else 0) for line in coordinates]
+        coords = np.concatenate([_line_deltas(line, scale, closed) for line in coordinates])
+    else:
+        if len(coordinates) != 1 or len(coordinates[0]) != 1:
+            lengths = [len(coordinates)]
+            for polygon in coordinates:
+                lengths.append(len(polygon))
+                lengths.extend(len(ring) - 1 for ring in polygon)
+        coords = np.concatenate([_line_deltas(ring, scale, True) for polygon in coordinates for ring in polygon])
+
+    message = field_key(1, WIRE_VARINT) + varint(GEOMETRY_TYPES[geom_type])
+    if lengths is not None:
+        message += bytes_field(2, pack_varints(lengths))
+    return message + bytes_field(3, pack_varints(zigzag_array(coords)))
+
+
+def encode_value(value):
+    """Encode an attribute value as a Geobuf Value message."""
+    if isinstance(value, bytes):
+        try:
+            value = value.decode('utf-8')
+        except UnicodeDecodeError:
+            value = str(value)
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+
+    if isinstance(value, str):
+        return bytes_field(1, value.encode('utf-8'))
+    if isinstance(value, bool):
+        return field_key(5, WIRE_VARINT) + varint(int(value))
+    if isinstance(value, int):
+        if value >= 0:
+            return field_key(3, WIRE_VARINT) + varint(value)
+        return field_key(4, WIRE_VARINT) + varint(-value)
+    if isinstance(value, float) and value.is_integer() and abs(value) < 2 ** 63:
+        return encode_value(int(value))
+    if isinstance(value, float):
+        return field_key(2, WIRE_FIXED64) + struct.pack('<d', value)
+    return bytes_field(6, json.dumps(value, default=str).encode('utf-8'))
+
+
+def encode_feature(geometry_message, values, feature_id=None):
+    """
+    Encode a Geobuf Feature message
+
+    Args:
+        geometry_message: Encoded Geometry message
+        values: Attribute values in the order of the Data keys
+        feature_id: Integer id of the feature
+
+    Returns:
+        bytes: Encoded message
+    """
+    message = bytes_field(1, geometry_message)
+    if feature_id is not None:
+        message += field_key(12, WIRE_VARINT) + varint(zigzag(feature_id))
+    if values:
+        message += b''.join(bytes_field(13, encode_value(value)) for value in values)
+        # Pairs of (key index, value index)
+        message += bytes_field(14, pack_varints([i for k in range(len(values)) for i in (k, k)]))
+    return message
+
+
+def encode_layer(shapefile_path, simplify='auto', max_features=None, zoom=None, fields=None, where=None):
+    """
+    Encode a shapefile layer as a Geobuf FeatureCollection
+
+    Features, sampling and simplification match the GeoJSON output of the
+    layer data endpoint; the attribute names form the key dictionary.
+
+    Args:
+        shapefile_path: Path to the .shp file
+        simplify: 'auto', a tolerance in coordinate units, or 'none'
+        max_features: Maximum number of features to include
+        zoom: Zoom level the data is displayed at
+        fields: Attribute names to include (all when None)
+        where: Attribute filter selecting the records to include (all when None)
+
+    Returns:
+        bytes: Encoded Data message
+    """
+    reader = shapefile.Reader(shapefile_path)
+    try:
+        total_shapes = len(reader)
+        extent = tuple(reader.bbox) if total_shapes else None
+        latitude = (reader.bbox[1] + reader.bbox[3]) / 2 if total_shapes else 0.0
+        tolerance = resolve_tolerance(simplify, total_shapes, zoom, latitude, extent)
+        keys = [field[0] for field in reader.fields[1:]]  # Skip DeletionFlag
+        if fields is not None:
+            keys = [key for key in keys if key in fields]
+
+        record_ids = select_records(shapefile_path, where) if where else range(total_shapes)
+        feature_limit = int(max_features) if max_features else None
+        step = 1
+        if feature_limit and len(record_ids) > feature_limit:
+            step = max(1, int(len(record_ids) / feature_limit))
+
+        store = get_geometry_store(shapefile_path)
+        features = []
+        for i in record_ids[::step]:
+            i = int(i)
+            # Encoded straight from the store's array views or the shape's points, not from GeoJSON
+            if store is not None:
+                geom_type, coordinates = store.coordinates(i, tolerance)
+            else:
+                shape = reader.shape(i)
+                geom_type, coordinates = geometry_coordinates(shape.shapeType, shape_rings(shape), tolerance)
+            if geom_type is None:
+                continue
+
+            geometry_message = encode_coordinates(geom_type, coordinates)
+            if geometry_message is None:
+                continue
+            features.append(bytes_field(1, encode_feature(geometry_message, list(reader.record(i, fields=fields)), i)))
+            if feature_limit and len(features) >= feature_limit:
+                break
+    finally:
+        reader.close()
+
+    data = b''.join(bytes_field(1, key.encode('utf-8')) for key in keys)
+    data += bytes_field(4, b''.join(features))
+    logger.info(f"Encoded {len(features)} features of {shapefile_path} as Geobuf "
+                f"({len(data) / (1024 * 1024):.2f} MB)")
+    return data
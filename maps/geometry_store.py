@@ -0,0 +1,403 @@
+"""
+Memory-mapped columnar geometry store for shapefile layers.
+
+When a layer is processed its geometries are converted once into flat NumPy
+arrays saved next to the shapefile (``<name>.geom/``):
+
+- ``coords.npy``: float64 (V, 2) array with every vertex of every feature
+- ``ring_offsets.npy``: int64 (P + 1,) start of each ring/part in ``coords``
+- ``part_offsets.npy``: int64 (F + 1,) start of each feature's rings in ``ring_offsets``
+- ``bboxes.npy``: float64 (F, 4) bounding box of each feature
+- ``shape_types.npy``: int16 (F,) shapefile shape type of each feature (0 for null)
+
+At serve time the arrays are opened with ``numpy.memmap``, so every worker
+process shares the OS page cache for a layer instead of parsing the shapefile
+into pyshp objects, and bounding box filtering is a single vector operation.
+"""
+
+import os
+import json
+import shutil
+import logging
+import threading
+
+import numpy as np
+import shapefile
+
+from maps.simplification import simplify_line, simplify_ring
+from maps.spatial_index import read_record_headers
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Store configuration
+STORE_SUFFIX = '.geom'
+BUILD_BLOCK_SIZE = 50000  # Features converted before their arrays are flushed
+ARRAY_NAMES = ('coords', 'ring_offsets', 'part_offsets', 'bboxes', 'shape_types')
+
+# Shapefile shape types by geometry family
+POINT_SHAPE_TYPES = (1, 11, 21)
+MULTIPOINT_SHAPE_TYPES = (8, 18, 28)
+LINE_SHAPE_TYPES = (3, 13, 23)
+POLYGON_SHAPE_TYPES = (5, 15, 25)
+
+# Opened stores, keyed by store path and modification time
+_store_cache = {}
+_store_cache_lock = threading.Lock()
+
+
+def get_store_path(shapefile_path):
+    """Get the path of the geometry store directory for a shapefile."""
+    return os.path.splitext(shapefile_path)[0] + STORE_SUFFIX
+
+
+def _signed_area(ring):
+    """Shoelace area of a ring, negative for clockwise rings."""
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]))
+
+
+class GeometryStore:
+    """Read-only view over the columnar arrays of a layer."""
+
+    def __init__(self, coords, ring_offsets, part_offsets, bboxes, shape_types):
+        self.coords = coords
+        self.ring_offsets = ring_offsets
+        self.part_offsets = part_offsets
+        self.bboxes = bboxes
+        self.shape_types = shape_types
+        self.shapefile_mtime = None
+
+    def __len__(self):
+        return len(self.shape_types)
+
+    @classmethod
+    def load(cls, path):
+        """Open the arrays of a store directory as read-only memory maps."""
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in ARRAY_NAMES}
+        return cls(**arrays)
+
+    def query_bbox(self, bbox):
+        """
+        Find the features whose bounding box overlaps a bbox
+
+        Args:
+            bbox: (x_min, y_min, x_max, y_max)
+
+        Returns:
+            numpy.ndarray: Sorted record numbers of the non-null overlapping features
+        """
+        x_min, y_min, x_max, y_max = bbox
+        boxes = self.bboxes
+        mask = ((boxes[:, 0] <= x_max) & (boxes[:, 2] >= x_min) &
+                (boxes[:, 1] <= y_max) & (boxes[:, 3] >= y_min) &
+                (self.shape_types != 0))
+        return np.nonzero(mask)[0]
+
+    def rings(self, i):
+        """Get the rings/parts of a feature as (N, 2) array views."""
+        first, last = self.part_offsets[i], self.part_offsets[i + 1]
+        offsets = self.ring_offsets[first:last + 1]
+        return [self.coords[offsets[k]:offsets[k + 1]] for k in range(len(offsets) - 1)]
+
+    def coordinates(self, i, tolerance=None):
+        """
+        Get the GeoJSON type and coordinates of a feature as array views (see geometry_coordinates)
+
+        Args:
+            i: Record number
+            tolerance: Simplification tolerance in coordinate units, or None
+
+        Returns:
+            tuple: (GeoJSON geometry type, nested coordinates), or (None, None)
+        """
+        return geometry_coordinates(int(self.shape_types[i]), self.rings(i), tolerance)
+
+    def geometry(self, i, tolerance=None):
+        """
+        Build the GeoJSON geometry of a feature, simplifying it on the way
+
+        Args:
+            i: Record number
+            tolerance: Simplification tolerance in coordinate units, or None
+
+        Returns:
+            dict: GeoJSON geometry, or None for null or fully collapsed shapes
+        """
+        geom_type, coordinates = self.coordinates(i, tolerance)
+        if geom_type is None:
+            return None
+        if geom_type == 'Point':
+            coordinates = tuple(coordinates.tolist())
+        elif geom_type in ('MultiPoint', 'LineString'):
+            coordinates = _as_list(coordinates)
+        elif geom_type in ('MultiLineString', 'Polygon'):
+            coordinates = [_as_list(ring) for ring in coordinates]
+        else:
+            coordinates = [[_as_list(ring) for ring in polygon] for polygon in coordinates]
+        return {'type': geom_type, 'coordinates': coordinates}
+
+
+def _as_list(ring):
+    """Convert a ring/part to a list of positions, if it wasn't simplified into one already."""
+    return ring.tolist() if isinstance(ring, np.ndarray) else ring
+
+
+def shape_rings(shape):
+    """Split the points of a pyshp Shape into its rings/parts, as (N, 2) arrays."""
+    if not shape.points:
+        return []
+    points = np.asarray(shape.points, dtype=np.float64)[:, :2]
+    parts = list(getattr(shape, 'parts', None) or [0]) + [len(points)]
+    return [points[parts[k]:parts[k + 1]] for k in range(len(parts) - 1)]
+
+
+def geometry_coordinates(shape_type, rings, tolerance=None):
+    """
+    Assemble the GeoJSON coordinates of a shape from its rings/parts
+
+    Coordinates are left as (N, 2) arrays (lists once simplified) so binary
+    encodings can use them without formatting them as GeoJSON.
+
+    Args:
+        shape_type: Shapefile shape type
+        rings: Rings/parts as (N, 2) arrays
+        tolerance: Simplification tolerance in coordinate units, or None
+
+    Returns:
+        tuple: (GeoJSON geometry type, nested coordinates), or (None, None) for null
+               or fully collapsed shapes
+    """
+    if shape_type == 0 or not rings:
+        return None, None
+
+    if shape_type in POINT_SHAPE_TYPES:
+        return 'Point', rings[0][0]
+    if shape_type in MULTIPOINT_SHAPE_TYPES:
+        return 'MultiPoint', rings[0]
+
+    if shape_type in LINE_SHAPE_TYPES:
+        lines = [simplify_line(ring, tolerance) if tolerance else ring for ring in rings]
+        if len(lines) == 1:
+            return 'LineString', lines[0]
+        return 'MultiLineString', lines
+
+    if shape_type in POLYGON_SHAPE_TYPES:
+        # Exterior rings are clockwise; each hole belongs to the last exterior containing its bbox
+        polygons = []
+        for ring in rings:
+            if len(ring) < 4:
+                continue
+            is_exterior = not polygons or _signed_area(ring) <= 0
+            if not is_exterior:
+                owner = polygons[-1]
+                for polygon in reversed(polygons):
+                    if polygon['bbox'] is None:
+                        exterior = polygon['ring']
+                        polygon['bbox'] = (exterior[:, 0].min(), exterior[:, 1].min(),
+                                           exterior[:, 0].max(), exterior[:, 1].max())
+                    box = polygon['bbox']
+                    if (box[0] <= ring[:, 0].min() and ring[:, 0].max() <= box[2] and
+                            box[1] <= ring[:, 1].min() and ring[:, 1].max() <= box[3]):
+                        owner = polygon
+                        break
+                if owner['rings'] is None:
+                    continue  # The exterior collapsed, so do its holes
+                hole = simplify_ring(ring, tolerance, is_exterior=False) if tolerance else ring
+                if hole is not None:
+                    owner['rings'].append(hole)
+                continue
+
+            exterior = simplify_ring(ring, tolerance, is_exterior=True) if tolerance else ring
+            # The bbox is only worked out once a hole needs its owner
+            polygons.append({
+                'ring': ring,
+                'bbox': None,
+                'rings': None if exterior is None else [exterior],
+            })
+
+        polygons = [polygon['rings'] for polygon in polygons if polygon['rings'] is not None]
+        if not polygons:
+            return None, None
+        if len(polygons) == 1:
+            return 'Polygon', polygons[0]
+        return 'MultiPolygon', polygons
+
+    return None, None
+
+
+def _read_sizes(shapefile_path):
+    """
+    Count the rings and vertices of every record from the .shp record headers
+
+    Args:
+        shapefile_path: Path to the .shp file
+
+    Returns:
+        tuple: (ring_counts, vertex_counts) int64 arrays, zero for null shapes
+    """
+    # Shape type, then bbox and part/point counts (multipoints have no part count)
+    content = read_record_headers(shapefile_path, 44)
+    shape_types = content[:, 0:4].copy().view('<i4').ravel()
+    first, second = content[:, 36:40].copy().view('<i4').ravel(), content[:, 40:44].copy().view('<i4').ravel()
+
+    ring_counts = np.zeros(len(content), dtype=np.int64)
+    vertex_counts = np.zeros(len(content), dtype=np.int64)
+    is_point = np.isin(shape_types, POINT_SHAPE_TYPES)
+    vertex_counts[is_point] = 1
+    is_multipoint = np.isin(shape_types, MULTIPOINT_SHAPE_TYPES)
+    vertex_counts[is_multipoint] = first[is_multipoint]
+    is_multipart = np.isin(shape_types, LINE_SHAPE_TYPES + POLYGON_SHAPE_TYPES)
+    vertex_counts[is_multipart] = second[is_multipart]
+    # Shapes without vertices are stored as null; a shape without parts is a single ring
+    ring_counts[is_multipart] = np.maximum(first[is_multipart], 1)
+    ring_counts[is_point | is_multipoint] = 1
+    ring_counts[vertex_counts == 0] = 0
+    return ring_counts, vertex_counts
+
+
+def build_geometry_store(shapefile_path):
+    """
+    Convert the geometries of a shapefile into a columnar store
+
+    The arrays are sized from the record headers first, then filled block by
+    block straight into their .npy files, so a layer is never held in memory.
+
+    Args:
+        shapefile_path: Path to the .shp file
+
+    Returns:
+        str: Path of the store directory
+    """
+    store_path = get_store_path(shapefile_path)
+    temp_path = store_path + '.tmp'
+    logger.info(f"Building geometry store for {shapefile_path}")
+
+    if os.path.exists(temp_path):
+        shutil.rmtree(temp_path)
+    os.makedirs(temp_path)
+
+    ring_counts, vertex_counts = _read_sizes(shapefile_path)
+    feature_count, ring_count, vertex_count = len(ring_counts), int(ring_counts.sum()), int(vertex_counts.sum())
+
+    def create(name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(temp_path, f"{name}.npy"), mode='w+', dtype=dtype, shape=shape)
+
+    arrays = {
+        'coords': create('coords', np.float64, (vertex_count, 2)),
+        'ring_offsets': create('ring_offsets', np.int64, (ring_count + 1,)),
+        'part_offsets': create('part_offsets', np.int64, (feature_count + 1,)),
+        'bboxes': create('bboxes', np.float64, (feature_count, 4)),
+        'shape_types': create('shape_types', np.int16, (feature_count,)),
+    }
+    # Offsets have a leading zero; positions is where the next block of each array goes
+    arrays['ring_offsets'][0] = 0
+    arrays['part_offsets'][0] = 0
+    positions = {'coords': 0, 'rings': 0, 'features': 0}
+
+    reader = shapefile.Reader(shapefile_path)
+    try:
+        pending = {'coords': [], 'ring_sizes': [], 'part_sizes': [], 'bboxes': [], 'shape_types': []}
+
+        def flush():
+            if not pending['shape_types']:
+                return
+            coords = [np.asarray(points, dtype=np.float64)[:, :2] for points in pending['coords'] if len(points)]
+            coords = np.vstack(coords) if coords else np.empty((0, 2))
+            ring_sizes = np.asarray(pending['ring_sizes'], dtype=np.int64)
+            part_sizes = np.asarray(pending['part_sizes'], dtype=np.int64)
+            vertex, ring, feature = positions['coords'], positions['rings'], positions['features']
+            if (vertex + len(coords) > vertex_count or ring + len(ring_sizes) > ring_count or
+                    feature + len(part_sizes) > feature_count):
+                raise ValueError(f"Shapes of {shapefile_path} don't match its record headers")
+
+            arrays['coords'][vertex:vertex + len(coords)] = coords
+            arrays['ring_offsets'][ring + 1:ring + 1 + len(ring_sizes)] = vertex + np.cumsum(ring_sizes)
+            arrays['part_offsets'][feature + 1:feature + 1 + len(part_sizes)] = ring + np.cumsum(part_sizes)
+            arrays['bboxes'][feature:feature + len(part_sizes)] = np.asarray(pending['bboxes'],
+                                                                             dtype=np.float64).reshape(-1, 4)
+            arrays['shape_types'][feature:feature + len(part_sizes)] = pending['shape_types']
+            positions['coords'] += len(coords)
+            positions['rings'] += len(ring_sizes)
+            positions['features'] += len(part_sizes)
+            for values in pending.values():
+                values.clear()
+
+        for shape in reader.iterShapes():
+            points = shape.points
+            if shape.shapeType == 0 or not points:
+                pending['shape_types'].append(0)
+                pending['bboxes'].append((np.nan,) * 4)
+                pending['part_sizes'].append(0)
+                continue
+
+            parts = list(getattr(shape, 'parts', None) or [0]) + [len(points)]
+            ring_sizes = [parts[k + 1] - parts[k] for k in range(len(parts) - 1)]
+            pending['coords'].append(points)
+            pending['ring_sizes'].extend(ring_sizes)
+            pending['part_sizes'].append(len(ring_sizes))
+            pending['shape_types'].append(shape.shapeType)
+            if hasattr(shape, 'bbox'):
+                pending['bboxes'].append(tuple(shape.bbox))
+            else:
+                # Point shapes have no bbox attribute
+                x, y = points[0][:2]
+                pending['bboxes'].append((x, y, x, y))
+
+            if len(pending['shape_types']) >= BUILD_BLOCK_SIZE:
+                flush()
+        flush()
+    finally:
+        reader.close()
+
+    if (positions['coords'], positions['rings'], positions['features']) != (vertex_count, ring_count, feature_count):
+        raise ValueError(f"Shapes of {shapefile_path} don't match its record headers")
+    for array in arrays.values():
+        array.flush()
+    del arrays
+    with open(os.path.join(temp_path, 'meta.json'), 'w') as f:
+        json.dump({'shapefile_mtime': os.path.getmtime(shapefile_path), 'feature_count': feature_count}, f)
+
+    if os.path.exists(store_path):
+        shutil.rmtree(store_path)
+    os.replace(temp_path, store_path)
+    logger.info(f"Geometry store written to {store_path}: {feature_count} features, {vertex_count} vertices")
+    return store_path
+
+
+def get_geometry_store(shapefile_path):
+    """
+    Get the memory-mapped geometry store of a shapefile, opening it once per process
+
+    Args:
+        shapefile_path: Path to the .shp file
+
+    Returns:
+        GeometryStore: The store, or None if it is missing or older than the shapefile
+    """
+    store_path = get_store_path(shapefile_path)
+    meta_path = os.path.join(store_path, 'meta.json')
+    try:
+        if not os.path.exists(meta_path):
+            return None
+
+        cache_key = (store_path, os.path.getmtime(meta_path))
+        with _store_cache_lock:
+            store = _store_cache.get(cache_key)
+        if store is None:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            store = GeometryStore.load(store_path)
+            store.shapefile_mtime = meta.get('shapefile_mtime')
+            with _store_cache_lock:
+                # Drop stale versions of the same store
+                for key in [k for k in _store_cache if k[0] == store_path]:
+                    del _store_cache[key]
+                _store_cache[cache_key] = store
+        if store.shapefile_mtime != os.path.getmtime(shapefile_path):
+            logger.info(f"Geometry store is stale: {store_path}")
+            return None
+        return store
+    except Exception as e:
+        logger.error(f"Error opening geometry store for {shapefile_path}: {e}")
+        return None
@@ -0,0 +1,175 @@
+"""
+Click identification of shapefile layer features.
+
+A clicked point is looked up in a layer's spatial index with a search box of a
+few pixels around it; only the candidate records are then tested exactly:
+point-in-polygon (even-odd rule over all rings, so holes are excluded) for
+polygons, and the ground distance to the nearest segment or point for every
+geometry type. Attributes are read from the .dbf for the matches only, so
+popups get full attributes without the client holding the attribute table.
+"""
+
+import logging
+
+import numpy as np
+import shapefile
+
+from maps.geometry_store import (
+    get_geometry_store, POINT_SHAPE_TYPES, MULTIPOINT_SHAPE_TYPES, POLYGON_SHAPE_TYPES,
+)
+from maps.pyramid import record_to_properties
+from maps.simplification import meters_per_pixel, METERS_PER_DEGREE
+from maps.spatial_index import get_spatial_index
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Identify configuration
+DEFAULT_PIXEL_TOLERANCE = 5  # Clicks this close to a feature identify it
+DEFAULT_ZOOM = 12
+MAX_FEATURES_PER_LAYER = 10
+EDGE_BLOCK_SIZE = 4096  # Ring edges tested at once
+MAX_BLOCK_ELEMENTS = 1 << 20  # Point/edge pairs tested at once, bounding memory use
+
+
+def points_in_rings(xs, ys, rings):
+    """
+    Test points against a polygon with the even-odd rule
+
+    Every ring toggles insideness, so points in holes are outside and the
+    exteriors of a multipolygon can be passed together.
+
+    Args:
+        xs, ys: Arrays of point coordinates
+        rings: Closed rings as (N, 2) arrays
+
+    Returns:
+        numpy.ndarray: Boolean array, True for the points inside
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    inside = np.zeros(len(xs), dtype=bool)
+    for ring in rings:
+        ring = np.asarray(ring, dtype=np.float64)
+        for start in range(0, len(ring) - 1, EDGE_BLOCK_SIZE):
+            edges = ring[start:start + EDGE_BLOCK_SIZE + 1]
+            x1, y1 = edges[:-1, 0], edges[:-1, 1]
+            x2, y2 = edges[1:, 0], edges[1:, 1]
+            point_block = max(1, MAX_BLOCK_ELEMENTS // len(x1))
+            for first in range(0, len(xs), point_block):
+                px = xs[first:first + point_block, None]
+                py = ys[first:first + point_block, None]
+                # Edges straddling each point's horizontal line, crossed to the right of the point
+                straddles = (y1 > py) != (y2 > py)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    crossing_x = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+                crossings = np.count_nonzero(straddles & (crossing_x > px), axis=1)
+                inside[first:first + point_block] ^= (crossings % 2).astype(bool)
+    return inside
+
+
+def distance_to_parts(x, y, parts, segments=True):
+    """
+    Ground distance from a point to the nearest segment or vertex of a geometry
+
+    Args:
+        x, y: Longitude and latitude of the point
+        parts: Lines, rings or point runs as (N, 2) arrays
+        segments: Measure to the segments between vertices (False for points)
+
+    Returns:
+        float: Distance in meters (approximate, equirectangular at the point's latitude)
+    """
+    scale = np.array([METERS_PER_DEGREE * np.cos(np.radians(y)), METERS_PER_DEGREE])
+    best = np.inf
+    for part in parts:
+        points = (np.asarray(part, dtype=np.float64)[:, :2] - (x, y)) * scale
+        if len(points) == 1 or not segments:
+            best = min(best, float(np.hypot(points[:, 0], points[:, 1]).min()))
+            continue
+        starts, deltas = points[:-1], np.diff(points, axis=0)
+        lengths = (deltas ** 2).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.clip(-(starts * deltas).sum(axis=1) / lengths, 0.0, 1.0)
+        t[lengths == 0] = 0.0
+        closest = starts + t[:, None] * deltas
+        best = min(best, float(np.hypot(closest[:, 0], closest[:, 1]).min()))
+    return best
+
+
+def _shape_parts(shape):
+    points = np.asarray(shape.points, dtype=np.float64)[:, :2]
+    parts = list(getattr(shape, 'parts', None) or [0]) + [len(points)]
+    return [points[parts[k]:parts[k + 1]] for k in range(len(parts) - 1)]
+
+
+def identify_features(shapefile_path, lng, lat, zoom=DEFAULT_ZOOM, pixel_tolerance=DEFAULT_PIXEL_TOLERANCE,
+                      max_features=MAX_FEATURES_PER_LAYER, fields=None):
+    """
+    Find the features of a shapefile containing a point or within a few pixels of it
+
+    Args:
+        shapefile_path: Path to the .shp file
+        lng, lat: Clicked point
+        zoom: Zoom level of the map, which sets the size of a pixel
+        pixel_tolerance: Search distance in pixels
+        max_features: Maximum number of features returned
+        fields: Attribute names to include (all when None)
+
+    Returns:
+        list: Feature dicts (id, properties, distance in meters), containing
+              polygons first, then by distance
+    """
+    tolerance = meters_per_pixel(zoom, lat) * pixel_tolerance
+    dy = tolerance / METERS_PER_DEGREE
+    dx = dy / max(np.cos(np.radians(lat)), 1e-6)
+    search_bbox = (lng - dx, lat - dy, lng + dx, lat + dy)
+
+    store = get_geometry_store(shapefile_path)
+    index = get_spatial_index(shapefile_path)
+    reader = shapefile.Reader(shapefile_path)
+    try:
+        if index is not None:
+            candidate_ids = index.query(search_bbox)
+        elif store is not None:
+            candidate_ids = store.query_bbox(search_bbox)
+        else:
+            candidate_ids = range(len(reader))
+
+        matches = []
+        for i in candidate_ids:
+            i = int(i)
+            if store is not None:
+                shape_type = int(store.shape_types[i])
+                parts = store.rings(i)
+            else:
+                shape = reader.shape(i)
+                shape_type = shape.shapeType
+                parts = _shape_parts(shape) if shape.points else []
+            if shape_type == 0 or not parts:
+                continue
+
+            if shape_type in POLYGON_SHAPE_TYPES and points_in_rings([lng], [lat], parts)[0]:
+                distance = 0.0
+            elif shape_type in POINT_SHAPE_TYPES or shape_type in MULTIPOINT_SHAPE_TYPES:
+                # A multipoint has no segments between its points
+                distance = distance_to_parts(lng, lat, parts, segments=False)
+            else:
+                distance = distance_to_parts(lng, lat, parts)
+            if distance <= tolerance:
+                matches.append((distance, i))
+
+        matches.sort()
+        field_names = [field[0] for field in reader.fields[1:] if fields is None or field[0] in fields]
+        features = []
+        for distance, i in matches[:max_features]:
+            features.append({
+                'id': i,
+                'properties': record_to_properties(reader.record(i, fields=fields), field_names),
+                'distance': round(distance, 2),
+            })
+    finally:
+        reader.close()
+
+    logger.info(f"Identified {len(features)} features of {shapefile_path} at ({lng}, {lat})")
+    return features
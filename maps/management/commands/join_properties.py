@@ -0,0 +1,33 @@
+"""
+Assign every property to the polygon it falls in for a polygon map layer.
+
+Usage:
+    python manage.py join_properties <layer_id> [<layer_id> ...] [--workers N]
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from maps.models import MapLayer
+from maps.spatial_join import join_properties_to_layer
+
+
+class Command(BaseCommand):
+    help = "Join properties to the polygons of shapefile map layers (zoning, school districts, wards...)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('layer_ids', nargs='+', type=int, help="Ids of the polygon layers to join")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Worker processes for the join (default: one per CPU)")
+
+    def handle(self, *args, **options):
+        for layer_id in options['layer_ids']:
+            try:
+                layer = MapLayer.objects.get(id=layer_id, layer_type='shapefile')
+            except MapLayer.DoesNotExist:
+                raise CommandError(f"Shapefile layer {layer_id} does not exist")
+
+            try:
+                joined = join_properties_to_layer(layer, workers=options['workers'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"Joined {joined} properties to layer {layer.name}"))
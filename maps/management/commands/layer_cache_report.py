@@ -0,0 +1,71 @@
+"""
+Report the disk footprint of the layer file cache per layer, optionally sweeping it first.
+
+Entries of deleted layers and of content versions layers no longer have are
+stale: they can't be read anymore and are removed by --sweep.
+
+Usage:
+    python manage.py layer_cache_report [--sweep]
+"""
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from maps import caching
+from maps.models import MapLayer
+
+
+def format_size(size):
+    """Format a byte count for humans."""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M') if timestamp else '-'
+
+
+class Command(BaseCommand):
+    help = "Show the file cache footprint of each map layer against the disk quota"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sweep', action='store_true',
+                            help="Remove stale and expired entries and evict down to the quota before reporting")
+
+    def handle(self, *args, **options):
+        layers = list(MapLayer.objects.all())
+        versions = {layer.id: layer.get_content_version() for layer in layers}
+        names = {layer.id: layer.name for layer in layers}
+
+        if options['sweep']:
+            stale = caching.remove_stale_entries(versions)
+            self.stdout.write(self.style.SUCCESS(f"Removed {stale} stale entries"))
+            swept = caching.layer_cache.sweep()
+            self.stdout.write(self.style.SUCCESS(
+                f"Swept: {swept['expired']} expired, {swept['orphaned']} orphaned and {swept['evicted']} evicted "
+                f"entries, {swept['temp_files']} temporary files, {format_size(swept['bytes_freed'])} freed"))
+
+        usage = caching.get_file_cache_usage()
+        budget = caching.layer_cache.file.budget
+        total = sum(layer['bytes'] for layer in usage.values())
+
+        self.stdout.write(f"{'Layer':<40} {'Entries':>8} {'Size':>10} {'Quota':>6} {'Stale':>10}  "
+                          f"{'Last used':<16}  {'Oldest':<16}")
+        # Largest first, entries of no layer (tiles, previews) last
+        for layer_id, layer in sorted(usage.items(), key=lambda item: (item[0] is None, -item[1]['bytes'])):
+            if layer_id is None:
+                label = "(other entries)"
+            else:
+                label = f"{layer_id} {names.get(layer_id, '(deleted layer)')}"
+            stale = sum(size for version, size in layer['versions'].items()
+                        if layer_id is not None and version != versions.get(layer_id))
+            self.stdout.write(f"{label[:40]:<40} {layer['entries']:>8} {format_size(layer['bytes']):>10} "
+                              f"{100 * layer['bytes'] / budget:>5.1f}% {format_size(stale):>10}  "
+                              f"{format_time(layer['last_used']):<16}  {format_time(layer['oldest']):<16}")
+
+        entries = sum(layer['entries'] for layer in usage.values())
+        self.stdout.write(f"Total: {entries} entries, {format_size(total)} of {format_size(budget)} "
+                          f"({100 * total / budget:.1f}%) in {caching.FILE_CACHE_DIR}")
@@ -0,0 +1,38 @@
+"""
+Run the post-processing pipeline of shapefile map layers in this process.
+
+Usage:
+    python manage.py process_layers <layer_id> [<layer_id> ...]
+    python manage.py process_layers --unfinished
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from maps.models import MapLayer
+from maps.processing import run_layer_pipeline
+
+
+class Command(BaseCommand):
+    help = "Extract shapefile map layers and rebuild their indexes and generalized versions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('layer_ids', nargs='*', type=int, help="Ids of the shapefile layers to process")
+        parser.add_argument('--unfinished', action='store_true',
+                            help="Process the layers left pending or processing, e.g. by a restart")
+
+    def handle(self, *args, **options):
+        layers = MapLayer.objects.filter(layer_type='shapefile').exclude(file='')
+        if options['unfinished']:
+            layers = layers.filter(processing_status__in=['pending', 'processing'])
+        elif options['layer_ids']:
+            layers = layers.filter(id__in=options['layer_ids'])
+            missing = set(options['layer_ids']) - set(layers.values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"Shapefile layers with a file not found: {sorted(missing)}")
+        else:
+            raise CommandError("Give layer ids or --unfinished")
+
+        for layer in layers.order_by('id'):
+            status = run_layer_pipeline(layer.id)
+            style = self.style.SUCCESS if status == 'ready' else self.style.ERROR
+            self.stdout.write(style(f"Layer {layer.name}: {status}"))
@@ -0,0 +1,57 @@
+"""
+Pre-render active shapefile map layers into the file cache at the zoom presets of map.js.
+
+Usage:
+    python manage.py warm_layer_cache [<layer_id> ...] [--zooms 10,12,14,16] [--workers N] [--force]
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from maps.cache_warming import get_warm_zooms, warm_layers
+from maps.models import MapLayer
+
+
+class Command(BaseCommand):
+    help = "Pre-render shapefile map layers at the zoom levels the map requests, so first loads hit the cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('layer_ids', nargs='*', type=int, help="Ids of the layers to warm (default: all active)")
+        parser.add_argument('--zooms', help="Comma-separated zoom levels (default: map reload levels and region zooms)")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Layers rendered in parallel (default: one per CPU)")
+        parser.add_argument('--force', action='store_true', help="Render again when the cache file exists")
+
+    def handle(self, *args, **options):
+        layers = MapLayer.objects.filter(is_active=True, layer_type='shapefile', processing_status='ready')
+        if options['layer_ids']:
+            layers = layers.filter(id__in=options['layer_ids'])
+            missing = set(options['layer_ids']) - set(layers.values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"Active, processed shapefile layers not found: {sorted(missing)}")
+
+        if options['zooms']:
+            try:
+                zooms = sorted({int(zoom) for zoom in options['zooms'].split(',') if zoom.strip()})
+            except ValueError:
+                raise CommandError("--zooms must be a comma-separated list of integers")
+        else:
+            zooms = get_warm_zooms()
+
+        failed = 0
+        for layer, results, error in warm_layers(list(layers.order_by('id')), zooms, options['force'],
+                                                 options['workers']):
+            if error:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"Layer {layer.name}: {error}"))
+                continue
+            warmed = [result for result in results if result['status'] == 'warmed']
+            errors = [result for result in results if result['status'] == 'failed']
+            failed += bool(errors)
+            summary = (f"Layer {layer.name}: {len(warmed)} rendered in {sum(r['seconds'] for r in warmed):.1f}s, "
+                       f"{sum(1 for r in results if r['status'] == 'cached')} already cached")
+            if errors:
+                summary += f", failed at zoom {', '.join(str(r['zoom']) for r in errors)}"
+            self.stdout.write((self.style.ERROR if errors else self.style.SUCCESS)(summary))
+
+        if failed:
+            raise CommandError(f"{failed} layers could not be fully warmed")
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-16 00:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0005_alter_maplayer_onedrive_file_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PropertyLayerFeature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feature_id', models.IntegerField(help_text="Record number of the polygon in the layer's shapefile")),
+                ('properties', models.JSONField(blank=True, default=dict, help_text='Attributes of the polygon')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('layer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='property_features', to='maps.maplayer')),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='layer_features', to='maps.property')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['layer', 'feature_id'], name='maps_proper_layer_i_eabd76_idx')],
+                'unique_together': {('property', 'layer')},
+            },
+        ),
+    ]
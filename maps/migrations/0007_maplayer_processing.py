@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-16 00:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0006_propertylayerfeature'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='maplayer',
+            name='processing_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='maplayer',
+            name='processing_progress',
+            field=models.JSONField(blank=True, default=list, help_text='State of each pipeline stage'),
+        ),
+        migrations.AddField(
+            model_name='maplayer',
+            name='processing_stage',
+            field=models.CharField(blank=True, default='', help_text='Pipeline stage currently running', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='maplayer',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='maplayer',
+            name='stats',
+            field=models.JSONField(blank=True, help_text='Feature count, extent and fields of the shapefile', null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-16 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0007_maplayer_processing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='maplayer',
+            name='content_version',
+            field=models.CharField(blank=True, default='', help_text='Hash of the source files and style, part of cache keys', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='maplayer',
+            name='source_hash',
+            field=models.CharField(blank=True, default='', help_text="MD5 of the layer's source files", max_length=32),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-16 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0008_maplayer_content_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='maplayer',
+            name='processing_attempts',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Times processing was restarted after stalling'),
+        ),
+        migrations.AddField(
+            model_name='maplayer',
+            name='processing_heartbeat',
+            field=models.DateTimeField(blank=True, help_text='Last sign of life of the job processing the layer', null=True),
+        ),
+    ]
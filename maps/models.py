@@ -5,6 +5,9 @@ import os
 
 # Note: Temporarily using regular fields instead of GeoDjango fields
 
+# Components of a shapefile its content version is hashed from
+SHAPEFILE_SOURCE_EXTENSIONS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
 
 class Region(models.Model):
     """Model representing a geographical region"""
@@ -126,6 +129,13 @@ class MapLayer(models.Model):
         ('onedrive', 'OneDrive'),
     ]
     
+    PROCESSING_STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+    
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True, null=True)
     layer_type = models.CharField(max_length=10, choices=LAYER_TYPE_CHOICES)
@@ -153,6 +163,24 @@ class MapLayer(models.Model):
                                     help_text="Directory containing extracted shapefile components")
     style = models.JSONField(blank=True, null=True, help_text="JSON object with style options")
     
+    # Background post-processing of shapefile uploads (see maps.processing)
+    processing_status = models.CharField(max_length=10, choices=PROCESSING_STATUS_CHOICES, default='ready')
+    processing_stage = models.CharField(max_length=50, blank=True, default='',
+                                        help_text="Pipeline stage currently running")
+    processing_progress = models.JSONField(blank=True, default=list, help_text="State of each pipeline stage")
+    processing_error = models.TextField(blank=True, null=True)
+    processing_heartbeat = models.DateTimeField(blank=True, null=True,
+                                                help_text="Last sign of life of the job processing the layer")
+    processing_attempts = models.PositiveSmallIntegerField(default=0,
+                                                           help_text="Times processing was restarted after stalling")
+    stats = models.JSONField(blank=True, null=True, help_text="Feature count, extent and fields of the shapefile")
+    
+    # Versioning of the served content: every cache key and ETag of the layer embeds content_version
+    source_hash = models.CharField(max_length=32, blank=True, default='',
+                                   help_text="MD5 of the layer's source files")
+    content_version = models.CharField(max_length=16, blank=True, default='',
+                                       help_text="Hash of the source files and style, part of cache keys")
+    
     # If the layer is specific to a region, link it to the region
     region = models.ForeignKey(Region, on_delete=models.CASCADE, null=True, blank=True, related_name='layers')
     
@@ -176,21 +204,39 @@ class MapLayer(models.Model):
         # Get the file path before save for comparison
         old_file_path = None
         old_shapefile_dir = None
+        old_content_version = None
         if self.pk:
             try:
                 old_instance = MapLayer.objects.get(pk=self.pk)
                 if old_instance.file:
                     old_file_path = old_instance.file.path if hasattr(old_instance.file, 'path') else None
                 old_shapefile_dir = old_instance.shapefile_dir
+                old_content_version = old_instance.content_version
             except Exception:
                 pass  # Ignore if we can't get old instance
         
+        # Style changes take effect here, source changes once the new files are hashed
+        self.content_version = self.derive_content_version()
+        
         # First save the model to get an ID
         super().save(*args, **kwargs)
         
         import logging
         logger = logging.getLogger(__name__)
         
+        # Uploaded files other than shapefiles are hashed once stored, shapefiles by the pipeline after extraction
+        if self.layer_type != 'shapefile' and self.file and hasattr(self.file, 'path'):
+            if not self.source_hash or old_file_path != self.file.path:
+                self.source_hash = self.compute_source_hash()
+                self.content_version = self.derive_content_version()
+                MapLayer.objects.filter(pk=self.pk).update(source_hash=self.source_hash,
+                                                           content_version=self.content_version)
+        
+        # Entries of the previous version can no longer be reached, so they are dropped
+        if old_content_version and old_content_version != self.content_version:
+            from .caching import clear_layer_cache
+            clear_layer_cache(self.id, keep_version=self.content_version)
+        
         # Process shapefiles if this is a shapefile layer
         if self.layer_type == 'shapefile' and self.file:
             # Conditions to process shapefile:
@@ -225,17 +271,44 @@ class MapLayer(models.Model):
                     logger.info(f"File has changed for layer {self.id}, will reprocess")
                     process_file = True
             
-            # Process the file if needed
+            # A layer already queued for the same file doesn't need a second run
+            if process_file and not file_changed and self.processing_status in ('pending', 'processing'):
+                logger.info(f"Layer {self.id} is already queued for processing")
+                process_file = False
+            
+            # Extraction and derived artifacts are built in the background after commit
             if process_file:
-                try:
-                    self.process_shapefile()
-                except Exception as e:
-                    import traceback
-                    logger.error(f"Error processing shapefile for layer {self.id}: {str(e)}")
-                    logger.error(traceback.format_exc())
+                from .processing import enqueue_layer_processing
+                enqueue_layer_processing(self)
+    
+    def delete(self, *args, **kwargs):
+        """Override delete to drop the layer's cached data"""
+        from .caching import clear_layer_cache
+        
+        layer_id = self.pk
+        result = super().delete(*args, **kwargs)
+        clear_layer_cache(layer_id)
+        return result
     
     def process_shapefile(self):
-        """Process uploaded shapefile (from ZIP or individual .shp file)"""
+        """Extract the uploaded shapefile and build its derived artifacts in this process"""
+        from .processing import run_layer_pipeline
+        
+        if not self.file:
+            raise ValueError("No file attached to layer")
+        return run_layer_pipeline(self.pk)
+    
+    def extract_shapefile(self):
+        """
+        Extract the uploaded shapefile (ZIP or individual .shp file) to the layer directory
+        
+        The upload is read in place when the storage exposes a path, and unpacked
+        to a staging directory that replaces the layer directory once complete,
+        so requests never see a half-extracted layer.
+        
+        Returns:
+            str: The layer directory
+        """
         import os
         import zipfile
         import tempfile
@@ -244,152 +317,191 @@ class MapLayer(models.Model):
         from django.conf import settings
         
         logger = logging.getLogger(__name__)
-        logger.info(f"Processing shapefile for layer {self.id}")
+        logger.info(f"Extracting shapefile for layer {self.id}")
         
         # Make sure file exists and is accessible
         if not self.file:
             logger.error("No file attached to layer")
             raise ValueError("No file attached to layer")
-            
+        
+        filename = os.path.basename(self.file.name)
+        layer_dir = os.path.join(settings.SHAPEFILES_DIR, f'layer_{self.id}')
+        staging_dir = layer_dir + '.extracting'
+        if os.path.exists(staging_dir):
+            shutil.rmtree(staging_dir)
+        os.makedirs(staging_dir)
+        
         try:
-            filename = os.path.basename(self.file.name)
-            
-            # Create a temporary file to handle potential file access issues
             with tempfile.TemporaryDirectory() as temp_dir:
-                # Save file to temporary location first to ensure we can access it
-                temp_file_path = os.path.join(temp_dir, filename)
-                with open(temp_file_path, 'wb') as destination:
-                    for chunk in self.file.chunks():
-                        destination.write(chunk)
-                
-                logger.info(f"Processing file: {filename} (saved to temp location)")
+                try:
+                    source_path = self.file.path
+                except NotImplementedError:
+                    source_path = None
+                if not source_path or not os.path.exists(source_path):
+                    # Storage without local paths: copy the upload to a temporary file first
+                    source_path = os.path.join(temp_dir, filename)
+                    with open(source_path, 'wb') as destination:
+                        for chunk in self.file.chunks():
+                            destination.write(chunk)
                 
-                # Use the predefined directory from settings
-                layer_dir = os.path.join(settings.SHAPEFILES_DIR, f'layer_{self.id}')
-                if os.path.exists(layer_dir):
-                    # Remove existing directory if it exists
-                    shutil.rmtree(layer_dir)
-                    
-                os.makedirs(layer_dir, exist_ok=True)
-                logger.info(f"Created layer directory: {layer_dir}")
+                logger.info(f"Processing file: {filename} from {source_path}")
                 
                 # Handle ZIP files with shapefile components
                 if filename.lower().endswith('.zip'):
-                    logger.info(f"Extracting ZIP file to {layer_dir}")
+                    logger.info(f"Extracting ZIP file to {staging_dir}")
                     try:
                         # Validate the ZIP file integrity
-                        if not zipfile.is_zipfile(temp_file_path):
-                            logger.error(f"The file is not a valid ZIP file: {temp_file_path}")
+                        if not zipfile.is_zipfile(source_path):
+                            logger.error(f"The file is not a valid ZIP file: {source_path}")
                             raise ValueError("The uploaded file is not a valid ZIP archive")
-                            
-                        # List the contents before extraction for debugging
-                        try:
-                            with zipfile.ZipFile(temp_file_path, 'r') as zip_ref:
-                                file_list = zip_ref.namelist()
-                                logger.info(f"ZIP file contains {len(file_list)} files: {file_list}")
-                                
-                                # Check for shapefile components in the ZIP
-                                shp_files_in_zip = [f for f in file_list if f.lower().endswith('.shp')]
-                                logger.info(f"SHP files in ZIP: {shp_files_in_zip}")
-                                
-                                # Check if the zip contains any nested directories
-                                has_dirs = any('/' in f for f in file_list)
-                                logger.info(f"ZIP contains nested directories: {has_dirs}")
-                                
-                                # Extract all files
-                                zip_ref.extractall(layer_dir)
-                                logger.info(f"Successfully extracted ZIP to {layer_dir}")
-                        except Exception as zip_ex:
-                            logger.error(f"Error examining ZIP contents: {str(zip_ex)}")
-                            raise ValueError(f"Error processing ZIP contents: {str(zip_ex)}")
-                        
-                        # Verify the extracted files
-                        all_extracted = os.listdir(layer_dir)
-                        logger.info(f"Extracted files: {all_extracted}")
                         
-                        # Find shapefile components recursively if needed
-                        import glob
-                        shp_files = glob.glob(os.path.join(layer_dir, '**', '*.shp'), recursive=True)
-                        if not shp_files:
-                            logger.error(f"No .shp files found in extracted ZIP contents")
-                            raise ValueError("No .shp file found in the ZIP archive")
-                            
-                        logger.info(f"Found shapefile(s) in ZIP: {shp_files}")
+                        with zipfile.ZipFile(source_path, 'r') as zip_ref:
+                            file_list = zip_ref.namelist()
+                            logger.info(f"ZIP file contains {len(file_list)} files: {file_list}")
+                            zip_ref.extractall(staging_dir)
+                            logger.info(f"Successfully extracted ZIP to {staging_dir}")
                     except zipfile.BadZipFile as e:
                         logger.error(f"Bad ZIP file: {str(e)}")
                         raise ValueError(f"Invalid ZIP file: {str(e)}")
+                    
+                    # Find shapefile components recursively if needed
+                    import glob
+                    shp_files = glob.glob(os.path.join(staging_dir, '**', '*.shp'), recursive=True)
+                    if not shp_files:
+                        logger.error(f"No .shp files found in extracted ZIP contents")
+                        raise ValueError("No .shp file found in the ZIP archive")
+                    logger.info(f"Found shapefile(s) in ZIP: {shp_files}")
                 else:
-                    # For individual .shp files, try to find related files in the same directory
+                    # For individual .shp files, companion files would have been uploaded separately
                     logger.info(f"Processing individual .shp file: {filename}")
+                    shutil.copy(source_path, os.path.join(staging_dir, filename))
                     
-                    # Copy the shapefile itself to the final location
-                    shutil.copy(temp_file_path, os.path.join(layer_dir, filename))
-                    
-                    # Since individual .shp files require companion files that would have been
-                    # uploaded separately, we'll log a warning but continue
-                    logger.warning(f"Uploaded single .shp file without companion files. Functionality may be limited.")
-                
-                # For individual .shp files, verify we have essential files
-                if filename.lower().endswith('.shp'):
                     base_name = os.path.splitext(filename)[0]
-                    if not os.path.exists(os.path.join(layer_dir, base_name + '.dbf')) or \
-                       not os.path.exists(os.path.join(layer_dir, base_name + '.shx')):
-                        logger.warning(f"Missing required related files for shapefile {filename}")
+                    if not os.path.exists(os.path.join(staging_dir, base_name + '.dbf')) or \
+                       not os.path.exists(os.path.join(staging_dir, base_name + '.shx')):
+                        logger.warning(f"Uploaded single .shp file without companion files. Functionality may be limited.")
             
-            # Update the model with the directory path
-            self.shapefile_dir = layer_dir
-            logger.info(f"Shapefile directory set to: {layer_dir}")
-            super().save(update_fields=['shapefile_dir'])
-            
-        except Exception as e:
-            logger.error(f"Error processing shapefile: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
+            # Swap the complete extraction in, dropping the previous files and sidecars
+            if os.path.exists(layer_dir):
+                shutil.rmtree(layer_dir)
+            os.rename(staging_dir, layer_dir)
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
             raise
         
-    def get_geojson_data(self, simplify='auto', max_features=None):
+        # Update the model with the directory path
+        self.shapefile_dir = layer_dir
+        MapLayer.objects.filter(pk=self.pk).update(shapefile_dir=layer_dir)
+        logger.info(f"Shapefile directory set to: {layer_dir}")
+        return layer_dir
+
+    def get_shapefile_path(self):
+        """Return the path of the first .shp file in the layer directory, or None"""
+        import glob
+
+        if not self.shapefile_dir or not os.path.isdir(self.shapefile_dir):
+            return None
+        shp_files = glob.glob(os.path.join(self.shapefile_dir, '**', '*.shp'), recursive=True)
+        return sorted(shp_files)[0] if shp_files else None
+
+    def get_field_names(self):
         """
-        Convert shapefile to GeoJSON for web display with simplification options
-        
-        Args:
-            simplify (str or float): 'auto' for automatic simplification based on size,
-                                    or a float between 0-1 for manual simplification level,
-                                    or None for no simplification
-            max_features (int): Maximum number of features to include in the output
+        Get the attribute names of a shapefile layer
         
         Returns:
-            str: GeoJSON string or None if error
+            list: Field names in .dbf order, or None if the shapefile is unavailable
         """
-        import logging
-        logger = logging.getLogger(__name__)
+        import shapefile
         
-        # Handle different layer types
-        if self.layer_type == 'geojson' and self.file:
-            # If it's a GeoJSON file, just return the file content
-            try:
-                logger.info(f"Reading GeoJSON file for layer {self.id}: {self.file.path}")
-                with open(self.file.path, 'r') as f:
-                    return f.read()
-            except Exception as e:
-                logger.error(f"Error reading GeoJSON file: {e}")
-                import traceback
-                logger.error(traceback.format_exc())
-                return None
-                
-        # For shapefiles, handle both local and OneDrive storage
-        if self.layer_type != 'shapefile':
-            logger.warning(f"Cannot generate GeoJSON for layer {self.id}: not a shapefile layer")
+        shapefile_path = self.get_shapefile_path()
+        if not shapefile_path:
             return None
-            
-        import os
+        reader = shapefile.Reader(shapefile_path)
+        try:
+            return [field[0] for field in reader.fields[1:]]  # Skip DeletionFlag
+        finally:
+            reader.close()
+
+    def compute_source_hash(self):
+        """
+        Hash the content of the layer's source files (the shapefile's components, or the uploaded file)
+        
+        Returns:
+            str: MD5 hex digest, or '' if the source files are unavailable
+        """
+        import hashlib
+        
+        paths = []
+        shapefile_path = self.get_shapefile_path() if self.layer_type == 'shapefile' else None
+        if shapefile_path:
+            # Only the shapefile's own components, not the sidecars derived from them
+            stem = os.path.splitext(shapefile_path)[0]
+            directory = os.path.dirname(shapefile_path)
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                base, ext = os.path.splitext(path)
+                if base == stem and ext.lower() in SHAPEFILE_SOURCE_EXTENSIONS and os.path.isfile(path):
+                    paths.append(path)
+        elif self.file and os.path.exists(getattr(self.file, 'path', '') or ''):
+            paths.append(self.file.path)
+        if not paths:
+            return ''
+        
+        digest = hashlib.md5()
+        for path in paths:
+            digest.update(os.path.splitext(path)[1].lower().encode())
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+        return digest.hexdigest()
+    
+    def derive_content_version(self):
+        """Get the content version of the layer's source hash and the settings its output depends on"""
+        import hashlib
         import json
+        
+        if not self.source_hash:
+            return ''
+        parts = [self.source_hash, self.layer_type, json.dumps(self.style, sort_keys=True)]
+        return hashlib.md5(':'.join(parts).encode()).hexdigest()[:16]
+    
+    def get_content_version(self):
+        """
+        Get a version string that changes whenever the layer's served content can change
+        
+        Returns:
+            str: content_version, or for layers not hashed yet a short hash of
+                 the layer's last update and its source file state
+        """
+        import hashlib
+        
+        if self.content_version:
+            return self.content_version
+        parts = [self.updated_at.isoformat() if self.updated_at else '', self.layer_type]
+        source_path = self.get_shapefile_path() if self.layer_type == 'shapefile' else None
+        if not source_path and self.file:
+            source_path = getattr(self.file, 'path', None)
+        if source_path and os.path.exists(source_path):
+            stat = os.stat(source_path)
+            parts += [source_path, str(stat.st_mtime_ns), str(stat.st_size)]
+        return hashlib.md5(':'.join(parts).encode()).hexdigest()[:16]
+
+    def get_local_shapefile(self):
+        """
+        Get the path of the layer's .shp file, downloading it from OneDrive first if needed
+        
+        Returns:
+            str: Path to the .shp file or None if unavailable
+        """
+        import logging
         import glob
         import tempfile
         import zipfile
         import requests
-        from datetime import date, datetime
         from django.conf import settings
         
+        logger = logging.getLogger(__name__)
+        
         # For OneDrive storage, we need to download and process the file first
         if self.storage_type == 'onedrive' and self.onedrive_file_url and not self.shapefile_dir:
             try:
@@ -460,75 +572,143 @@ class MapLayer(models.Model):
                     all_files.append(os.path.join(root, file).replace(self.shapefile_dir, '').lstrip('/\\'))
             logger.info(f"All files in directory tree: {all_files}")
             return None
+        
+        return sorted(shp_files)[0]
+    
+    def get_geojson_data(self, simplify='auto', max_features=None, zoom=None, fields=None, where=None):
+        """
+        Convert shapefile to GeoJSON for web display with simplification options
+        
+        Args:
+            simplify (str or float): 'auto' for automatic simplification of large layers
+                                    to the zoom fitting their extent, or a float tolerance in coordinate units,
+                                    or None for no simplification
+            max_features (int): Maximum number of features to include in the output
+            zoom (int): Zoom level the data is displayed at; when given the
+                        simplification tolerance is derived from it (about one pixel)
+            fields (list): Attribute names to include; only these .dbf columns
+                           are decoded (all attributes when None)
+            where (str): Attribute filter (see maps.attribute_index.parse_where);
+                         only the matching records are read
+        
+        Returns:
+            str: GeoJSON string or None if error
+        """
+        import logging
+        logger = logging.getLogger(__name__)
+        
+        # Handle different layer types
+        if self.layer_type == 'geojson' and self.file:
+            # If it's a GeoJSON file, just return the file content
+            try:
+                logger.info(f"Reading GeoJSON file for layer {self.id}: {self.file.path}")
+                with open(self.file.path, 'r') as f:
+                    return f.read()
+            except Exception as e:
+                logger.error(f"Error reading GeoJSON file: {e}")
+                import traceback
+                logger.error(traceback.format_exc())
+                return None
+                
+        # For shapefiles, handle both local and OneDrive storage
+        if self.layer_type != 'shapefile':
+            logger.warning(f"Cannot generate GeoJSON for layer {self.id}: not a shapefile layer")
+            return None
+        
+        shp_file = self.get_local_shapefile()
+        if not shp_file:
+            return None
             
         try:
-            # Use pyshp (shapefile) library to convert to GeoJSON
-            import shapefile
-            
-            shp_file = shp_files[0]
-            logger.info(f"Processing shapefile: {shp_file}")
-            
-            # Read the shapefile
-            sf = shapefile.Reader(shp_file)
+            # Convert to JSON string
+            result_json = ''.join(self.iter_geojson_data(shp_file, simplify, max_features, zoom, fields, where))
             
-            # Convert to GeoJSON
-            geojson = {"type": "FeatureCollection", "features": []}
+            # Log total string size for debugging
+            logger.info(f"GeoJSON size: {len(result_json) / (1024 * 1024):.2f} MB")
             
-            # Custom JSON serializer to handle dates
-            def json_serial(obj):
-                if isinstance(obj, (datetime, date)):
-                    return obj.isoformat()
-                raise TypeError(f"Type {type(obj)} not serializable")
+            return result_json
             
-            # Get total number of shapes
-            total_shapes = len(sf.shapes())
+        except Exception as e:
+            # Log the error
+            logger.error(f"Error converting shapefile to GeoJSON: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+            return None
+    
+    def stream_geojson_data(self, simplify='auto', max_features=None, zoom=None, fields=None, where=None):
+        """
+        Same as get_geojson_data for shapefile layers, but returns an iterator of
+        GeoJSON text pieces so the whole layer is never held in memory
+        
+        Returns:
+            iterator: GeoJSON text pieces, or None if the shapefile is unavailable
+        """
+        if self.layer_type != 'shapefile':
+            return None
+        
+        shp_file = self.get_local_shapefile()
+        if not shp_file:
+            return None
+        
+        return self.iter_geojson_data(shp_file, simplify, max_features, zoom, fields, where)
+    
+    def iter_geojson_data(self, shp_file, simplify='auto', max_features=None, zoom=None, fields=None, where=None):
+        """
+        Generate the GeoJSON FeatureCollection of a shapefile piece by piece
+        
+        Records are read one at a time and each feature is serialized as soon as
+        it is produced; the collection info comes last, once the counts are known.
+        When max_features samples the layer, only the sampled records are read.
+        
+        Args:
+            shp_file (str): Path to the .shp file
+            simplify, max_features, zoom, fields, where: See get_geojson_data
+        
+        Yields:
+            str: Consecutive pieces of the GeoJSON text
+        """
+        import json
+        import logging
+        from datetime import date, datetime
+        
+        # Use pyshp (shapefile) library to convert to GeoJSON
+        import shapefile
+        from .simplification import resolve_tolerance, simplify_geometry
+        
+        logger = logging.getLogger(__name__)
+        logger.info(f"Processing shapefile: {shp_file}")
+        
+        # Custom JSON serializer to handle dates
+        def json_serial(obj):
+            if isinstance(obj, (datetime, date)):
+                return obj.isoformat()
+            raise TypeError(f"Type {type(obj)} not serializable")
+        
+        # Read the shapefile
+        sf = shapefile.Reader(shp_file)
+        try:
+            # Get total number of shapes (from the header, without reading any shape)
+            total_shapes = len(sf)
             logger.info(f"Processing {total_shapes} shapes from shapefile")
             
-            # Determine simplification level based on number of shapes and zoom level
-            simplify_factor = None
-            
-            # Get zoom level from request if available
-            zoom_level = None
+            # Get zoom level from the argument or the request if available
+            zoom_level = zoom
             try:
                 # Check if we're being called from a view with request.GET
-                if 'zoom' in self._current_request.GET:
+                if zoom_level is None and 'zoom' in self._current_request.GET:
                     zoom_level = int(self._current_request.GET.get('zoom'))
                     logger.info(f"Using zoom level from request: {zoom_level}")
             except (AttributeError, ValueError):
                 # No zoom level available or invalid
                 pass
-                
-            if simplify == 'auto':
-                # Base simplification on feature count
-                if total_shapes > 500000:
-                    simplify_factor = 0.01  # Very aggressive simplification for huge files
-                elif total_shapes > 100000:
-                    simplify_factor = 0.005  # High simplification for large files
-                elif total_shapes > 50000:
-                    simplify_factor = 0.001  # Medium simplification
-                elif total_shapes > 10000:
-                    simplify_factor = 0.0005  # Light simplification
-                
-                # Adjust based on zoom level if available
-                if zoom_level is not None:
-                    if zoom_level <= 10:
-                        # Further out - more simplification
-                        simplify_factor = max(simplify_factor * 2, 0.01)
-                    elif zoom_level >= 16:
-                        # Zoomed in - less simplification
-                        simplify_factor = min(simplify_factor / 4, 0.0001)
-                    elif zoom_level >= 14:
-                        # Somewhat zoomed in - moderate simplification
-                        simplify_factor = min(simplify_factor / 2, 0.0005)
             
-            elif simplify and simplify not in ['none', 'false', '0']:
-                try:
-                    simplify_factor = float(simplify)
-                except (ValueError, TypeError):
-                    pass
+            # Determine the simplification tolerance (in coordinate units)
+            layer_extent = tuple(sf.bbox) if total_shapes else None
+            layer_latitude = (sf.bbox[1] + sf.bbox[3]) / 2 if total_shapes else 0.0
+            simplify_tolerance = resolve_tolerance(simplify, total_shapes, zoom_level, layer_latitude, layer_extent)
                     
-            if simplify_factor:
-                logger.info(f"Using simplification factor: {simplify_factor}")
+            if simplify_tolerance:
+                logger.info(f"Using simplification tolerance: {simplify_tolerance}")
             
             # Determine number of features to include
             feature_limit = None
@@ -539,18 +719,40 @@ class MapLayer(models.Model):
                 except (ValueError, TypeError):
                     pass
                     
+            # Restrict the layer to the records matching the attribute filter
+            record_ids = None
+            matching_shapes = total_shapes
+            if where:
+                from .attribute_index import select_records
+                record_ids = select_records(shp_file, where)
+                matching_shapes = len(record_ids)
+                logger.info(f"Filter {where!r} matches {matching_shapes} of {total_shapes} records")
+            
             # Process shapes with potential subsampling
             feature_count = 0
             step = 1
-            if feature_limit and total_shapes > feature_limit:
-                step = max(1, int(total_shapes / feature_limit))
+            if feature_limit and matching_shapes > feature_limit:
+                step = max(1, int(matching_shapes / feature_limit))
                 logger.info(f"Taking every {step}th feature due to feature limit")
-                
-            shapes_to_process = sf.shapeRecords()
-            if step > 1:
-                shapes_to_process = shapes_to_process[::step]
             
-            for shape_rec in shapes_to_process:
+            # Skip DeletionFlag; with a projection only the requested columns are decoded
+            field_names = [field_info[0] for field_info in sf.fields[1:] if fields is None or field_info[0] in fields]
+            geometry_counts = {'Polygon': 0, 'Line': 0, 'Point': 0}
+            
+            yield '{"type": "FeatureCollection", "features": ['
+            
+            if record_ids is not None:
+                # Only the matching records are read, through the .shx offsets
+                shape_records = (sf.shapeRecord(int(i), fields=fields) for i in record_ids[::step])
+            elif step > 1:
+                # Seek straight to the sampled records through the .shx offsets
+                # (and the matching fixed-size .dbf rows) instead of reading every record
+                shape_records = (sf.shapeRecord(i, fields=fields) for i in range(0, total_shapes, step))
+            else:
+                # Records are read one at a time instead of materializing them all
+                shape_records = sf.iterShapeRecords(fields=fields)
+            
+            for shape_rec in shape_records:
                 # Skip null geometries
                 if not shape_rec.shape.points:
                     continue
@@ -560,19 +762,11 @@ class MapLayer(models.Model):
                     # Get the geometry interface (will be simplified if needed)
                     geometry = shape_rec.shape.__geo_interface__
                     
-                    # Apply simplification if enabled and we have a polygon or line
-                    if simplify_factor and geometry['type'] in ['Polygon', 'MultiPolygon', 'LineString', 'MultiLineString']:
-                        # Simple point count-based simplification for polygons and lines
-                        # More sophisticated algorithms would use libraries like shapely or topojson
-                        if geometry['type'] in ['Polygon', 'LineString']:
-                            if len(geometry['coordinates'][0]) > 10:
-                                step = max(1, int(len(geometry['coordinates'][0]) * simplify_factor))
-                                geometry['coordinates'][0] = geometry['coordinates'][0][::step]
-                        elif geometry['type'] in ['MultiPolygon', 'MultiLineString']:
-                            for i, poly in enumerate(geometry['coordinates']):
-                                if len(poly[0]) > 10:
-                                    step = max(1, int(len(poly[0]) * simplify_factor))
-                                    geometry['coordinates'][i][0] = poly[0][::step]
+                    # Apply tolerance-based simplification to every ring and part
+                    if simplify_tolerance:
+                        geometry = simplify_geometry(geometry, simplify_tolerance)
+                        if geometry is None:
+                            continue
                     
                     feature = {
                         "type": "Feature",
@@ -581,10 +775,7 @@ class MapLayer(models.Model):
                     }
                     
                     # Add all attributes
-                    for field_idx, field_info in enumerate(sf.fields[1:]):  # Skip DeletionFlag
-                        field_name = field_info[0]  # Get the name from the field descriptor
-                        value = shape_rec.record[field_idx]
-                        
+                    for field_name, value in zip(field_names, shape_rec.record):
                         # Handle binary data (convert to string)
                         if isinstance(value, bytes):
                             try:
@@ -594,54 +785,70 @@ class MapLayer(models.Model):
                                 
                         feature["properties"][field_name] = value
                     
-                    # Add feature if valid
-                    geojson["features"].append(feature)
-                    feature_count += 1
-                    
-                    # Break if we've reached feature limit
-                    if feature_limit and feature_count >= feature_limit:
-                        logger.info(f"Reached feature limit of {feature_limit}")
-                        break
-                        
+                    feature_json = json.dumps(feature, default=json_serial)
                 except Exception as feature_error:
                     logger.error(f"Error processing feature: {feature_error}")
                     continue
                 
+                # Add feature if valid
+                yield feature_json if feature_count == 0 else ', ' + feature_json
+                feature_count += 1
+                
+                if geometry['type'] in ('Polygon', 'MultiPolygon'):
+                    geometry_counts['Polygon'] += 1
+                elif geometry['type'] in ('LineString', 'MultiLineString'):
+                    geometry_counts['Line'] += 1
+                elif geometry['type'] == 'Point':
+                    geometry_counts['Point'] += 1
+                
+                # Break if we've reached feature limit
+                if feature_limit and feature_count >= feature_limit:
+                    logger.info(f"Reached feature limit of {feature_limit}")
+                    break
+            
+            yield ']'
+                
             # Add metadata if available
             if hasattr(sf, 'meta'):
-                geojson["metadata"] = sf.meta
+                yield ', "metadata": ' + json.dumps(sf.meta, default=json_serial)
                 
             # Add style information from the model if available
             if self.style:
-                geojson["style"] = self.style
+                yield ', "style": ' + json.dumps(self.style)
                 
             # Add info about simplification and feature counts
-            geojson["info"] = {
-                "total_features": total_shapes,
+            info = {
+                "total_features": matching_shapes,
                 "included_features": feature_count,
-                "simplification": simplify_factor if simplify_factor else "none"
+                "simplification": simplify_tolerance if simplify_tolerance else "none"
             }
+            yield ', "info": ' + json.dumps(info) + '}'
                 
-            # Return as JSON string with detailed logging
-            logger.info(f"Successfully converted shapefile with {feature_count} features (from {total_shapes} total)")
-            logger.info(f"Polygon count: {len([f for f in geojson['features'] if f['geometry']['type'] in ['Polygon', 'MultiPolygon']])}")
-            logger.info(f"Line count: {len([f for f in geojson['features'] if f['geometry']['type'] in ['LineString', 'MultiLineString']])}")
-            logger.info(f"Point count: {len([f for f in geojson['features'] if f['geometry']['type'] == 'Point'])}")
-            
-            # Convert to JSON string
-            result_json = json.dumps(geojson, default=json_serial)
-            
-            # Log total string size for debugging
-            logger.info(f"GeoJSON size: {len(result_json) / (1024 * 1024):.2f} MB")
-            
-            return result_json
-            
-        except Exception as e:
-            # Log the error
-            logger.error(f"Error converting shapefile to GeoJSON: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
-            return None
+            # Detailed logging
+            logger.info(f"Successfully converted shapefile with {feature_count} features (from {matching_shapes} total)")
+            logger.info(f"Polygon count: {geometry_counts['Polygon']}")
+            logger.info(f"Line count: {geometry_counts['Line']}")
+            logger.info(f"Point count: {geometry_counts['Point']}")
+        finally:
+            sf.close()
         
     class Meta:
         ordering = ['-z_index', 'name']
+
+
+class PropertyLayerFeature(models.Model):
+    """Polygon of a map layer that a property falls in, precomputed by a spatial join"""
+    property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='layer_features')
+    layer = models.ForeignKey(MapLayer, on_delete=models.CASCADE, related_name='property_features')
+    feature_id = models.IntegerField(help_text="Record number of the polygon in the layer's shapefile")
+    properties = models.JSONField(default=dict, blank=True, help_text="Attributes of the polygon")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ('property', 'layer')
+        indexes = [
+            models.Index(fields=['layer', 'feature_id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.property} in {self.layer.name} #{self.feature_id}"
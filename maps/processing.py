@@ -0,0 +1,300 @@
+"""
+Background post-processing pipeline for shapefile layers.
+
+Saving an uploaded shapefile layer only stores the upload. Extraction and every
+derived artifact (statistics, content version, spatial index, geometry store,
+chunk manifest, attribute index, generalization pyramid, warmed map cache) are built afterwards
+by run_layer_pipeline, outside the request. Each stage records its state in the
+layer's processing_progress, which the layer form polls through
+/api/layer/<id>/status/.
+
+Jobs are queued once the saving transaction commits and run on a small thread
+pool in the web process (LAYER_PROCESSING_WORKERS threads). With
+LAYER_PROCESSING_ASYNC = False they run inline instead, and
+`manage.py process_layers` runs layers a restart left pending.
+
+A running pipeline refreshes the layer's processing_heartbeat. When the web
+process dies mid-job (e.g. a recycled worker), the heartbeat stops and the
+layer's status and data requests find it stale: it is processed again, or
+marked failed once it has stalled MAX_PROCESSING_ATTEMPTS times.
+"""
+
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+import shapefile
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from maps.attribute_index import build_attribute_index
+from maps.caching import clear_layer_cache
+from maps.cache_warming import get_warm_zooms, warm_layer
+from maps.chunking import build_chunk_manifest
+from maps.geometry_store import build_geometry_store
+from maps.pyramid import build_pyramid
+from maps.spatial_index import build_spatial_index
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Pipeline configuration
+DEFAULT_PROCESSING_WORKERS = 1  # Layers processed at once per web process
+FINISHED_STAGE_STATUSES = ('done', 'failed', 'skipped')
+HEARTBEAT_INTERVAL = 30  # Seconds between heartbeats of a running pipeline
+DEFAULT_STALE_AFTER = 60 * 5  # Seconds without a heartbeat after which a processing layer is stale
+MAX_PROCESSING_ATTEMPTS = 2  # Runs of a stalling layer before it is marked failed
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def compute_layer_stats(shapefile_path):
+    """
+    Summarize a shapefile from its headers
+
+    Returns:
+        dict: feature_count, shape_type, bbox and fields
+    """
+    reader = shapefile.Reader(shapefile_path)
+    try:
+        return {
+            'feature_count': len(reader),
+            'shape_type': reader.shapeTypeName,
+            'bbox': [float(value) for value in reader.bbox] if len(reader) else None,
+            'fields': [field[0] for field in reader.fields[1:]],  # Skip DeletionFlag
+        }
+    finally:
+        reader.close()
+
+
+def _extract(layer):
+    layer.extract_shapefile()
+    if not layer.get_shapefile_path():
+        raise ValueError("No .shp file found in the upload")
+
+
+def _stats(layer):
+    layer.stats = compute_layer_stats(layer.get_shapefile_path())
+    type(layer).objects.filter(pk=layer.pk).update(stats=layer.stats)
+
+
+def _content_version(layer):
+    layer.source_hash = layer.compute_source_hash()
+    layer.content_version = layer.derive_content_version()
+    type(layer).objects.filter(pk=layer.pk).update(source_hash=layer.source_hash,
+                                                   content_version=layer.content_version)
+    # Entries of earlier uploads are keyed by other versions and can't be read anymore
+    clear_layer_cache(layer.pk, keep_version=layer.content_version)
+
+
+def _warm_cache(layer):
+    # Entries still cached for the same content version are kept
+    results = warm_layer(layer, get_warm_zooms(), shapefile_path=layer.get_shapefile_path())
+    errors = [result['error'] for result in results if result['status'] == 'failed']
+    if errors:
+        raise ValueError(errors[0])
+
+
+def _artifact(builder):
+    return lambda layer: builder(layer.get_shapefile_path())
+
+
+# (name, label, runner, required): a failed required stage fails the layer, the
+# other stages are optimizations the layer stays usable without
+STAGES = [
+    ('extract', 'Extracting files', _extract, True),
+    ('stats', 'Reading statistics', _stats, True),
+    ('content_version', 'Hashing source files', _content_version, False),
+    ('spatial_index', 'Building spatial index', _artifact(build_spatial_index), False),
+    ('geometry_store', 'Building geometry store', _artifact(build_geometry_store), False),
+    ('chunk_manifest', 'Building chunk manifest', _artifact(build_chunk_manifest), False),
+    ('attribute_index', 'Indexing attributes', _artifact(build_attribute_index), False),
+    ('pyramid', 'Generalizing for zoom levels', _artifact(build_pyramid), False),
+    ('cache', 'Warming map cache', _warm_cache, False),
+]
+
+
+def initial_progress():
+    """Get the progress of a pipeline that hasn't started"""
+    return [{'name': name, 'label': label, 'status': 'pending'} for name, label, _, _ in STAGES]
+
+
+def get_progress_percent(progress):
+    """Get the share of finished stages, from 0 to 100"""
+    if not progress:
+        return 0
+    finished = sum(1 for stage in progress if stage.get('status') in FINISHED_STAGE_STATUSES)
+    return round(100 * finished / len(progress))
+
+
+@contextmanager
+def _heartbeat(layer_id):
+    """Refresh the layer's processing_heartbeat from a thread while the block runs."""
+    from maps.models import MapLayer
+
+    stopped = threading.Event()
+
+    def beat():
+        try:
+            while not stopped.wait(HEARTBEAT_INTERVAL):
+                MapLayer.objects.filter(pk=layer_id, processing_status='processing').update(
+                    processing_heartbeat=timezone.now())
+        except Exception as e:
+            logger.warning(f"Heartbeat of layer {layer_id} stopped: {str(e)}")
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, name=f'layer-heartbeat-{layer_id}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def run_layer_pipeline(layer_id):
+    """
+    Extract a shapefile layer and build its derived artifacts, recording per-stage progress
+
+    Args:
+        layer_id: ID of the MapLayer to process
+
+    Returns:
+        str: Final processing status ('ready' or 'failed')
+    """
+    from maps.models import MapLayer
+
+    layer = MapLayer.objects.get(pk=layer_id)
+    progress = initial_progress()
+    MapLayer.objects.filter(pk=layer_id).update(processing_status='processing', processing_stage='',
+                                                processing_progress=progress, processing_error=None,
+                                                processing_heartbeat=timezone.now())
+    logger.info(f"Processing layer {layer_id} in {len(STAGES)} stages")
+
+    status, error = 'ready', None
+    with _heartbeat(layer_id):
+        for stage, (name, label, runner, required) in zip(progress, STAGES):
+            if error:
+                stage['status'] = 'skipped'
+                continue
+
+            stage['status'] = 'running'
+            stage['started_at'] = timezone.now().isoformat()
+            MapLayer.objects.filter(pk=layer_id).update(processing_stage=name, processing_progress=progress,
+                                                        processing_heartbeat=timezone.now())
+
+            started = time.monotonic()
+            try:
+                runner(layer)
+                stage['status'] = 'done'
+            except Exception as e:
+                stage['status'] = 'failed'
+                stage['error'] = str(e)
+                if required:
+                    logger.exception(f"Stage {name} failed for layer {layer_id}: {str(e)}")
+                    status, error = 'failed', f"{label} failed: {str(e)}"
+                else:
+                    logger.warning(f"Stage {name} failed for layer {layer_id}: {str(e)}")
+            stage['seconds'] = round(time.monotonic() - started, 3)
+            MapLayer.objects.filter(pk=layer_id).update(processing_progress=progress)
+
+    # Bumping updated_at also changes the fallback content version of layers whose files couldn't be hashed
+    MapLayer.objects.filter(pk=layer_id).update(processing_status=status, processing_stage='',
+                                                processing_progress=progress, processing_error=error,
+                                                updated_at=timezone.now())
+    logger.info(f"Finished processing layer {layer_id}: {status}")
+    return status
+
+
+def _run_in_background(layer_id):
+    try:
+        run_layer_pipeline(layer_id)
+    except Exception as e:
+        logger.exception(f"Error processing layer {layer_id}: {str(e)}")
+    finally:
+        # Worker threads hold their own database connections
+        connections.close_all()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'LAYER_PROCESSING_WORKERS', DEFAULT_PROCESSING_WORKERS)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='layer-processing')
+        return _executor
+
+
+def _start(layer_id):
+    if getattr(settings, 'LAYER_PROCESSING_ASYNC', True):
+        _get_executor().submit(_run_in_background, layer_id)
+    else:
+        run_layer_pipeline(layer_id)
+
+
+def enqueue_layer_processing(layer):
+    """
+    Queue a shapefile layer for processing once the current transaction commits
+
+    Args:
+        layer: Saved MapLayer instance
+    """
+    from maps.models import MapLayer
+
+    layer.processing_status = 'pending'
+    layer.processing_stage = ''
+    layer.processing_progress = initial_progress()
+    layer.processing_error = None
+    layer.processing_attempts = 0
+    MapLayer.objects.filter(pk=layer.pk).update(processing_status=layer.processing_status, processing_stage='',
+                                                processing_progress=layer.processing_progress,
+                                                processing_error=None, processing_attempts=0)
+    layer_id = layer.pk
+    transaction.on_commit(lambda: _start(layer_id))
+    logger.info(f"Queued layer {layer_id} for processing")
+
+
+def recover_stale_layer(layer):
+    """
+    Restart the processing of a layer whose job stopped sending heartbeats
+
+    The job was lost with its process (e.g. a recycled web worker), so the layer
+    would stay processing for good. It is queued again, or marked failed once it
+    has stalled MAX_PROCESSING_ATTEMPTS times. Layers left pending by a restart
+    are run by `manage.py process_layers --unfinished`.
+
+    Args:
+        layer: MapLayer instance, updated in place when recovered
+
+    Returns:
+        bool: Whether the layer was stale
+    """
+    from maps.models import MapLayer
+
+    if layer.processing_status != 'processing':
+        return False
+    stale_after = getattr(settings, 'LAYER_PROCESSING_STALE_AFTER', DEFAULT_STALE_AFTER)
+    if layer.processing_heartbeat and timezone.now() - layer.processing_heartbeat < timedelta(seconds=stale_after):
+        return False
+
+    # Only the request whose update finds the same heartbeat recovers the layer
+    claimed = MapLayer.objects.filter(pk=layer.pk, processing_status='processing',
+                                      processing_heartbeat=layer.processing_heartbeat)
+    if layer.processing_attempts + 1 >= MAX_PROCESSING_ATTEMPTS:
+        error = f"Processing stopped responding {layer.processing_attempts + 1} times"
+        if claimed.update(processing_status='failed', processing_stage='', processing_error=error):
+            logger.error(f"Layer {layer.pk} stalled while processing, marked failed")
+    else:
+        if claimed.update(processing_status='pending', processing_stage='', processing_progress=initial_progress(),
+                          processing_heartbeat=timezone.now(), processing_attempts=F('processing_attempts') + 1):
+            logger.warning(f"Layer {layer.pk} stalled while processing, queued again")
+            _start(layer.pk)
+    layer.refresh_from_db()
+    return True
@@ -0,0 +1,78 @@
+"""
+Protocol buffer wire format writers shared by the binary layer encodings.
+
+Vector tiles (maps/vector_tiles.py) and Geobuf (maps/geobuf.py) are written
+by hand with these helpers so no protobuf dependency is required. Messages
+are built as bytes: a field is its key (field number and wire type) followed
+by its varint, fixed 64-bit or length-delimited payload.
+"""
+
+import numpy as np
+
+# Wire types
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_BYTES = 2
+
+VECTORIZE_MIN_VALUES = 64  # Shorter runs are varint-encoded in plain Python
+
+
+def varint(value):
+    """Encode an unsigned integer as a protobuf varint."""
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def zigzag(value):
+    """Zigzag-encode a signed integer."""
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def zigzag_array(values):
+    """Zigzag-encode an int64 array."""
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def field_key(field_number, wire_type):
+    """Encode the key of a field."""
+    return varint((field_number << 3) | wire_type)
+
+
+def bytes_field(field_number, payload):
+    """Encode a length-delimited field."""
+    return field_key(field_number, WIRE_BYTES) + varint(len(payload)) + payload
+
+
+def pack_varints(values):
+    """Encode an array of unsigned integers as concatenated varints, vectorized."""
+    if len(values) < VECTORIZE_MIN_VALUES:
+        # NumPy call overhead outweighs the work for short runs
+        return b''.join(varint(int(value)) for value in values)
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    largest = int(values.max())
+    for k in range(1, 10):
+        if largest < 1 << (7 * k):
+            break
+        sizes += values >= np.uint64(1 << (7 * k))
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    out = np.empty(int(sizes.sum()), dtype=np.uint8)
+    for k in range(int(sizes.max())):
+        mask = sizes > k
+        byte = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        byte |= np.where(sizes[mask] > k + 1, np.uint64(0x80), np.uint64(0))
+        out[starts[mask] + k] = byte.astype(np.uint8)
+    return out.tobytes()
+
+
+def packed_field(field_number, values):
+    """Encode a packed repeated field of unsigned integers."""
+    return bytes_field(field_number, pack_varints(values))
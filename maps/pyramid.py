@@ -0,0 +1,270 @@
+"""
+Per-zoom generalization pyramid for shapefile layers.
+
+When a layer is processed, every feature is simplified once for each zoom
+band and written next to the shapefile, one feature per line. A request at
+any zoom is then answered by reading the level of its band instead of
+converting the shapefile again. Each level has an array of the byte offset of
+every record's line, so a sampled request (max_features, attribute filter)
+seeks to the records it keeps instead of scanning the level.
+"""
+
+import os
+import json
+import logging
+from datetime import date, datetime
+
+import numpy as np
+import shapefile
+
+from maps.attribute_index import select_records
+from maps.simplification import simplify_geometry, tolerance_for_zoom
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Pyramid configuration
+ZOOM_BANDS = (8, 10, 12, 14, 16)  # Each band serves the zoom levels up to its own
+PYRAMID_SUFFIX = '.z{band}.ndjson'
+PYRAMID_OFFSETS_SUFFIX = '.z{band}.offsets.npy'
+PYRAMID_FORMAT = 3  # Bumped whenever the level line layout changes
+
+
+def get_zoom_band(zoom):
+    """Get the pyramid band serving a zoom level (the finest band for zoom 16+)."""
+    for band in ZOOM_BANDS:
+        if zoom <= band:
+            return band
+    return ZOOM_BANDS[-1]
+
+
+def get_pyramid_path(shapefile_path, band):
+    """Get the path of a pyramid level stored next to the shapefile."""
+    return os.path.splitext(shapefile_path)[0] + PYRAMID_SUFFIX.format(band=band)
+
+
+def get_pyramid_offsets_path(shapefile_path, band):
+    """Get the path of the line offsets of a pyramid level (-1 for records without a line)."""
+    return os.path.splitext(shapefile_path)[0] + PYRAMID_OFFSETS_SUFFIX.format(band=band)
+
+
+def json_serial(obj):
+    """Serialize the dates found in shapefile attributes."""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Type {type(obj)} not serializable")
+
+
+def record_to_properties(record, field_names):
+    """Convert a shapefile record to a GeoJSON properties dict."""
+    properties = {}
+    for field_name, value in zip(field_names, record):
+        # Handle binary data (convert to string)
+        if isinstance(value, bytes):
+            try:
+                value = value.decode('utf-8')
+            except UnicodeDecodeError:
+                value = str(value)
+        properties[field_name] = value
+    return properties
+
+
+def build_pyramid(shapefile_path, bands=ZOOM_BANDS):
+    """
+    Write a generalized copy of a shapefile for each zoom band
+
+    The shapefile is read once; each geometry is simplified with the
+    tolerance of about one pixel at every band's zoom level. A level file
+    starts with a JSON header line, followed by one
+    "<record index>\\t<geometry>\\t<properties>" line per feature, and its
+    offsets array gives the position of each record's line.
+
+    Args:
+        shapefile_path: Path to the source shapefile
+        bands: Zoom bands to build
+
+    Returns:
+        list: Paths of the level files written
+    """
+    logger.info(f"Building generalization pyramid for {shapefile_path}")
+
+    reader = shapefile.Reader(shapefile_path)
+    levels = []
+    try:
+        total_shapes = len(reader)
+        latitude = (reader.bbox[1] + reader.bbox[3]) / 2 if total_shapes else 0.0
+        field_names = [field[0] for field in reader.fields[1:]]  # Skip DeletionFlag
+        shapefile_mtime = os.path.getmtime(shapefile_path)
+
+        for band in bands:
+            path = get_pyramid_path(shapefile_path, band)
+            temp_path = path + '.tmp'
+            out = open(temp_path, 'wb')
+            levels.append({'band': band, 'path': path, 'temp_path': temp_path, 'file': out,
+                           'tolerance': tolerance_for_zoom(band, latitude), 'feature_count': 0,
+                           'offsets': np.full(total_shapes, -1, dtype=np.int64), 'position': 0})
+            header = {
+                'format': PYRAMID_FORMAT,
+                'band': band,
+                'tolerance': levels[-1]['tolerance'],
+                'total_features': total_shapes,
+                'shapefile_mtime': shapefile_mtime,
+            }
+            levels[-1]['position'] = out.write((json.dumps(header) + '\n').encode('utf-8'))
+
+        for index, shape_rec in enumerate(reader.iterShapeRecords()):
+            # Skip null geometries
+            if not shape_rec.shape.points:
+                continue
+
+            try:
+                geometry = shape_rec.shape.__geo_interface__
+                properties = json.dumps(record_to_properties(shape_rec.record, field_names), default=json_serial)
+            except Exception as e:
+                logger.error(f"Error processing feature {index}: {e}")
+                continue
+
+            for level in levels:
+                simplified = simplify_geometry(geometry, level['tolerance'])
+                if simplified is None:
+                    continue
+                level['offsets'][index] = level['position']
+                level['position'] += level['file'].write(
+                    f'{index}\t{json.dumps(simplified)}\t{properties}\n'.encode('utf-8'))
+                level['feature_count'] += 1
+
+        for level in levels:
+            level['file'].close()
+            offsets_path = get_pyramid_offsets_path(shapefile_path, level['band'])
+            with open(offsets_path + '.tmp', 'wb') as f:
+                np.save(f, level['offsets'])
+            # The offsets are replaced first, a level is never read with the offsets of an older one
+            os.replace(offsets_path + '.tmp', offsets_path)
+            os.replace(level['temp_path'], level['path'])
+            logger.info(f"Pyramid level z{level['band']}: {level['feature_count']} features, "
+                        f"{os.path.getsize(level['path']) / (1024 * 1024):.2f} MB")
+    finally:
+        reader.close()
+        for level in levels:
+            level['file'].close()
+            for temp_path in (level['temp_path'], get_pyramid_offsets_path(shapefile_path, level['band']) + '.tmp'):
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    return [level['path'] for level in levels]
+
+
+def read_pyramid_header(shapefile_path, band):
+    """
+    Read the header of a pyramid level
+
+    Returns:
+        dict: Level header, or None if the level is missing, in an older format,
+              or older than the shapefile
+    """
+    path = get_pyramid_path(shapefile_path, band)
+    try:
+        if not os.path.exists(get_pyramid_offsets_path(shapefile_path, band)):
+            return None
+        with open(path, 'r') as f:
+            header = json.loads(f.readline())
+        if (header.get('format') != PYRAMID_FORMAT or
+                header.get('shapefile_mtime') != os.path.getmtime(shapefile_path)):
+            logger.info(f"Pyramid level {path} is stale")
+            return None
+        return header
+    except (OSError, ValueError):
+        return None
+
+
+def iter_pyramid_geojson(shapefile_path, zoom, max_features=None, style=None, fields=None, where=None):
+    """
+    Serve a layer's GeoJSON from the pyramid level of a zoom level
+
+    Features are sampled the same way as a live conversion: every step-th
+    record of the shapefile (or of the records passing an attribute filter), up
+    to max_features. With a field projection the attributes are read from the
+    requested .dbf columns instead.
+
+    Args:
+        shapefile_path: Path to the source shapefile
+        zoom: Requested zoom level
+        max_features: Maximum number of features to include
+        style: Layer style to embed in the collection
+        fields: Attribute names to include (all when None)
+        where: Attribute filter selecting the records to include (all when None)
+
+    Returns:
+        iterator: GeoJSON text pieces, or None if the level is unavailable
+    """
+    band = get_zoom_band(int(zoom))
+    header = read_pyramid_header(shapefile_path, band)
+    if header is None:
+        return None
+
+    record_ids = select_records(shapefile_path, where) if where else None
+    logger.info(f"Serving zoom {zoom} from pyramid level z{band} of {shapefile_path}")
+    return _iter_level(shapefile_path, get_pyramid_path(shapefile_path, band), header, max_features, style, fields,
+                       record_ids)
+
+
+def _iter_lines(f, shapefile_path, band, selected):
+    # Every line in order, or the lines of the selected records
+    if selected is None:
+        yield from f
+        return
+    offsets = np.load(get_pyramid_offsets_path(shapefile_path, band), mmap_mode='r')
+    selected = selected[selected < len(offsets)]
+    for offset in offsets[selected]:
+        # Records without a line (null or vanished geometry) are skipped, like in the level
+        if offset >= 0:
+            f.seek(int(offset))
+            yield f.readline()
+
+
+def _iter_level(shapefile_path, path, header, max_features, style, fields, record_ids):
+    total_shapes = header['total_features'] if record_ids is None else len(record_ids)
+    feature_limit = int(max_features) if max_features else None
+    step = 1
+    if feature_limit and total_shapes > feature_limit:
+        step = max(1, int(total_shapes / feature_limit))
+    
+    # Records that the sampling keeps, read by seeking to their lines (all of them when None)
+    selected = None
+    if record_ids is not None or step > 1:
+        selected = np.arange(0, total_shapes, step) if record_ids is None else np.asarray(record_ids)[::step]
+
+    reader = None
+    if fields is not None:
+        reader = shapefile.Reader(shapefile_path)
+        field_names = [field[0] for field in reader.fields[1:] if field[0] in fields]
+
+    feature_count = 0
+    try:
+        yield '{"type": "FeatureCollection", "features": ['
+        with open(path, 'rb') as f:
+            f.readline()  # Header
+            for line in _iter_lines(f, shapefile_path, header['band'], selected):
+                index, geometry_json, properties_json = line.decode('utf-8').rstrip('\n').split('\t', 2)
+                if reader is not None:
+                    record = reader.record(int(index), fields=fields)
+                    properties_json = json.dumps(record_to_properties(record, field_names), default=json_serial)
+                feature_json = f'{{"type": "Feature", "geometry": {geometry_json}, "properties": {properties_json}}}'
+                yield feature_json if feature_count == 0 else ', ' + feature_json
+                feature_count += 1
+                if feature_limit and feature_count >= feature_limit:
+                    break
+        yield ']'
+    finally:
+        if reader is not None:
+            reader.close()
+
+    if style:
+        yield ', "style": ' + json.dumps(style)
+
+    info = {
+        "total_features": total_shapes,
+        "included_features": feature_count,
+        "simplification": header['tolerance'],
+    }
+    yield ', "info": ' + json.dumps(info) + '}'
@@ -0,0 +1,91 @@
+"""
+Background rebuilds of expired layer cache entries (stale-while-revalidate).
+
+The layer endpoints serve an expired cache entry right away when no fresh
+copy is cached (see TieredCache.get) and schedule its rebuild here, so a
+layer that has been viewed before never waits for a conversion again. Entries
+are keyed by the layer's content version, so an expired entry still holds the
+current data; the expiry only bounds how long it goes without being rebuilt.
+
+Rebuilds run on a small thread pool in the web process
+(LAYER_CACHE_REVALIDATION_WORKERS threads). Each key is rebuilt once at a
+time: requests of this process asking again while it is queued are ignored,
+and a rebuild whose key is being converted by another request or worker
+(holding its KeyLock), or was refreshed since, is dropped.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+from maps.caching import layer_cache
+from maps.single_flight import KeyLock
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Revalidation configuration
+DEFAULT_REVALIDATION_WORKERS = 1  # Rebuilds run at once per web process
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()  # Keys queued or being rebuilt in this process
+_pending_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'LAYER_CACHE_REVALIDATION_WORKERS', DEFAULT_REVALIDATION_WORKERS)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cache-revalidation')
+        return _executor
+
+
+def _rebuild(key, rebuild, args, kwargs):
+    lock = KeyLock(key)
+    try:
+        if not lock.acquire(timeout=0):
+            logger.info(f"Not rebuilding {key}, it is being converted elsewhere")
+            return False
+        if layer_cache.contains(key):
+            # Refreshed by another worker since the stale hit
+            return False
+        rebuild(*args, **kwargs)
+        logger.info(f"Rebuilt expired cache entry {key}")
+        return True
+    except Exception as e:
+        logger.exception(f"Error rebuilding cache entry {key}: {str(e)}")
+        return False
+    finally:
+        lock.release()
+        with _pending_lock:
+            _pending.discard(key)
+        # Worker threads hold their own database connections
+        connections.close_all()
+
+
+def revalidate(key, rebuild, *args, **kwargs):
+    """
+    Rebuild an expired cache entry in the background, unless already scheduled
+
+    Args:
+        key: Cache key of the entry
+        rebuild: Function writing the entry to the layer cache, called with args and kwargs
+
+    Returns:
+        Future: Resolving to whether the entry was rebuilt, or None if a rebuild was already scheduled
+    """
+    with _pending_lock:
+        if key in _pending:
+            return None
+        _pending.add(key)
+    try:
+        return _get_executor().submit(_rebuild, key, rebuild, args, kwargs)
+    except Exception:
+        with _pending_lock:
+            _pending.discard(key)
+        raise
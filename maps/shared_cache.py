@@ -0,0 +1,269 @@
+"""
+Cache store shared by all worker processes of a node, without an external service.
+
+Entries live in a SQLite database file (WAL journal, so readers don't block
+the writer and each other): every write is a transaction, so other workers
+see an entry entirely or not at all. The total size of the entries is kept
+in the database by triggers, so every process accounts for the same bytes,
+and writes evict the least recently used entries beyond the byte budget.
+Hits are served from the OS page cache the workers share, instead of each
+worker holding its own copy of large values.
+
+SQLiteStore is used by the layer cache (maps.caching) as its shared tier, and
+SharedSQLiteCache exposes it as a Django cache backend for settings.CACHES.
+SQLiteStore itself only holds bytes.
+"""
+
+import os
+import time
+import pickle
+import logging
+import sqlite3
+import threading
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Store configuration
+DEFAULT_SHARED_BUDGET = 1024 * 1024 * 512  # 512MB
+BUSY_TIMEOUT = 10  # Seconds a worker waits for another one's write
+ACCESS_RESOLUTION = 60  # Seconds: hits update the access time at most this often, sparing writes
+EVICTION_BATCH = 32  # Least recently used entries looked up at once when evicting
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE TABLE IF NOT EXISTS usage (id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER NOT NULL,
+                                  bytes INTEGER NOT NULL);
+INSERT OR IGNORE INTO usage VALUES (0, 0, 0);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    UPDATE usage SET entries = entries + 1, bytes = bytes + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    UPDATE usage SET entries = entries - 1, bytes = bytes - OLD.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN
+    UPDATE usage SET bytes = bytes - OLD.size + NEW.size WHERE id = 0;
+END;
+"""
+
+
+class SQLiteStore:
+    """
+    Byte-budgeted LRU of binary values in a SQLite file shared by processes
+
+    Connections are opened per thread and per process, so the store can be
+    used from request threads and survives forks.
+    """
+
+    def __init__(self, path, budget=DEFAULT_SHARED_BUDGET):
+        self.path = path
+        self.budget = budget
+        self._local = threading.local()
+        self.hits = self.misses = self.evictions = 0
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Autocommit mode, transactions are opened explicitly
+        connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(SCHEMA)
+        self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def get(self, key):
+        """
+        Get a value, counting a hit or a miss
+
+        Returns:
+            bytes: The value, or None if missing or expired
+        """
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def get_entry(self, key, grace=0):
+        """
+        Get a value with its expiry, counting a hit or a miss
+
+        Args:
+            key: Cache key
+            grace: Seconds past its expiry a value is still returned
+
+        Returns:
+            tuple: (bytes, expiry timestamp or None), or None if missing or expired longer than grace ago
+        """
+        connection = self._connect()
+        now = time.time()
+        row = connection.execute('SELECT value, expires, accessed FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] + grace <= now):
+            self.misses += 1
+            return None
+        if now - row[2] >= ACCESS_RESOLUTION:
+            connection.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        self.hits += 1
+        return row[0], row[1]
+
+    def contains(self, key):
+        """Check whether a key holds an unexpired value, without counting a hit or miss."""
+        row = self._connect().execute('SELECT expires FROM entries WHERE key = ?', (key,)).fetchone()
+        return row is not None and (row[0] is None or row[0] > time.time())
+
+    def fits(self, size):
+        return size <= self.budget
+
+    def set(self, key, value, expires=None, only_new=False):
+        """
+        Store a value, evicting the least recently used entries beyond the budget
+
+        Args:
+            key: Cache key
+            value: bytes
+            expires: Timestamp the value expires at (never when None)
+            only_new: Leave an unexpired existing value in place
+
+        Returns:
+            bool: Whether the value was stored
+        """
+        if not self.fits(len(value)):
+            return False
+        connection = self._connect()
+        now = time.time()
+        evicted = 0
+        # IMMEDIATE takes the write lock up front, so the budget check can't race another writer
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if only_new:
+                row = connection.execute('SELECT expires FROM entries WHERE key = ?', (key,)).fetchone()
+                if row is not None and (row[0] is None or row[0] > now):
+                    connection.execute('COMMIT')
+                    return False
+            # Deleted then inserted, since REPLACE skips the delete trigger
+            connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+            used = connection.execute('SELECT bytes FROM usage WHERE id = 0').fetchone()[0]
+            while used + len(value) > self.budget:
+                oldest = connection.execute('SELECT key, size FROM entries ORDER BY accessed LIMIT ?',
+                                            (EVICTION_BATCH,)).fetchall()
+                if not oldest:
+                    break
+                for old_key, size in oldest:
+                    connection.execute('DELETE FROM entries WHERE key = ?', (old_key,))
+                    used -= size
+                    evicted += 1
+                    if used + len(value) <= self.budget:
+                        break
+            connection.execute('INSERT INTO entries (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)',
+                               (key, sqlite3.Binary(value), len(value), expires, now))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        if evicted:
+            self.evictions += evicted
+            logger.info(f"Evicted {evicted} entries from the shared cache {self.path}")
+        return True
+
+    def touch(self, key, expires=None):
+        """Set a new expiry on an existing value; returns whether the key existed."""
+        cursor = self._connect().execute('UPDATE entries SET expires = ? WHERE key = ?', (expires, key))
+        return cursor.rowcount > 0
+
+    def delete(self, key):
+        """Remove a value; returns whether the key existed."""
+        return self._connect().execute('DELETE FROM entries WHERE key = ?', (key,)).rowcount > 0
+
+    def delete_matching(self, test):
+        """Remove the values whose key passes a test; returns how many were removed."""
+        connection = self._connect()
+        keys = [key for key, in connection.execute('SELECT key FROM entries') if test(key)]
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in keys])
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return len(keys)
+
+    def sweep(self, grace=0):
+        """Remove the values expired more than grace seconds ago; returns how many were removed."""
+        return self._connect().execute('DELETE FROM entries WHERE expires <= ?', (time.time() - grace,)).rowcount
+
+    def clear(self):
+        self._connect().execute('DELETE FROM entries')
+
+    def stats(self):
+        """
+        Get the counters of this process and the usage of all processes
+
+        Returns:
+            dict: hits, misses, evictions, entries, bytes and budget
+        """
+        entries, used = self._connect().execute('SELECT entries, bytes FROM usage WHERE id = 0').fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': entries, 'bytes': used, 'budget': self.budget}
+
+
+class SharedSQLiteCache(BaseCache):
+    """
+    Django cache backend storing pickled values in a SQLiteStore, shared by
+    the workers of a node
+
+    Like Django's file and database backends, values are unpickled on read, so
+    the database must only be writable by the application: keep it outside
+    MEDIA_ROOT and any other uploaded or served directory. The layer cache
+    (maps.caching) stores bytes only and does not unpickle.
+
+    CACHES = {'default': {
+        'BACKEND': 'maps.shared_cache.SharedSQLiteCache',
+        'LOCATION': '/path/to/cache.sqlite3',
+        'OPTIONS': {'MAX_BYTES': 64 * 1024 * 1024},
+    }}
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._store = SQLiteStore(location, options.get('MAX_BYTES', DEFAULT_SHARED_BUDGET))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._store.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.get_backend_timeout(timeout),
+                               only_new=True)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        value = self._store.get(key)
+        return default if value is None else pickle.loads(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        if not self._store.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                               self.get_backend_timeout(timeout)):
+            logger.warning(f"Value of {key} is larger than the shared cache budget")
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._store.touch(key, self.get_backend_timeout(timeout))
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._store.delete(key)
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._store.contains(key)
+
+    def clear(self):
+        self._store.clear()
@@ -0,0 +1,315 @@
+"""
+Tolerance-based geometry simplification over NumPy coordinate arrays.
+
+Provides Douglas-Peucker and Visvalingam-Whyatt simplification for GeoJSON
+geometries. Every ring of every polygon (holes and MultiPolygon parts
+included) and every part of a line is simplified. The tolerance is expressed
+in coordinate units and can be derived from a zoom level, so detail that
+cannot be seen on screen is dropped while visible shapes keep their form.
+"""
+
+import math
+import heapq
+import logging
+
+import numpy as np
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Simplification configuration
+EARTH_CIRCUMFERENCE = 40075016.686  # meters at the equator
+TILE_SIZE = 256  # pixels, as used by Leaflet
+METERS_PER_DEGREE = EARTH_CIRCUMFERENCE / 360.0
+PIXEL_TOLERANCE = 1.0  # Detail smaller than this many pixels is removed
+VIEWPORT_SIZE = 1024  # pixels across the map view a whole layer is fitted into
+MAX_FIT_ZOOM = 20
+AUTO_MIN_FEATURES = 10000  # 'auto' without a zoom level leaves smaller layers unsimplified
+DEFAULT_METHOD = 'douglas_peucker'
+METHODS = ('douglas_peucker', 'visvalingam')
+
+
+def meters_per_pixel(zoom, latitude=0.0):
+    """Ground resolution of a Web Mercator map at a zoom level and latitude."""
+    return EARTH_CIRCUMFERENCE * math.cos(math.radians(latitude)) / (TILE_SIZE * 2 ** zoom)
+
+
+def tolerance_for_zoom(zoom, latitude=0.0, pixel_tolerance=PIXEL_TOLERANCE):
+    """
+    Get a simplification tolerance in degrees for a zoom level
+
+    Args:
+        zoom: Map zoom level
+        latitude: Latitude of the data, used for the ground resolution
+        pixel_tolerance: Size in pixels of the detail that can be dropped
+
+    Returns:
+        float: Tolerance in degrees (the coordinate unit of lon/lat layers)
+    """
+    # A pixel spans fewer degrees of latitude than of longitude, so measuring it in
+    # degrees of latitude is the conservative choice
+    return meters_per_pixel(zoom, latitude) * pixel_tolerance / METERS_PER_DEGREE
+
+
+def zoom_for_extent(extent, viewport_size=VIEWPORT_SIZE):
+    """
+    Get the zoom level at which a lon/lat extent fits in the map view
+
+    Args:
+        extent: (x_min, y_min, x_max, y_max) in degrees
+        viewport_size: Size of the map view in pixels
+
+    Returns:
+        int: Zoom level
+    """
+    width, height = extent[2] - extent[0], extent[3] - extent[1]
+    # Degrees of latitude span more pixels than degrees of longitude away from the equator
+    latitude = (extent[1] + extent[3]) / 2
+    span = max(width, height / max(math.cos(math.radians(latitude)), 0.01))
+    if not span > 0:
+        return MAX_FIT_ZOOM
+    zoom = math.floor(math.log2(360.0 * viewport_size / (TILE_SIZE * span)))
+    return max(0, min(zoom, MAX_FIT_ZOOM))
+
+
+def resolve_tolerance(simplify, total_features, zoom=None, latitude=0.0, extent=None):
+    """
+    Get the simplification tolerance of a layer data request
+
+    Args:
+        simplify: 'auto', a tolerance in coordinate units, or None/'none'/'false'/'0'
+                  to disable simplification
+        total_features: Feature count of the layer; 'auto' without a zoom level
+                        only simplifies layers of more than AUTO_MIN_FEATURES
+        zoom: Zoom level the data is displayed at; takes precedence over the value
+              of simplify (about one pixel of tolerance)
+        latitude: Latitude of the data
+        extent: (x_min, y_min, x_max, y_max) of the layer; 'auto' without a zoom
+                level uses the zoom at which the whole layer fits in the map view
+
+    Returns:
+        float: Tolerance in coordinate units, or None for no simplification
+    """
+    if simplify in (None, '', 'none', 'false', '0'):
+        return None
+    if zoom is not None:
+        # Drop the detail that cannot be seen at this zoom level
+        return tolerance_for_zoom(int(zoom), latitude)
+    if simplify == 'auto':
+        if total_features <= AUTO_MIN_FEATURES or extent is None:
+            return None
+        # The whole layer is shown, so drop the detail that cannot be seen at the zoom fitting it
+        return tolerance_for_zoom(zoom_for_extent(extent), latitude)
+    try:
+        return float(simplify)
+    except (ValueError, TypeError):
+        return None
+
+
+def _segment_distances(points, start, end):
+    """Distance of each point to the segment start-end."""
+    direction = end - start
+    length_sq = float(direction @ direction)
+    offsets = points - start
+    if length_sq == 0:
+        return np.hypot(offsets[:, 0], offsets[:, 1])
+    t = np.clip(offsets @ direction / length_sq, 0.0, 1.0)
+    projected = start + t[:, None] * direction
+    delta = points - projected
+    return np.hypot(delta[:, 0], delta[:, 1])
+
+
+def douglas_peucker_mask(points, tolerance):
+    """
+    Douglas-Peucker simplification of an open polyline
+
+    Args:
+        points: (N, 2) float array
+        tolerance: Maximum distance between the original and simplified line
+
+    Returns:
+        numpy.ndarray: Boolean mask of the vertices to keep
+    """
+    count = len(points)
+    keep = np.zeros(count, dtype=bool)
+    if count == 0:
+        return keep
+    keep[0] = keep[-1] = True
+
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = _segment_distances(points[first + 1:last], points[first], points[last])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def _triangle_areas(points):
+    """Area of the triangle each interior vertex forms with its neighbours."""
+    a, b, c = points[:-2], points[1:-1], points[2:]
+    return np.abs((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) -
+                  (c[:, 0] - a[:, 0]) * (b[:, 1] - a[:, 1])) / 2.0
+
+
+def visvalingam_mask(points, tolerance):
+    """
+    Visvalingam-Whyatt simplification of an open polyline
+
+    Vertices are removed by increasing effective area until every remaining
+    vertex forms a triangle larger than tolerance squared.
+
+    Args:
+        points: (N, 2) float array
+        tolerance: Linear tolerance, squared to get the minimum area
+
+    Returns:
+        numpy.ndarray: Boolean mask of the vertices to keep
+    """
+    count = len(points)
+    keep = np.ones(count, dtype=bool)
+    if count < 3:
+        return keep
+
+    min_area = tolerance * tolerance
+    areas = np.empty(count)
+    areas[0] = areas[-1] = np.inf
+    areas[1:-1] = _triangle_areas(points)
+
+    previous = np.arange(-1, count - 1)
+    following = np.arange(1, count + 1)
+    heap = [(areas[i], i) for i in range(1, count - 1)]
+    heapq.heapify(heap)
+
+    def area_of(i):
+        a, b, c = points[previous[i]], points[i], points[following[i]]
+        return abs((b[0] - a[0]) * (c[1] - a[1]) - (c[0] - a[0]) * (b[1] - a[1])) / 2.0
+
+    while heap:
+        area, i = heapq.heappop(heap)
+        if not keep[i] or area != areas[i]:
+            continue  # Removed already or stale heap entry
+        if area >= min_area:
+            break
+        keep[i] = False
+        before, after = previous[i], following[i]
+        following[before] = after
+        previous[after] = before
+        for neighbour in (before, after):
+            if 0 < neighbour < count - 1:
+                # Never let a neighbour's area drop below the removed one
+                areas[neighbour] = max(area_of(neighbour), area)
+                heapq.heappush(heap, (areas[neighbour], neighbour))
+    return keep
+
+
+def _mask(points, tolerance, method):
+    if method == 'visvalingam':
+        return visvalingam_mask(points, tolerance)
+    return douglas_peucker_mask(points, tolerance)
+
+
+def simplify_line(coordinates, tolerance, method=DEFAULT_METHOD):
+    """Simplify a LineString coordinate list."""
+    if len(coordinates) <= 2:
+        return [list(c) for c in coordinates]
+    points = np.asarray(coordinates, dtype=np.float64)
+    keep = _mask(points[:, :2], tolerance, method)
+    return points[keep].tolist()
+
+
+def simplify_ring(coordinates, tolerance, method=DEFAULT_METHOD, is_exterior=True):
+    """
+    Simplify a closed polygon ring
+
+    Args:
+        coordinates: Ring coordinates (first and last point equal)
+        tolerance: Simplification tolerance in coordinate units
+        method: 'douglas_peucker' or 'visvalingam'
+        is_exterior: Exterior rings are reduced to a triangle at most, holes
+                     that collapse are dropped
+
+    Returns:
+        list: Simplified closed ring, or None if it collapsed
+    """
+    if len(coordinates) <= 4:
+        return [list(c) for c in coordinates]
+
+    points = np.asarray(coordinates, dtype=np.float64)
+    xy = points[:, :2]
+    if not np.array_equal(xy[0], xy[-1]):
+        points = np.vstack([points, points[:1]])
+        xy = points[:, :2]
+
+    # Split at the vertex farthest from the start so neither half has a degenerate baseline
+    far = int(np.argmax(((xy - xy[0]) ** 2).sum(axis=1)))
+    if far == 0:
+        return None if not is_exterior else points.tolist()
+    keep = np.zeros(len(points), dtype=bool)
+    keep[:far + 1] |= _mask(xy[:far + 1], tolerance, method)
+    keep[far:] |= _mask(xy[far:], tolerance, method)
+
+    if keep.sum() < 4:
+        if not is_exterior:
+            return None
+        # Keep the largest triangle so small features stay visible
+        distances = _segment_distances(xy, xy[0], xy[far])
+        third = int(np.argmax(distances))
+        if distances[third] == 0:
+            return None
+        keep[third] = True
+
+    return points[keep].tolist()
+
+
+def simplify_polygon(rings, tolerance, method=DEFAULT_METHOD):
+    """Simplify every ring of a Polygon, returning None if the exterior collapsed."""
+    exterior = simplify_ring(rings[0], tolerance, method, is_exterior=True)
+    if exterior is None:
+        return None
+    holes = [simplify_ring(ring, tolerance, method, is_exterior=False) for ring in rings[1:]]
+    return [exterior] + [hole for hole in holes if hole is not None]
+
+
+def simplify_geometry(geometry, tolerance, method=DEFAULT_METHOD):
+    """
+    Simplify a GeoJSON geometry dict
+
+    Args:
+        geometry: GeoJSON geometry (e.g. a pyshp Shape's __geo_interface__)
+        tolerance: Simplification tolerance in coordinate units
+        method: 'douglas_peucker' or 'visvalingam'
+
+    Returns:
+        dict: Simplified geometry, or None if nothing visible remains
+    """
+    if not tolerance or tolerance <= 0:
+        return geometry
+
+    geom_type = geometry.get('type')
+    coordinates = geometry.get('coordinates')
+
+    if geom_type == 'LineString':
+        coordinates = simplify_line(coordinates, tolerance, method)
+    elif geom_type == 'MultiLineString':
+        coordinates = [simplify_line(line, tolerance, method) for line in coordinates]
+    elif geom_type == 'Polygon':
+        coordinates = simplify_polygon(coordinates, tolerance, method)
+        if coordinates is None:
+            return None
+    elif geom_type == 'MultiPolygon':
+        polygons = [simplify_polygon(polygon, tolerance, method) for polygon in coordinates]
+        coordinates = [polygon for polygon in polygons if polygon is not None]
+        if not coordinates:
+            return None
+    else:
+        # Points and unknown types have nothing to simplify
+        return geometry
+
+    return {'type': geom_type, 'coordinates': coordinates}
@@ -0,0 +1,184 @@
+"""
+Single-flight coalescing of expensive cache-miss work.
+
+When a cache entry is missing, every concurrent request for it would run the
+same conversion. A KeyLock lets one request compute while the others for the
+same key wait, then read the result from the cache.
+
+Requests of one process wait on a per-key thread lock. Across processes, the
+holder also takes an exclusive flock on a lock file in FILE_CACHE_DIR/locks;
+the kernel releases it when the process dies, so a crashed worker never
+leaves a stale lock. Keys are spread over LOCK_STRIPES lock files, which
+keeps their number bounded without any cleanup (two keys sharing a file only
+wait on each other across processes). Where fcntl is unavailable, coalescing
+is per process.
+
+Waiting is bounded: after the timeout a request computes on its own instead
+of failing.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows, where coalescing stays within a process
+    fcntl = None
+
+from django.conf import settings
+
+from maps import caching
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Coalescing configuration
+DEFAULT_WAIT_TIMEOUT = 120  # Seconds a request waits for another one's conversion
+LOCK_STRIPES = 4096  # Lock files keys are spread over
+POLL_INTERVAL = 0.05  # First wait between attempts at another process's lock, doubling up to MAX_POLL_INTERVAL
+MAX_POLL_INTERVAL = 0.5
+
+_local_locks = {}  # key -> [threading.Lock, number of users]
+_registry_lock = threading.Lock()
+
+
+def get_wait_timeout():
+    """Get the seconds requests wait for a conversion in flight (LAYER_CACHE_COALESCE_TIMEOUT)."""
+    return getattr(settings, 'LAYER_CACHE_COALESCE_TIMEOUT', DEFAULT_WAIT_TIMEOUT)
+
+
+def get_lock_path(key):
+    """Get the lock file guarding a key across processes."""
+    stripe = int(hashlib.md5(key.encode()).hexdigest(), 16) % LOCK_STRIPES
+    return os.path.join(caching.FILE_CACHE_DIR, 'locks', f"{stripe:04d}.lock")
+
+
+class KeyLock:
+    """
+    Exclusive lock on a cache key, within and across processes
+
+    After acquire(), waited tells whether another holder had the key first,
+    in which case its result is usually in the cache by now.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.waited = False
+        self._local = None
+        self._file = None
+
+    def acquire(self, timeout=None):
+        """
+        Wait for the key
+
+        Args:
+            timeout: Seconds to wait at most (get_wait_timeout() when None)
+
+        Returns:
+            bool: Whether the lock is held; False once the timeout has passed
+        """
+        timeout = get_wait_timeout() if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        with _registry_lock:
+            entry = _local_locks.setdefault(self.key, [threading.Lock(), 0])
+            entry[1] += 1
+        local = entry[0]
+        if not local.acquire(blocking=False):
+            self.waited = True
+            if not local.acquire(timeout=max(0, deadline - time.monotonic())):
+                self._forget()
+                return False
+        self._local = local
+
+        if fcntl is not None and not self._lock_file(deadline):
+            self._local = None
+            local.release()
+            self._forget()
+            return False
+        return True
+
+    def _lock_file(self, deadline):
+        path = get_lock_path(self.key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            file = open(path, 'a+b')
+        except OSError as e:
+            # Without the lock file, coalescing stays within the process
+            logger.error(f"Error opening lock file {path}: {e}")
+            return True
+        interval = POLL_INTERVAL
+        while True:
+            try:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._file = file
+                return True
+            except BlockingIOError:
+                self.waited = True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                file.close()
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    def _forget(self):
+        with _registry_lock:
+            entry = _local_locks.get(self.key)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del _local_locks[self.key]
+
+    def release(self):
+        """Release the lock, if held (repeated calls do nothing)."""
+        if self._file is not None:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            finally:
+                self._file.close()
+                self._file = None
+        if self._local is not None:
+            self._local.release()
+            self._local = None
+            self._forget()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class ReleasingIterator:
+    """
+    Iterate a stream while holding a KeyLock, released once the stream ends
+    or the response is closed, so streamed conversions coalesce too
+    """
+
+    def __init__(self, iterable, lock):
+        self._iterator = iter(iterable)
+        self._lock = lock
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        # Closing the stream first commits or discards its cache entry before waiters look it up
+        try:
+            close = getattr(self._iterator, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._lock.release()
@@ -0,0 +1,301 @@
+"""
+Persistent packed R-tree spatial index for shapefile layers.
+
+The index is built once when a layer is processed and saved as a sidecar file
+next to the shapefile (``<name>.rtree.npz``). It maps record numbers to their
+bounding boxes and is packed with the Sort-Tile-Recursive (STR) algorithm, so
+bounding box queries only touch the tree nodes they overlap and callers can
+then read just the matching records through the .shx offsets.
+"""
+
+import os
+import math
+import logging
+import threading
+
+import numpy as np
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Index configuration
+NODE_CAPACITY = 16
+INDEX_SUFFIX = '.rtree.npz'
+READ_BLOCK_SIZE = 100000  # Records whose headers are read per block
+
+# Shapefile shape types whose records start with a bounding box
+POINT_SHAPE_TYPES = (1, 11, 21)
+NULL_SHAPE_TYPE = 0
+
+# Loaded indexes, keyed by sidecar path and modification time
+_index_cache = {}
+_index_cache_lock = threading.Lock()
+
+
+def get_index_path(shapefile_path):
+    """Get the path of the R-tree sidecar file for a shapefile."""
+    return os.path.splitext(shapefile_path)[0] + INDEX_SUFFIX
+
+
+def _get_companion_path(shapefile_path, extension):
+    """Find a companion file (.shx, .dbf) regardless of extension case."""
+    base = os.path.splitext(shapefile_path)[0]
+    for ext in (extension.lower(), extension.upper()):
+        if os.path.exists(base + ext):
+            return base + ext
+    return None
+
+
+def read_record_headers(shapefile_path, length=36):
+    """
+    Read the first bytes of every record's content straight from the .shp file
+
+    Record offsets come from the .shx index, so only the requested bytes of each
+    record are read instead of parsing every vertex. Bytes past the end of a
+    short record are not meaningful.
+
+    Args:
+        shapefile_path: Path to the .shp file
+        length: Number of content bytes to read per record, shape type included
+
+    Returns:
+        numpy.ndarray: uint8 array with one row of `length` bytes per record
+    """
+    shx_path = _get_companion_path(shapefile_path, '.shx')
+    if not shx_path:
+        raise ValueError(f"No .shx index found for {shapefile_path}")
+
+    # .shx: 100 byte header followed by big-endian (offset, length) pairs in 16-bit words
+    shx = np.fromfile(shx_path, dtype='>i4', offset=100).reshape(-1, 2)
+    record_count = len(shx)
+    content = np.empty((record_count, length), dtype=np.uint8)
+    if record_count == 0:
+        return content
+
+    shp = np.memmap(shapefile_path, dtype=np.uint8, mode='r')
+    # Skip the 8 byte record header to get to the record content
+    starts = shx[:, 0].astype(np.int64) * 2 + 8
+    header_bytes = np.arange(length)
+    for block in range(0, record_count, READ_BLOCK_SIZE):
+        block_starts = starts[block:block + READ_BLOCK_SIZE]
+        # Every record holds at least its shape type; clip reads so short records stay in bounds
+        positions = np.minimum(block_starts[:, None] + header_bytes, len(shp) - 1)
+        content[block:block + READ_BLOCK_SIZE] = shp[positions]
+    del shp
+    return content
+
+
+def read_shape_bboxes(shapefile_path):
+    """
+    Read the bounding box of every record straight from the .shp record headers
+
+    Only the first 36 bytes of each record are read (see read_record_headers).
+
+    Args:
+        shapefile_path: Path to the .shp file
+
+    Returns:
+        tuple: (ids, boxes) where ids are record numbers of non-null shapes and
+               boxes is a float64 array of (x_min, y_min, x_max, y_max) rows
+    """
+    content = read_record_headers(shapefile_path, 36)
+    record_count = len(content)
+    if record_count == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 4), dtype=np.float64)
+
+    shape_types = content[:, 0:4].copy().view('<i4').ravel()
+    values = content[:, 4:36].copy().view('<f8')
+
+    boxes = np.empty((record_count, 4), dtype=np.float64)
+    is_point = np.isin(shape_types, POINT_SHAPE_TYPES)
+    # Points store x, y right after the shape type
+    boxes[is_point] = values[is_point][:, [0, 1, 0, 1]]
+    boxes[~is_point] = values[~is_point]
+
+    valid = (shape_types != NULL_SHAPE_TYPE) & np.all(np.isfinite(boxes), axis=1)
+    ids = np.nonzero(valid)[0].astype(np.int64)
+    return ids, boxes[valid]
+
+
+class PackedRTree:
+    """Static R-tree packed with Sort-Tile-Recursive, stored as flat arrays per level"""
+
+    def __init__(self, levels, ids, capacity=NODE_CAPACITY):
+        # levels[0] holds the leaf entries (one bbox per feature), the last level is the root
+        self.levels = levels
+        self.ids = ids
+        self.capacity = capacity
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def bbox(self):
+        """Bounding box of all indexed features."""
+        if not len(self.ids):
+            return None
+        root = self.levels[-1]
+        return (float(root[:, 0].min()), float(root[:, 1].min()),
+                float(root[:, 2].max()), float(root[:, 3].max()))
+
+    @classmethod
+    def build(cls, ids, boxes, capacity=NODE_CAPACITY):
+        """
+        Pack feature bounding boxes into an R-tree
+
+        Args:
+            ids: Array of feature ids (record numbers)
+            boxes: Array of (x_min, y_min, x_max, y_max) rows
+            capacity: Maximum number of children per node
+
+        Returns:
+            PackedRTree: The packed tree
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        count = len(ids)
+        if count == 0:
+            return cls([boxes], ids, capacity)
+
+        # Sort-Tile-Recursive: sort by x into vertical slabs, then by y inside each slab
+        centers_x = (boxes[:, 0] + boxes[:, 2]) / 2
+        centers_y = (boxes[:, 1] + boxes[:, 3]) / 2
+        leaf_pages = math.ceil(count / capacity)
+        slab_count = math.ceil(math.sqrt(leaf_pages))
+        slab_size = slab_count * capacity
+
+        order = np.argsort(centers_x, kind='stable')
+        for start in range(0, count, slab_size):
+            slab = order[start:start + slab_size]
+            order[start:start + slab_size] = slab[np.argsort(centers_y[slab], kind='stable')]
+
+        levels = [boxes[order]]
+        ids = ids[order]
+
+        # Every node covers `capacity` consecutive entries of the level below
+        while len(levels[-1]) > 1:
+            children = levels[-1]
+            groups = np.arange(0, len(children), capacity)
+            parents = np.empty((len(groups), 4), dtype=np.float64)
+            parents[:, 0] = np.minimum.reduceat(children[:, 0], groups)
+            parents[:, 1] = np.minimum.reduceat(children[:, 1], groups)
+            parents[:, 2] = np.maximum.reduceat(children[:, 2], groups)
+            parents[:, 3] = np.maximum.reduceat(children[:, 3], groups)
+            levels.append(parents)
+
+        return cls(levels, ids, capacity)
+
+    def query(self, bbox, min_size=None):
+        """
+        Find the features whose bounding box intersects a bounding box
+
+        Args:
+            bbox: (x_min, y_min, x_max, y_max)
+            min_size: If given, skip features whose bounding box is smaller than
+                      this in both width and height
+
+        Returns:
+            numpy.ndarray: Sorted feature ids, ready for sequential record reads
+        """
+        if not len(self.ids):
+            return np.zeros(0, dtype=np.int64)
+
+        x_min, y_min, x_max, y_max = bbox
+        candidates = np.arange(len(self.levels[-1]))
+        offsets = np.arange(self.capacity)
+
+        for depth in range(len(self.levels) - 1, -1, -1):
+            level = self.levels[depth]
+            if depth < len(self.levels) - 1:
+                # Expand the matching parents into their children
+                candidates = (candidates[:, None] * self.capacity + offsets).ravel()
+                candidates = candidates[candidates < len(level)]
+            boxes = level[candidates]
+            overlap = ((boxes[:, 0] <= x_max) & (boxes[:, 2] >= x_min) &
+                       (boxes[:, 1] <= y_max) & (boxes[:, 3] >= y_min))
+            candidates = candidates[overlap]
+            if not len(candidates):
+                break
+
+        if min_size and len(candidates):
+            boxes = self.levels[0][candidates]
+            visible = ((boxes[:, 2] - boxes[:, 0]) >= min_size) | ((boxes[:, 3] - boxes[:, 1]) >= min_size)
+            candidates = candidates[visible]
+        return np.sort(self.ids[candidates])
+
+    def save(self, path):
+        """Save the tree to a sidecar file."""
+        arrays = {f"level_{i}": level for i, level in enumerate(self.levels)}
+        # Write to a temporary file first so readers never see a partial index; the name is
+        # unique per process and thread, as requests building a missing index can race
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                np.savez(f, ids=self.ids, capacity=np.array(self.capacity), **arrays)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """Load a tree from a sidecar file."""
+        with np.load(path) as data:
+            level_count = len([name for name in data.files if name.startswith('level_')])
+            levels = [data[f"level_{i}"] for i in range(level_count)]
+            return cls(levels, data['ids'], int(data['capacity']))
+
+
+def build_spatial_index(shapefile_path):
+    """
+    Build and save the R-tree sidecar for a shapefile
+
+    Args:
+        shapefile_path: Path to the .shp file
+
+    Returns:
+        PackedRTree: The built index
+    """
+    ids, boxes = read_shape_bboxes(shapefile_path)
+    tree = PackedRTree.build(ids, boxes)
+    index_path = get_index_path(shapefile_path)
+    tree.save(index_path)
+    logger.info(f"Built spatial index for {len(tree)} features: {index_path}")
+    return tree
+
+
+def get_spatial_index(shapefile_path, build_if_missing=True):
+    """
+    Get the spatial index for a shapefile, loading it once per process
+
+    Layers processed before indexes existed get their sidecar built on first use.
+
+    Args:
+        shapefile_path: Path to the .shp file
+        build_if_missing: Build the sidecar if it does not exist yet
+
+    Returns:
+        PackedRTree: The index, or None if it is unavailable
+    """
+    index_path = get_index_path(shapefile_path)
+    try:
+        if not os.path.exists(index_path):
+            if not build_if_missing:
+                return None
+            build_spatial_index(shapefile_path)
+
+        cache_key = (index_path, os.path.getmtime(index_path))
+        with _index_cache_lock:
+            tree = _index_cache.get(cache_key)
+        if tree is None:
+            tree = PackedRTree.load(index_path)
+            with _index_cache_lock:
+                # Drop stale versions of the same sidecar
+                for key in [k for k in _index_cache if k[0] == index_path]:
+                    del _index_cache[key]
+                _index_cache[cache_key] = tree
+        return tree
+    except Exception as e:
+        logger.error(f"Error loading spatial index for {shapefile_path}: {e}")
+        return None
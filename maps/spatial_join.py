@@ -0,0 +1,170 @@
+"""
+Bulk point-in-polygon join of properties to polygon map layers.
+
+Every property with coordinates is assigned the polygon of a layer it falls
+in (zone, school district, ward...), and the result is stored in the
+PropertyLayerFeature join table so pages can show memberships with a single
+indexed lookup instead of any geometry work.
+
+The points are sorted by longitude and cut into blocks. For each block the
+layer's R-tree gives the polygons overlapping the block's extent, and for each
+of those the points inside its bounding box (a binary search on the sorted
+longitudes, then a latitude mask) are tested against its rings with the
+vectorized even-odd test. Blocks are independent, so they are spread across a
+process pool; polygons are read from the memory-mapped geometry store, which
+the worker processes share through the page cache.
+"""
+
+import os
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import shapefile
+
+from maps.geometry_store import build_geometry_store, get_geometry_store, POLYGON_SHAPE_TYPES
+from maps.identify import points_in_rings
+from maps.pyramid import json_serial, record_to_properties
+from maps.spatial_index import get_spatial_index
+from maps.utils import get_pool_context, setup_pool_worker
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Join configuration
+JOIN_BLOCK_SIZE = 50000  # Points handled by one task
+SAVE_BATCH_SIZE = 5000  # Join rows inserted per query
+NO_FEATURE = -1
+
+
+def _join_block(shapefile_path, xs, ys):
+    """
+    Assign a block of points, sorted by longitude, to the polygons containing them
+
+    Returns:
+        numpy.ndarray: Record number of the containing polygon for each point,
+                       NO_FEATURE where there is none (the lowest record wins on overlaps)
+    """
+    result = np.full(len(xs), NO_FEATURE, dtype=np.int64)
+    if not len(xs):
+        return result
+
+    store = get_geometry_store(shapefile_path)
+    index = get_spatial_index(shapefile_path)
+    block_bbox = (float(xs[0]), float(ys.min()), float(xs[-1]), float(ys.max()))
+    candidate_ids = index.query(block_bbox) if index is not None else store.query_bbox(block_bbox)
+
+    for i in candidate_ids:
+        i = int(i)
+        if int(store.shape_types[i]) not in POLYGON_SHAPE_TYPES:
+            continue
+        x_min, y_min, x_max, y_max = store.bboxes[i]
+        start, end = np.searchsorted(xs, x_min, 'left'), np.searchsorted(xs, x_max, 'right')
+        if start == end:
+            continue
+        positions = np.arange(start, end)
+        positions = positions[(ys[start:end] >= y_min) & (ys[start:end] <= y_max) & (result[start:end] == NO_FEATURE)]
+        if not len(positions):
+            continue
+        inside = points_in_rings(xs[positions], ys[positions], store.rings(i))
+        result[positions[inside]] = i
+    return result
+
+
+def join_points_to_polygons(shapefile_path, xs, ys, workers=None):
+    """
+    Find the polygon of a shapefile containing each point
+
+    Args:
+        shapefile_path: Path to the polygon .shp file
+        xs, ys: Longitudes and latitudes of the points
+        workers: Number of worker processes (all CPUs when None, 1 to stay in process)
+
+    Returns:
+        numpy.ndarray: Record number of the containing polygon for each point,
+                       NO_FEATURE where there is none
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+
+    # The join reads polygons from the geometry store and prunes them with the R-tree
+    if get_geometry_store(shapefile_path) is None:
+        build_geometry_store(shapefile_path)
+    get_spatial_index(shapefile_path)
+
+    order = np.argsort(xs, kind='stable')
+    sorted_xs, sorted_ys = xs[order], ys[order]
+    blocks = [(start, min(start + JOIN_BLOCK_SIZE, len(xs))) for start in range(0, len(xs), JOIN_BLOCK_SIZE)]
+    workers = min(workers or os.cpu_count() or 1, len(blocks))
+    logger.info(f"Joining {len(xs)} points to {shapefile_path} in {len(blocks)} blocks with {workers} workers")
+
+    sorted_result = np.full(len(xs), NO_FEATURE, dtype=np.int64)
+    if workers <= 1:
+        for start, end in blocks:
+            sorted_result[start:end] = _join_block(shapefile_path, sorted_xs[start:end], sorted_ys[start:end])
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_pool_context(),
+                                 initializer=setup_pool_worker) as pool:
+            futures = [(start, end, pool.submit(_join_block, shapefile_path, sorted_xs[start:end], sorted_ys[start:end]))
+                       for start, end in blocks]
+            for start, end, future in futures:
+                sorted_result[start:end] = future.result()
+
+    result = np.empty_like(sorted_result)
+    result[order] = sorted_result
+    return result
+
+
+def join_properties_to_layer(layer, workers=None):
+    """
+    Rebuild the join of all properties with coordinates to a polygon layer
+
+    Args:
+        layer: Shapefile MapLayer instance
+        workers: Number of worker processes (see join_points_to_polygons)
+
+    Returns:
+        int: Number of properties assigned to a polygon
+    """
+    from django.db import transaction
+    from maps.models import Property, PropertyLayerFeature
+
+    shapefile_path = layer.get_local_shapefile()
+    if not shapefile_path:
+        raise ValueError(f"Layer {layer.id} has no shapefile")
+
+    rows = np.array(
+        Property.objects.filter(latitude__isnull=False, longitude__isnull=False)
+        .values_list('id', 'longitude', 'latitude'),
+        dtype=np.float64,
+    ).reshape(-1, 3)
+    feature_ids = join_points_to_polygons(shapefile_path, rows[:, 1], rows[:, 2], workers)
+    matched = feature_ids != NO_FEATURE
+
+    # Attributes are read once per polygon, then stored with each member property
+    reader = shapefile.Reader(shapefile_path)
+    try:
+        field_names = [field[0] for field in reader.fields[1:]]  # Skip DeletionFlag
+        attributes = {}
+        for i in np.unique(feature_ids[matched]).tolist():
+            properties = record_to_properties(reader.record(i), field_names)
+            attributes[i] = json.loads(json.dumps(properties, default=json_serial))
+    finally:
+        reader.close()
+
+    with transaction.atomic():
+        PropertyLayerFeature.objects.filter(layer=layer).delete()
+        batch = []
+        for property_id, feature_id in zip(rows[matched, 0].astype(np.int64).tolist(), feature_ids[matched].tolist()):
+            batch.append(PropertyLayerFeature(property_id=property_id, layer=layer, feature_id=feature_id,
+                                              properties=attributes[feature_id]))
+            if len(batch) >= SAVE_BATCH_SIZE:
+                PropertyLayerFeature.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            PropertyLayerFeature.objects.bulk_create(batch)
+
+    joined = int(matched.sum())
+    logger.info(f"Joined {joined} of {len(rows)} properties to layer {layer.id}")
+    return joined
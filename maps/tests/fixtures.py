@@ -0,0 +1,60 @@
+"""Shapefile and geometry fixtures shared by the maps tests."""
+
+import math
+
+import shapefile
+
+POINT_SHAPE_TYPES = (shapefile.POINT, shapefile.POINTZ, shapefile.POINTM)
+LINE_SHAPE_TYPES = (shapefile.POLYLINE, shapefile.POLYLINEZ, shapefile.POLYLINEM)
+
+
+def square(x0, y0, size, clockwise=True):
+    """Closed square ring, clockwise (exterior) by default."""
+    ring = [[x0, y0], [x0, y0 + size], [x0 + size, y0 + size], [x0 + size, y0], [x0, y0]]
+    return ring if clockwise else list(reversed(ring))
+
+
+def circle(radius, count, cx=0.0, cy=0.0):
+    """Closed ring approximating a circle, clockwise like a shapefile exterior ring."""
+    ring = [(cx + radius * math.cos(-2 * math.pi * i / count),
+             cy + radius * math.sin(-2 * math.pi * i / count)) for i in range(count)]
+    return ring + [ring[0]]
+
+
+def write_shapefile(path, shape_type, fields, features):
+    """
+    Write a shapefile
+
+    Args:
+        path: Path of the .shp file
+        shape_type: pyshp shape type of the layer
+        fields: Field definitions, each a tuple of pyshp Writer.field arguments
+        features: (geometry, record values) pairs; the geometry is an (x, y) point,
+                  a list of rings/parts, or None for a null shape
+
+    Returns:
+        str: The path
+    """
+    writer = shapefile.Writer(path, shapeType=shape_type)
+    try:
+        for field in fields:
+            writer.field(*field)
+        for geometry, values in features:
+            if geometry is None:
+                writer.null()
+            elif shape_type in POINT_SHAPE_TYPES:
+                writer.point(*geometry)
+            elif shape_type in LINE_SHAPE_TYPES:
+                writer.line(geometry)
+            else:
+                writer.poly(geometry)
+            writer.record(*values)
+    finally:
+        writer.close()
+    return path
+
+
+def write_points(path, names, step=0.01):
+    """Write a row of points eastward from (-73.5, 45.5), one per name, with a NAME column."""
+    features = [((-73.5 + i * step, 45.5), [name]) for i, name in enumerate(names)]
+    return write_shapefile(path, shapefile.POINT, [('NAME', 'C')], features)
@@ -0,0 +1,64 @@
+import os
+import tempfile
+
+import shapefile
+from django.test import SimpleTestCase
+
+from maps.attribute_index import AttributeFilterError, check_where, get_index_path, parse_where, select_records
+from maps.tests.fixtures import write_shapefile
+
+
+class AttributeIndexTest(SimpleTestCase):
+    """Test case for where filters answered from the per-column indexes."""
+
+    def setUp(self):
+        """Write a shapefile of points with a numeric and a categorical column."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'parcels.shp')
+        self.records = [((i * 37) % 2000 + 0.5, ('R1', 'R2', 'C1', "O'N")[i % 4]) for i in range(500)]
+        write_shapefile(self.path, shapefile.POINT, [('AREA', 'N', 50, 1), ('ZONE', 'C', 10)],
+                        [((-73.5 + i * 0.001, 45.5), record) for i, record in enumerate(self.records)])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def expected(self, predicate):
+        return [i for i, record in enumerate(self.records) if predicate(*record)]
+
+    def test_parse_where(self):
+        """Test that conditions are parsed and malformed filters are rejected."""
+        self.assertEqual(parse_where("ZONE IN ('R1', R2) and AREA >= 1000"),
+                         [('ZONE', 'IN', ['R1', 'R2']), ('AREA', '>=', ['1000'])])
+        for where in ("ZONE", "ZONE = 'R1' OR AREA < 3", "ZONE IN ('R1'", "= 3"):
+            with self.assertRaises(AttributeFilterError):
+                parse_where(where)
+
+    def test_equality_ranges_and_in(self):
+        """Test that the indexes return exactly the matching records, in order."""
+        cases = [
+            ("ZONE = 'R1'", lambda area, zone: zone == 'R1'),
+            ("ZONE = 'O''N'", lambda area, zone: zone == "O'N"),
+            ("AREA > 1000", lambda area, zone: area > 1000),
+            ("AREA <= 100.5", lambda area, zone: area <= 100.5),
+            ("ZONE IN (R2, C1, R2) AND AREA >= 500 AND AREA < 1500",
+             lambda area, zone: zone in ('R2', 'C1') and 500 <= area < 1500),
+            ("AREA IN (37.5, 74.5, 3)", lambda area, zone: area in (37.5, 74.5)),
+            ("ZONE < R", lambda area, zone: zone < 'R'),
+        ]
+        for where, predicate in cases:
+            self.assertEqual(select_records(self.path, where).tolist(), self.expected(predicate), where)
+
+    def test_invalid_filter_for_layer(self):
+        """Test that unknown fields and non-numeric values are rejected."""
+        with self.assertRaises(AttributeFilterError):
+            select_records(self.path, "NAME = 'x'")
+        with self.assertRaises(AttributeFilterError):
+            select_records(self.path, "AREA > big")
+
+    def test_check_where(self):
+        """Test that filters are checked against the .dbf header without building the index."""
+        self.assertEqual(check_where(self.path, "AREA > 10"), [('AREA', '>', ['10'])])
+        for where in ("NAME = 'x'", "AREA > big", "ZONE ="):
+            with self.assertRaises(AttributeFilterError):
+                check_where(self.path, where)
+        self.assertFalse(os.path.exists(get_index_path(self.path)))
@@ -0,0 +1,46 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, Client
+
+from maps.cache_warming import get_map_preset, get_warm_zooms
+from maps.models import MapLayer, Region
+from maps.tests.fixtures import write_points
+
+
+class CacheWarmingTest(TestCase):
+    """Test case for pre-rendering layers at the zoom presets of the map."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        write_points(os.path.join(self.temp_dir.name, 'wells.shp'), [f"well {i}" for i in range(50)])
+        self.layer = MapLayer.objects.create(name='Wells', layer_type='shapefile', shapefile_dir=self.temp_dir.name)
+        self.cache_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch('maps.caching.FILE_CACHE_DIR', self.cache_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = Client()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+        self.temp_dir.cleanup()
+
+    def test_map_presets(self):
+        """Test the zoom bands of map.js and the zoom levels warmed."""
+        self.assertEqual(get_map_preset(8), ('0.01', 5000))
+        self.assertEqual(get_map_preset(12), ('0.005', 10000))
+        self.assertEqual(get_map_preset(13), ('0.002', 15000))
+        self.assertEqual(get_map_preset(18), ('0.001', 25000))
+        Region.objects.create(name='Test', center_latitude=45.5, center_longitude=-73.5, default_zoom=9)
+        self.assertEqual(get_warm_zooms(), [9, 10, 12, 14, 16])
+
+    def test_warmed_layer_is_served_from_file_cache(self):
+        """Test that the map's request for a warmed zoom level hits the cache file."""
+        call_command('warm_layer_cache', zooms='11', workers=1, stdout=open(os.devnull, 'w'))
+
+        response = self.client.get(f'/api/layer/{self.layer.id}/data/',
+                                   {'simplify': '0.005', 'max_features': '10000', 'zoom': '11'})
+        self.assertEqual(response['X-Cache'], 'FILE-HIT')
+        self.assertIn(b'well 49', b''.join(response.streaming_content))
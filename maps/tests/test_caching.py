@@ -0,0 +1,301 @@
+import gzip
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from maps.caching import (
+    SHARED_CACHE_NAME, TieredCache, clear_layer_cache, get_accepted_encodings, get_cache_key,
+    get_compressed_cache_path, get_file_cache_path, get_file_cache_usage, get_tile_cache_key, layer_cache,
+    parse_cache_key, remove_stale_entries,
+)
+from maps.shared_cache import SharedSQLiteCache
+
+
+def cache_files(directory):
+    """Names of the file tier's files in a cache directory, without the shared store's database."""
+    return sorted(name for name in os.listdir(directory) if not name.startswith(SHARED_CACHE_NAME))
+
+
+class StreamToFileCacheTest(SimpleTestCase):
+    """Test case for writing streamed responses to the file cache."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch('maps.caching.FILE_CACHE_DIR', self.temp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_complete_stream_is_cached(self):
+        """Test that the streamed bytes match the pieces and end up in the cache."""
+        pieces = ['{"type": "FeatureCollection", "features": [']
+        pieces += [', ' * (i > 0) + json.dumps({'type': 'Feature', 'id': i}) for i in range(5000)]
+        pieces.append(']}')
+
+        body = b''.join(TieredCache().stream('key', iter(pieces)))
+        self.assertEqual(body, ''.join(pieces).encode('utf-8'))
+        with open(get_file_cache_path('key'), 'rb') as f:
+            self.assertEqual(f.read(), body)
+        with gzip.open(get_compressed_cache_path('key', 'gzip'), 'rb') as f:
+            self.assertEqual(f.read(), body)
+
+    def test_interrupted_stream_is_discarded(self):
+        """Test that a stream closed early leaves no cache entry or temporary file."""
+        stream = TieredCache().stream('key', ('x' * 1024 for _ in range(1000)))
+        next(stream)
+        stream.close()
+        self.assertEqual(cache_files(self.temp_dir.name), [])
+
+
+class CompressedCacheTest(SimpleTestCase):
+    """Test case for precompressed cache variants."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch('maps.caching.FILE_CACHE_DIR', self.temp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_accepted_encodings(self):
+        """Test Accept-Encoding parsing against the available encodings."""
+        self.assertIn('gzip', get_accepted_encodings('gzip, deflate, br'))
+        self.assertEqual(get_accepted_encodings('deflate'), [])
+        self.assertEqual(get_accepted_encodings('gzip;q=0'), [])
+        self.assertEqual(get_accepted_encodings(None), [])
+
+    def test_file_cache_variants(self):
+        """Test that file cache writes come with a gzip variant."""
+        data = json.dumps({'type': 'FeatureCollection', 'features': [{'id': i} for i in range(1000)]})
+        layer_cache = TieredCache(memory_max_entry_size=0)
+        self.assertEqual(layer_cache.set('key', data).tier, 'file')
+
+        entry = layer_cache.get('key', ['gzip'])
+        self.assertEqual((entry.tier, entry.encoding), ('file', 'gzip'))
+        with gzip.open(entry.file, 'rb') as f:
+            self.assertEqual(f.read().decode('utf-8'), data)
+        self.assertLess(os.path.getsize(get_compressed_cache_path('key', 'gzip')), len(data) / 5)
+        entry = layer_cache.get('key')
+        with entry.file:
+            self.assertEqual(entry.encoding, None)
+
+
+class TieredCacheTest(SimpleTestCase):
+    """Test case for the byte budgets, LRU eviction and counters of the tiered cache."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch('maps.caching.FILE_CACHE_DIR', self.temp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_memory_tier_evicts_least_recently_used(self):
+        """Test that entries are evicted by recency until the new one fits the budget."""
+        layer_cache = TieredCache(memory_budget=3000, memory_max_entry_size=2000, shared_budget=0)
+        for key in ('a', 'b', 'c'):
+            layer_cache.set(key, 'x' * 1000, compress=False, persist=False)
+        self.assertEqual(layer_cache.get('a').data, b'x' * 1000)  # Now more recent than b
+
+        layer_cache.set('d', 'y' * 1500, compress=False, persist=False)
+        self.assertIsNone(layer_cache.get('b'))
+        self.assertIsNone(layer_cache.get('c'))
+        self.assertIsNotNone(layer_cache.get('a'))
+
+        # Entries over the per-entry limit are not kept in memory
+        self.assertIsNone(layer_cache.set('e', 'z' * 2500, compress=False, persist=False))
+        stats = layer_cache.stats()['memory']
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (2, 2, 2))
+        self.assertEqual((stats['entries'], stats['bytes']), (2, 2500))
+
+    def test_file_tier_budget(self):
+        """Test that file entries over the budget are evicted oldest first, across instances."""
+        layer_cache = TieredCache(memory_max_entry_size=0, file_budget=2500)
+        layer_cache.set('a', 'x' * 1000, compress=False)
+        layer_cache.set('b', 'x' * 1000, compress=False)
+        self.assertEqual(layer_cache.get_text('a'), 'x' * 1000)  # Now more recent than b
+        layer_cache.set('c', 'x' * 1000, compress=False)
+
+        self.assertFalse(os.path.exists(get_file_cache_path('b')))
+        self.assertEqual(cache_files(self.temp_dir.name), ['a.geojson', 'c.geojson'])
+        self.assertEqual(layer_cache.stats()['file']['evictions'], 1)
+
+        # Another process's cache finds the entries on disk
+        other = TieredCache(memory_max_entry_size=0, file_budget=2500)
+        self.assertEqual(other.stats()['file']['bytes'], 2000)
+        self.assertEqual(other.get_text('c'), 'x' * 1000)
+        self.assertIsNone(other.get_text('b'))
+        self.assertEqual((other.stats()['file']['hits'], other.stats()['file']['misses']), (1, 1))
+
+    def test_sweep_by_access_time(self):
+        """Test that sweeps drop expired and leftover files, then evict by access time across processes."""
+        layer_cache = TieredCache(memory_max_entry_size=0, file_budget=20000, file_expiry=3600)
+        keys = [get_cache_key(1, 'a1', '0.01', 5000, str(zoom)) for zoom in (10, 12, 14)]
+        other_layer_key = get_cache_key(2, 'b2', '0.01', 5000, '10')
+        for key in keys + [other_layer_key]:
+            layer_cache.set(key, 'x' * 3000, compress=False)
+
+        now = time.time()
+        # The first key was read last, by another process; the other layer's entry was written long ago
+        for age, key in zip((10, 300, 200), keys):
+            os.utime(get_file_cache_path(key), (now - age, now - 400))
+        os.utime(get_file_cache_path(other_layer_key), (now - 100, now - 7200))
+        # Leftovers of a crashed write and of a partially cleared entry
+        with open(get_file_cache_path('gone') + '.gz', 'wb') as f:
+            f.write(b'x' * 10)
+        temp_file = get_file_cache_path('crashed') + '.1.1.tmp'
+        with open(temp_file, 'wb') as f:
+            f.write(b'x' * 10)
+        os.utime(temp_file, (now - 7200, now - 7200))
+
+        usage = get_file_cache_usage()
+        self.assertEqual((usage[1]['entries'], usage[1]['bytes'], usage[2]['entries']), (3, 9000, 1))
+        self.assertEqual(usage[None]['bytes'], 10)
+
+        # Expired entries are only removed once they are past the stale window too
+        swept = TieredCache(file_budget=10000, file_expiry=3600, stale_window=1800).sweep(target=5000)
+        self.assertEqual((swept['expired'], swept['orphaned'], swept['evicted'], swept['temp_files']), (1, 1, 2, 1))
+        self.assertEqual((swept['entries'], swept['bytes'], swept['bytes_freed']), (1, 3000, 9020))
+        self.assertEqual(cache_files(self.temp_dir.name), [os.path.basename(get_file_cache_path(keys[0]))])
+
+    def test_hits_record_access_time(self):
+        """Test that a hit moves the access time forward and keeps the write time expiry uses."""
+        layer_cache = TieredCache(memory_max_entry_size=0)
+        layer_cache.set('a', 'x' * 100, compress=False)
+        os.utime(get_file_cache_path('a'), (1000000, 2000000))
+        self.assertEqual(layer_cache.get_text('a'), None)  # Expired by its write time
+
+        layer_cache.set('a', 'x' * 100, compress=False)
+        written = os.path.getmtime(get_file_cache_path('a'))
+        os.utime(get_file_cache_path('a'), (written - 1000, written))
+        self.assertEqual(layer_cache.get_text('a'), 'x' * 100)
+        self.assertGreater(os.path.getatime(get_file_cache_path('a')), written - 1000)
+        self.assertEqual(os.path.getmtime(get_file_cache_path('a')), written)
+
+
+    def test_stale_entries(self):
+        """Test that expired entries are only returned on request, flagged stale, and dropped after the window."""
+        layer_cache = TieredCache(memory_max_entry_size=0, file_expiry=3600, stale_window=3600)
+        layer_cache.set('a', 'x' * 100, compress=False)
+        written = time.time()
+        os.utime(get_file_cache_path('a'), (written, written - 5000))
+        self.assertIsNone(layer_cache.get('a'))
+        self.assertFalse(layer_cache.contains('a'))
+        entry = layer_cache.get('a', stale=True)
+        self.assertEqual((entry.tier, entry.stale), ('file', True))
+        entry.file.close()
+        os.utime(get_file_cache_path('a'), (written, written - 8000))
+        self.assertIsNone(layer_cache.get('a', stale=True))
+        self.assertEqual(cache_files(self.temp_dir.name), [])
+
+        layer_cache.set('tile', b't' * 100, timeout=0.01, compress=False, persist=False)
+        time.sleep(0.05)
+        self.assertIsNone(layer_cache.get('tile'))
+        self.assertEqual(layer_cache.get('tile', stale=True), ('shared', None, b't' * 100, None, True))
+
+        # An expired memory entry gives way to a fresh file
+        layer_cache = TieredCache(file_expiry=3600, stale_window=3600)
+        layer_cache.set('b', 'y' * 100, timeout=0.01, compress=False)
+        time.sleep(0.05)
+        entry = layer_cache.get('b', stale=True)
+        self.assertEqual((entry.tier, entry.stale), ('file', False))
+        entry.file.close()
+        os.remove(get_file_cache_path('b'))
+        layer_cache.set('b', 'y' * 100, timeout=0.01, compress=False)
+        os.remove(get_file_cache_path('b'))
+        time.sleep(0.05)
+        self.assertEqual(layer_cache.get('b', stale=True), ('memory', None, b'y' * 100, None, True))
+
+    def test_shared_tier_across_workers(self):
+        """Test that an entry one worker stores is found by another, with the same accounting."""
+        worker, other_worker = (TieredCache(memory_max_entry_size=0, shared_budget=25000) for _ in range(2))
+        stored = worker.set('tile', b't' * 10000, compress=False, persist=False)
+        self.assertEqual(stored.tier, 'shared')
+        self.assertEqual(other_worker.get('tile'), ('shared', None, b't' * 10000, None, False))
+        self.assertEqual(cache_files(self.temp_dir.name), [])
+
+        # Writes of either worker evict the least recently used entries of both
+        other_worker.set('other', b'o' * 10000, compress=False, persist=False)
+        worker.set('third', b'x' * 10000, compress=False, persist=False)
+        self.assertIsNone(other_worker.get('tile'))
+        self.assertEqual(worker.stats()['shared']['bytes'], other_worker.stats()['shared']['bytes'])
+        self.assertEqual(worker.stats()['shared']['entries'], 2)
+
+    def test_shared_tier_entries_are_not_pickled(self):
+        """Test that shared entries keep their variants as bytes, and other blobs are read as misses."""
+        worker = TieredCache(memory_max_entry_size=0)
+        worker.set('layer', b'{"features": []}' * 100, compress=True, persist=False)
+        store = worker.shared._store()
+        self.assertNotIn(b'\x80', store.get('layer')[:2])  # No pickle protocol header
+        self.assertEqual(worker.get('layer', encodings=['gzip']).encoding, 'gzip')
+
+        store.set('pickled', b'\x80\x05\x95\x00\x00\x00\x00')
+        self.assertIsNone(worker.shared.get('pickled'))
+
+    def test_django_backend(self):
+        """Test the Django cache API of the shared store."""
+        backend = SharedSQLiteCache(os.path.join(self.temp_dir.name, 'django.sqlite3'), {})
+        backend.set('layers', {'count': 3})
+        self.assertEqual(backend.get('layers'), {'count': 3})
+        self.assertFalse(backend.add('layers', 'other'))
+        self.assertTrue(backend.add('regions', [1, 2]))
+        backend.set('expired', 1, timeout=0)
+        self.assertIsNone(backend.get('expired'))
+        self.assertTrue(backend.delete('layers'))
+        self.assertEqual(backend.get('layers', 'missing'), 'missing')
+        backend.clear()
+        self.assertFalse(backend.has_key('regions'))
+
+
+class VersionedCacheKeyTest(SimpleTestCase):
+    """Test case for per-layer, per-version invalidation of cache entries."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch('maps.caching.FILE_CACHE_DIR', self.temp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(layer_cache.memory.clear)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_keys_carry_layer_and_version(self):
+        """Test that every kind of layer key parses back to its layer and version."""
+        data_key = get_cache_key(12, 'ab12', '0.01', 5000, '10', ['NAME'], 'AREA > 5')
+        self.assertEqual(parse_cache_key(data_key), (12, 'ab12'))
+        self.assertEqual(parse_cache_key(f"topojson_{data_key}_10000"), (12, 'ab12'))
+        self.assertEqual(parse_cache_key(f"{data_key}_chunk_0_1"), (12, 'ab12'))
+        self.assertEqual(parse_cache_key(get_tile_cache_key(12, 'ab12', 14, 4844, 5860)), (12, 'ab12'))
+        self.assertEqual(parse_cache_key('preview_123'), (None, None))
+        self.assertNotEqual(get_cache_key(12, 'cd34', '0.01', 5000, '10'), get_cache_key(12, 'ab12', '0.01', 5000, '10'))
+
+    def test_clear_layer_cache(self):
+        """Test that a layer's old versions are removed from both tiers, other layers kept until stale."""
+        old, new = get_cache_key(1, 'aa', '0.01', 5000), get_cache_key(1, 'bb', '0.01', 5000)
+        other = get_cache_key(11, 'aa', '0.01', 5000)
+        for key in (old, new, other):
+            layer_cache.set(key, 'x' * 100, compress=False)
+        layer_cache.set(get_tile_cache_key(1, 'aa', 14, 1, 1), b'tile', compress=False, persist=False)
+
+        clear_layer_cache(1, keep_version='bb')
+        self.assertIsNone(layer_cache.get(old))
+        self.assertIsNone(layer_cache.get(get_tile_cache_key(1, 'aa', 14, 1, 1)))
+        self.assertIsNotNone(layer_cache.get(new))
+        self.assertIsNotNone(layer_cache.get(other))
+
+        # Layer 11 was deleted
+        self.assertEqual(remove_stale_entries({1: 'bb'}), 1)
+        self.assertEqual(cache_files(self.temp_dir.name), [os.path.basename(get_file_cache_path(new))])
+        clear_layer_cache(1)
+        self.assertEqual(cache_files(self.temp_dir.name), [])
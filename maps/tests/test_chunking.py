@@ -0,0 +1,112 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+import shapefile
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from maps import chunking
+from maps.caching import layer_cache
+from maps.chunking import extract_chunks, process_layer_in_chunks
+from maps.models import MapLayer
+from maps.spatial_index import build_spatial_index
+from maps.tests.fixtures import square, write_shapefile
+
+
+class ChunkExtractionTest(SimpleTestCase):
+    """Test case for extracting the chunks of a viewport across the process pool."""
+
+    def setUp(self):
+        """Write a 20x20 grid of points indexed with an R-tree."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'grid.shp')
+        write_shapefile(self.path, shapefile.POINT, [('NAME', 'C')],
+                        [((col + 0.5, row + 0.5), [f"{row}-{col}"]) for row in range(20) for col in range(20)])
+        build_spatial_index(self.path)
+        self.chunks = [{'chunk_id': f'chunk_{i}_{j}', 'bbox': (i * 10, j * 10, i * 10 + 10, j * 10 + 10),
+                        'shapefile_path': self.path} for i in range(2) for j in range(2)]
+
+    def tearDown(self):
+        chunking._reset_chunk_pool()
+        self.temp_dir.cleanup()
+
+    def test_parallel_extraction_matches_serial(self):
+        """Test that pooled workers return each chunk's features, in chunk order."""
+        with override_settings(CHUNK_EXTRACTION_WORKERS=1):
+            serial = extract_chunks(self.chunks, 1000, 0.0, fields=['NAME'])
+        with override_settings(CHUNK_EXTRACTION_WORKERS=2):
+            parallel = extract_chunks(self.chunks, 1000, 0.0, fields=['NAME'])
+
+        self.assertEqual(parallel, serial)
+        counts = [len(json.loads(data)['features']) for data in parallel]
+        self.assertEqual(counts, [100, 100, 100, 100])
+        first = json.loads(parallel[1])['features'][0]
+        self.assertEqual(first['properties'], {'NAME': '10-0'})  # Chunk 0_1 covers rows 10-19
+
+
+@override_settings(CHUNK_EXTRACTION_WORKERS=1)
+class ViewportChunkingTest(TestCase):
+    """Test case for serving the part of a chunked layer within the map view."""
+
+    def setUp(self):
+        """Write a 70x70 grid of squares, plus one straddling the chunk boundary at x=35, in four chunks."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'parcels.shp')
+        features = [([square(col + 0.1, row + 0.1, 0.8)], [f"{row}-{col}"]) for row in range(70) for col in range(70)]
+        write_shapefile(self.path, shapefile.POLYGON, [('NAME', 'C')],
+                        features + [([square(34.6, 5.2, 0.8)], ['straddling'])])
+        build_spatial_index(self.path)
+        chunks = chunking.chunk_shapefile(self.path, max_features_per_chunk=2000)
+        with open(chunking.get_chunk_manifest_path(self.path), 'w') as f:
+            json.dump({'shapefile_mtime': os.path.getmtime(self.path), 'chunks': chunks}, f)
+        self.assertEqual(len(chunks), 4)
+
+        self.layer = MapLayer.objects.create(name='Parcels', layer_type='shapefile', shapefile_dir=self.temp_dir.name)
+        self.cache_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch('maps.caching.FILE_CACHE_DIR', self.cache_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(layer_cache.memory.clear)
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+        self.temp_dir.cleanup()
+
+    def get_features(self, view_bbox, zoom_level):
+        data = json.loads(process_layer_in_chunks(self.layer, view_bbox, zoom_level, simplify='0'))
+        return data['features'], data['info']
+
+    def test_only_features_in_view(self):
+        """Test that features outside the view are left out, and one in two chunks is included once."""
+        features, info = self.get_features((30, 0, 40, 10), 12)
+        names = [feature['properties']['NAME'] for feature in features]
+        expected = {f"{row}-{col}" for row in range(10) for col in range(30, 40)} | {'straddling'}
+        self.assertEqual(len(names), len(expected))
+        self.assertEqual(set(names), expected)
+        self.assertEqual(info['total_features'], 4901)
+
+    def test_features_in_view_not_truncated(self):
+        """Test that chunks holding more features than the former per-chunk caps are served whole."""
+        features, info = self.get_features((0, 0, 70, 70), 5)
+        self.assertEqual(len(features), 4901)
+        self.assertEqual(len({feature['id'] for feature in features}), 4901)
+        self.assertEqual(info['included_features'], 4901)
+
+    def test_max_features_samples_view(self):
+        """Test that a feature limit samples across the view rather than keeping the first records."""
+        data = json.loads(process_layer_in_chunks(self.layer, (0, 0, 70, 70), 5, simplify='0', max_features=400))
+        rows = {int(feature['properties']['NAME'].split('-')[0]) for feature in data['features']
+                if feature['properties']['NAME'] != 'straddling'}
+        self.assertLessEqual(len(data['features']), 400)
+        self.assertGreater(max(rows) - min(rows), 50)
+
+    def test_panning_reuses_cached_cells(self):
+        """Test that a view shifted within the same cells is served from the cache without extracting."""
+        self.get_features((30, 0, 40, 10), 12)
+        with mock.patch('maps.chunking.extract_chunks') as extract:
+            features, _ = self.get_features((30.5, 0.5, 40.5, 10.5), 12)
+        extract.assert_not_called()
+        names = {feature['properties']['NAME'] for feature in features}
+        self.assertIn('10-40', names)  # Only in the shifted view
+        self.assertNotIn('bbox', features[0])
@@ -0,0 +1,172 @@
+import os
+import struct
+import tempfile
+
+import shapefile
+from django.test import SimpleTestCase
+
+from maps.geobuf import accepts_geobuf, encode_geometry, encode_layer
+from maps.geometry_store import build_geometry_store
+from maps.protobuf import pack_varints, varint
+from maps.tests.fixtures import square, write_shapefile
+
+
+def read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def read_fields(data):
+    """Split a protobuf message into (field number, value) pairs."""
+    pos, fields = 0, []
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        else:
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        fields.append((field, value))
+    return fields
+
+
+def read_packed(data, signed=False):
+    pos, values = 0, []
+    while pos < len(data):
+        value, pos = read_varint(data, pos)
+        values.append((value >> 1) ^ -(value & 1) if signed else value)
+    return values
+
+
+def decode_line(coords, count, closed):
+    """Undo the per-line delta encoding of geobuf."""
+    points, x, y = [], 0, 0
+    for k in range(count):
+        x, y = x + coords[2 * k], y + coords[2 * k + 1]
+        points.append([x / 1e6, y / 1e6])
+    if closed:
+        points.append(points[0])
+    return points, coords[2 * count:]
+
+
+def decode_geometry(data):
+    """Decode a Geometry message the way the geobuf JavaScript decoder does."""
+    fields = dict(read_fields(data))
+    geom_type = fields.get(1, 0)
+    lengths = read_packed(fields[2]) if 2 in fields else None
+    coords = read_packed(fields.get(3, b''), signed=True)
+    if geom_type == 0:
+        return {'type': 'Point', 'coordinates': [coords[0] / 1e6, coords[1] / 1e6]}
+    if geom_type == 2:
+        return {'type': 'LineString', 'coordinates': decode_line(coords, len(coords) // 2, False)[0]}
+    if geom_type in (3, 4):
+        closed = geom_type == 4
+        lines = []
+        for length in (lengths or [len(coords) // 2]):
+            line, coords = decode_line(coords, length, closed)
+            lines.append(line)
+        return {'type': 'Polygon' if closed else 'MultiLineString', 'coordinates': lines}
+    if geom_type == 5:
+        polygons = []
+        if lengths is None:
+            lengths = [1, 1, len(coords) // 2]
+        position = 1
+        for _ in range(lengths[0]):
+            rings = []
+            ring_count = lengths[position]
+            for length in lengths[position + 1:position + 1 + ring_count]:
+                ring, coords = decode_line(coords, length, True)
+                rings.append(ring)
+            position += ring_count + 1
+            polygons.append(rings)
+        return {'type': 'MultiPolygon', 'coordinates': polygons}
+    raise ValueError(geom_type)
+
+
+def decode_value(data):
+    field, value = read_fields(data)[0]
+    if field == 1:
+        return value.decode('utf-8')
+    if field == 2:
+        return struct.unpack('<d', value)[0]
+    if field == 3:
+        return value
+    if field == 4:
+        return -value
+    return value
+
+
+class GeobufTest(SimpleTestCase):
+    """Test case for the Geobuf binary encoding."""
+
+    def test_geometries_round_trip(self):
+        """Test that every geometry type decodes back to its coordinates."""
+        square = [[-73.5, 45.5], [-73.5, 45.6], [-73.4, 45.6], [-73.4, 45.5], [-73.5, 45.5]]
+        hole = [[-73.48, 45.52], [-73.42, 45.52], [-73.42, 45.58], [-73.48, 45.58], [-73.48, 45.52]]
+        geometries = [
+            {'type': 'Point', 'coordinates': [-73.567, 45.501]},
+            {'type': 'LineString', 'coordinates': [[-73.5, 45.5], [-73.4, 45.6], [-73.3, 45.5]]},
+            {'type': 'MultiLineString', 'coordinates': [[[0, 0], [1, 1]], [[2, 2], [3, 3], [4, 2]]]},
+            {'type': 'Polygon', 'coordinates': [square, hole]},
+            {'type': 'MultiPolygon', 'coordinates': [[square, hole], [[[1, 1], [1, 2], [2, 2], [1, 1]]]]},
+        ]
+        for geometry in geometries:
+            self.assertEqual(decode_geometry(encode_geometry(geometry)), geometry)
+
+    def test_encode_layer(self):
+        """Test that a shapefile encodes to keys and features with their attributes."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'lots.shp')
+            write_shapefile(path, shapefile.POLYGON, [('NAME', 'C'), ('AREA', 'N', 50, 2)],
+                            [([square(i, 0, 1)], (f"lot_{i}", i + 0.5)) for i in range(20)])
+
+            data = encode_layer(path, simplify='none', max_features=5)
+
+        fields = read_fields(data)
+        keys = [value.decode('utf-8') for field, value in fields if field == 1]
+        self.assertEqual(keys, ['NAME', 'AREA'])
+        collection = [value for field, value in fields if field == 4][0]
+        features = [value for field, value in read_fields(collection) if field == 1]
+        self.assertEqual(len(features), 5)
+
+        feature = read_fields(features[1])
+        geometry = decode_geometry(feature[0][1])
+        self.assertEqual(geometry['coordinates'][0][0], [4.0, 0.0])
+        values = [decode_value(value) for field, value in feature if field == 13]
+        self.assertEqual(values, ['lot_4', 4.5])
+        self.assertEqual(dict(feature)[12], 8)  # Zigzag-encoded record number 4
+
+    def test_store_and_shapefile_encode_alike(self):
+        """Test that features encoded from the geometry store match those encoded from the shapefile."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'blocks.shp')
+            write_shapefile(path, shapefile.POLYGON, [('ID', 'N')], [
+                ([square(i, 0, 1), square(i + 0.25, 0.25, 0.5, clockwise=False)] if i % 2 else [square(i, 0, 1)], [i])
+                for i in range(10)
+            ])
+
+            from_shapefile = encode_layer(path, simplify='none')
+            build_geometry_store(path)
+            self.assertEqual(encode_layer(path, simplify='none'), from_shapefile)
+
+    def test_pack_varints(self):
+        """Test that vectorized varints match the one-by-one encoding."""
+        values = [0, 1, 127, 128, 300, 2 ** 21, 2 ** 35 + 5, 2 ** 63 + 1] * 10
+        self.assertEqual(pack_varints(values), b''.join(varint(value) for value in values))
+
+    def test_accept_header(self):
+        """Test content negotiation on the Accept header."""
+        self.assertTrue(accepts_geobuf('application/x-geobuf, application/json;q=0.5'))
+        self.assertTrue(accepts_geobuf('application/x-protobuf'))
+        self.assertFalse(accepts_geobuf('application/json, */*'))
+        self.assertFalse(accepts_geobuf('application/x-geobuf;q=0'))
+        self.assertFalse(accepts_geobuf(None))
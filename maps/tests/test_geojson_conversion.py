@@ -0,0 +1,43 @@
+import json
+import os
+import tempfile
+
+import shapefile
+from django.test import SimpleTestCase
+
+from maps.models import MapLayer
+from maps.tests.fixtures import write_shapefile
+
+
+class GeoJSONConversionTest(SimpleTestCase):
+    """Test case for converting shapefile layers to GeoJSON."""
+
+    def setUp(self):
+        """Write a shapefile with one numbered point per record."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        write_shapefile(os.path.join(self.temp_dir.name, 'points.shp'), shapefile.POINT,
+                        [('NUM', 'N'), ('NAME', 'C', 20)],
+                        [((-73.5 + i * 0.001, 45.5), (i, f'point {i}')) for i in range(1000)])
+        self.layer = MapLayer(id=1, name='points', layer_type='shapefile', shapefile_dir=self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_max_features_samples_every_nth_record(self):
+        """Test that sampling reads every step-th record up to the limit."""
+        data = json.loads(self.layer.get_geojson_data(simplify='none', max_features=30))
+        numbers = [feature['properties']['NUM'] for feature in data['features']]
+        self.assertEqual(numbers, list(range(0, 1000, 33))[:30])
+        self.assertEqual(data['info'], {'total_features': 1000, 'included_features': 30, 'simplification': 'none'})
+
+    def test_stream_matches_full_conversion(self):
+        """Test that the streamed pieces join to the same document."""
+        expected = self.layer.get_geojson_data(simplify='none')
+        self.assertEqual(''.join(self.layer.stream_geojson_data(simplify='none')), expected)
+        self.assertEqual(len(json.loads(expected)['features']), 1000)
+
+    def test_fields_projection(self):
+        """Test that only the requested attributes are included."""
+        data = json.loads(self.layer.get_geojson_data(simplify='none', max_features=10, fields=['NAME']))
+        self.assertEqual(data['features'][1]['properties'], {'NAME': 'point 100'})
+        self.assertEqual(self.layer.get_field_names(), ['NUM', 'NAME'])
@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+import numpy as np
+import shapefile
+from django.test import SimpleTestCase
+
+from maps.geometry_store import build_geometry_store, get_geometry_store
+from maps.tests.fixtures import square, write_shapefile
+
+
+def as_json(geometry):
+    return json.loads(json.dumps(geometry))
+
+
+class GeometryStoreTest(SimpleTestCase):
+    """Test case for the memory-mapped columnar geometry store."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, name, shape_type, geometries):
+        return write_shapefile(os.path.join(self.temp_dir.name, f"{name}.shp"), shape_type, [('ID', 'N')],
+                               [(geometry, [i]) for i, geometry in enumerate(geometries)])
+
+    def assert_matches_pyshp(self, path):
+        build_geometry_store(path)
+        store = get_geometry_store(path)
+        reader = shapefile.Reader(path)
+        for i, shape in enumerate(reader.shapes()):
+            expected = as_json(shape.__geo_interface__) if shape.points else None
+            self.assertEqual(as_json(store.geometry(i)), expected)
+        reader.close()
+        return store
+
+    def test_polygons(self):
+        """Test that holes and multi-part polygons are rebuilt like pyshp does."""
+        path = self.write('polygons', shapefile.POLYGON, [
+            [square(0, 0, 1)],
+            [square(0, 0, 4), square(1, 1, 1, clockwise=False)],
+            [square(0, 0, 4), square(1, 1, 1, clockwise=False), square(10, 10, 2)],
+            None,
+        ])
+        store = self.assert_matches_pyshp(path)
+        self.assertIsInstance(store.coords, np.memmap)
+        np.testing.assert_array_equal(store.query_bbox((0.5, 0.5, 0.6, 0.6)), [0, 1, 2])
+        np.testing.assert_array_equal(store.query_bbox((11, 11, 12, 12)), [2])
+
+    def test_built_in_blocks(self):
+        """Test that blocks flushed into the preallocated arrays line up across block boundaries."""
+        path = self.write('blocks', shapefile.POLYGON, [
+            [square(i, 0, 1)] if i % 3 else [square(i, 0, 1), square(i + 0.25, 0.25, 0.5, clockwise=False)]
+            for i in range(7)
+        ] + [None, [square(20, 20, 1)]])
+        with mock.patch('maps.geometry_store.BUILD_BLOCK_SIZE', 2):
+            store = self.assert_matches_pyshp(path)
+        self.assertEqual(store.part_offsets[-1], len(store.ring_offsets) - 1)
+        self.assertEqual(store.ring_offsets[-1], len(store.coords))
+
+    def test_lines_and_points(self):
+        """Test that line and point layers round-trip."""
+        lines = self.write('lines', shapefile.POLYLINE, [
+            [[(0, 0), (1, 1), (2, 0)]],
+            [[(0, 0), (1, 1)], [(5, 5), (6, 6)]],
+        ])
+        self.assert_matches_pyshp(lines)
+        points = self.write('points', shapefile.POINT, [(1.5, 2.5), (3.0, 4.0)])
+        store = self.assert_matches_pyshp(points)
+        np.testing.assert_array_equal(store.query_bbox((1, 2, 2, 3)), [0])
+
+    def test_simplified_geometry(self):
+        """Test that simplification drops vertices that are within tolerance."""
+        ring = [(0, 0)] + [(0, y / 100.0) for y in range(1, 100)] + [(0, 1), (1, 1), (1, 0), (0, 0)]
+        path = self.write('dense', shapefile.POLYGON, [[ring]])
+        build_geometry_store(path)
+        geometry = get_geometry_store(path).geometry(0, tolerance=0.01)
+        self.assertEqual(len(geometry['coordinates'][0]), 5)
+
+    def test_stale_store_is_ignored(self):
+        """Test that a store older than its shapefile is not used."""
+        path = self.write('stale', shapefile.POINT, [(1.0, 1.0)])
+        build_geometry_store(path)
+        mtime = os.path.getmtime(path)
+        os.utime(path, (mtime + 10, mtime + 10))
+        self.assertIsNone(get_geometry_store(path))
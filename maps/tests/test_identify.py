@@ -0,0 +1,65 @@
+import os
+import tempfile
+
+import numpy as np
+import shapefile
+from django.test import TestCase, Client
+
+from maps.identify import identify_features, points_in_rings
+from maps.models import MapLayer
+from maps.tests.fixtures import square, write_shapefile
+
+
+class IdentifyTest(TestCase):
+    """Test case for identifying the features at a clicked point."""
+
+    def setUp(self):
+        """Create a polygon layer, plus line and point shapefiles."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        donut = [square(-73.6, 45.4, 0.2), square(-73.55, 45.45, 0.05, clockwise=False)]
+        self.path = self.write('zones', shapefile.POLYGON, donut, ('donut', 'R1'))
+        self.line_path = self.write('roads', shapefile.POLYLINE, [[(-73.3, 45.4), (-73.3, 45.6)]], ('road', 'C1'))
+        self.point_path = self.write('wells', shapefile.POINT, (-73.2, 45.5), ('well', 'R2'))
+
+        self.layer = MapLayer.objects.create(name='Zones', layer_type='shapefile',
+                                             shapefile_dir=os.path.dirname(self.path))
+        self.client = Client()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, name, shape_type, geometry, values):
+        directory = os.path.join(self.temp_dir.name, name)
+        os.makedirs(directory)
+        return write_shapefile(os.path.join(directory, f"{name}.shp"), shape_type, [('NAME', 'C'), ('ZONE', 'C')],
+                               [(geometry, values)])
+
+    def names(self, path, lng, lat, zoom=12):
+        return [feature['properties']['NAME'] for feature in identify_features(path, lng, lat, zoom)]
+
+    def test_points_in_rings(self):
+        """Test the even-odd rule, with points in the hole outside."""
+        rings = [np.array(square(0, 0, 10)), np.array(square(4, 4, 2, clockwise=False))]
+        inside = points_in_rings([1, 5, 11, 9.9], [1, 5, 5, 0.1], rings)
+        self.assertEqual(inside.tolist(), [True, False, False, True])
+
+    def test_identify_features(self):
+        """Test containment, holes and the pixel tolerance around lines and points."""
+        self.assertEqual(self.names(self.path, -73.58, 45.42), ['donut'])
+        self.assertEqual(self.names(self.path, -73.52, 45.47), [])  # In the hole
+        # About 2 pixels away at zoom 12 (a pixel is ~27 m here), 5 pixels are allowed
+        self.assertEqual(self.names(self.line_path, -73.3 + 0.0007, 45.5), ['road'])
+        self.assertEqual(self.names(self.line_path, -73.3 + 0.0007, 45.5, zoom=16), [])
+        self.assertEqual(self.names(self.point_path, -73.2, 45.5004), ['well'])
+
+    def test_identify_endpoint(self):
+        """Test the API response and its parameter validation."""
+        response = self.client.get('/api/identify/', {'lat': 45.42, 'lng': -73.58, 'layers': self.layer.id,
+                                                      'fields': 'ZONE'})
+        self.assertEqual(response.status_code, 200)
+        layers = response.json()['layers']
+        self.assertEqual(layers[0]['id'], self.layer.id)
+        self.assertEqual(layers[0]['features'], [{'id': 0, 'properties': {'ZONE': 'R1'}, 'distance': 0.0}])
+
+        self.assertEqual(self.client.get('/api/identify/', {'lat': 45.42, 'lng': -73.58}).status_code, 400)
+        self.assertEqual(self.client.get('/api/identify/', {'lat': 'x', 'lng': -73.58, 'layers': 1}).status_code, 400)
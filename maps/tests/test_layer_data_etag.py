@@ -0,0 +1,61 @@
+import os
+import tempfile
+
+from django.test import TestCase, Client
+
+from maps.caching import layer_cache
+from maps.models import MapLayer
+from maps.tests.fixtures import write_points
+
+
+class LayerDataETagTest(TestCase):
+    """Test case for conditional layer data responses."""
+
+    def setUp(self):
+        """Create a shapefile layer with a few points."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        write_points(os.path.join(self.temp_dir.name, 'points.shp'), [f"point_{i}" for i in range(10)])
+
+        self.layer = MapLayer.objects.create(name='Points', layer_type='shapefile', shapefile_dir=self.temp_dir.name)
+        self.url = f"/api/layer/{self.layer.id}/data/?zoom=12&max_features=100"
+        self.client = Client()
+        layer_cache.memory.clear()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_not_modified(self):
+        """Test that a matching If-None-Match gets a 304 without a body."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def test_etag_follows_parameters_and_content(self):
+        """Test that other parameters or a changed layer get a new ETag."""
+        etag = self.client.get(self.url)['ETag']
+        self.assertNotEqual(self.client.get(self.url + '&simplify=none')['ETag'], etag)
+
+        self.layer.style = {'color': '#ff0000'}
+        self.layer.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_compressed_representation(self):
+        """Test that gzip responses carry their own tag that still revalidates."""
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].endswith('-gzip"'))
+
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # Only the suffixes of the compressed representations are accepted
+        other = response['ETag'].replace('-gzip"', '-stale"')
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=other)
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,120 @@
+import os
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
+from zipfile import ZipFile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, Client, override_settings
+from django.utils import timezone
+
+from maps.models import MapLayer
+from maps.processing import STAGES
+from maps.spatial_index import get_index_path
+from maps.tests.fixtures import write_points
+
+
+@override_settings(LAYER_PROCESSING_ASYNC=False)
+class LayerProcessingTest(TestCase):
+    """Test case for the background post-processing of shapefile uploads."""
+
+    def setUp(self):
+        self.media_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_dir.name,
+                                                   SHAPEFILES_DIR=os.path.join(self.media_dir.name, 'shapefiles'))
+        self.settings_override.enable()
+        patcher = mock.patch('maps.caching.FILE_CACHE_DIR', os.path.join(self.media_dir.name, 'cache'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = Client()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media_dir.cleanup()
+
+    def zipped_shapefile(self):
+        """Zip a shapefile of 20 points."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            write_points(os.path.join(temp_dir, 'wells.shp'), [f"well {i}" for i in range(20)])
+            buffer = BytesIO()
+            with ZipFile(buffer, 'w') as archive:
+                for extension in ('shp', 'shx', 'dbf'):
+                    archive.write(os.path.join(temp_dir, f'wells.{extension}'), f'wells.{extension}')
+        return SimpleUploadedFile('wells.zip', buffer.getvalue(), content_type='application/zip')
+
+    def test_processing_runs_after_commit(self):
+        """Test that saving only queues the layer, and the pipeline builds every stage."""
+        with self.captureOnCommitCallbacks() as callbacks:
+            layer = MapLayer.objects.create(name='Wells', layer_type='shapefile', file=self.zipped_shapefile())
+        layer.refresh_from_db()
+        self.assertEqual(layer.processing_status, 'pending')
+        self.assertIsNone(layer.shapefile_dir)
+
+        # Layer data isn't served until the processing is done
+        response = self.client.get(f'/api/layer/{layer.id}/data/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+
+        for callback in callbacks:
+            callback()
+        status = self.client.get(f'/api/layer/{layer.id}/status/').json()
+        self.assertEqual((status['status'], status['progress'], status['error']), ('ready', 100, None))
+        self.assertEqual([stage['name'] for stage in status['stages']], [name for name, _, _, _ in STAGES])
+        self.assertEqual({stage['status'] for stage in status['stages']}, {'done'})
+        self.assertEqual(status['stats']['feature_count'], 20)
+        self.assertEqual(status['stats']['fields'], ['NAME'])
+
+        layer.refresh_from_db()
+        self.assertTrue(os.path.exists(get_index_path(layer.get_shapefile_path())))
+        self.assertEqual(layer.source_hash, layer.compute_source_hash())
+        self.assertEqual(layer.get_content_version(), layer.derive_content_version())
+        self.assertEqual(len(self.client.get(f'/api/layer/{layer.id}/data/').json()['features']), 20)
+
+    def test_failed_extraction(self):
+        """Test that a failed required stage fails the layer and skips the rest."""
+        upload = SimpleUploadedFile('broken.zip', b'not a zip', content_type='application/zip')
+        with self.captureOnCommitCallbacks(execute=True):
+            layer = MapLayer.objects.create(name='Broken', layer_type='shapefile', file=upload)
+        layer.refresh_from_db()
+
+        self.assertEqual(layer.processing_status, 'failed')
+        self.assertIn('not a valid ZIP', layer.processing_error)
+        self.assertEqual([stage['status'] for stage in layer.processing_progress],
+                         ['failed'] + ['skipped'] * (len(STAGES) - 1))
+
+    def test_process_layers_command(self):
+        """Test that the command runs the layers left pending."""
+        with self.captureOnCommitCallbacks():
+            layer = MapLayer.objects.create(name='Wells', layer_type='shapefile', file=self.zipped_shapefile())
+
+        call_command('process_layers', unfinished=True, stdout=open(os.devnull, 'w'))
+        layer.refresh_from_db()
+        self.assertEqual(layer.processing_status, 'ready')
+        self.assertEqual(layer.stats['shape_type'], 'POINT')
+
+    def test_stale_processing_is_recovered(self):
+        """Test that a layer whose job stopped sending heartbeats is queued again, then failed."""
+        with self.captureOnCommitCallbacks():
+            layer = MapLayer.objects.create(name='Wells', layer_type='shapefile', file=self.zipped_shapefile())
+        MapLayer.objects.filter(pk=layer.pk).update(processing_status='processing',
+                                                    processing_heartbeat=timezone.now())
+        with mock.patch('maps.processing._start') as start:
+            # A recent heartbeat means the job is alive
+            self.assertEqual(self.client.get(f'/api/layer/{layer.id}/status/').json()['status'], 'processing')
+            start.assert_not_called()
+
+            MapLayer.objects.filter(pk=layer.pk).update(processing_heartbeat=timezone.now() - timedelta(hours=1))
+            self.assertEqual(self.client.get(f'/api/layer/{layer.id}/status/').json()['status'], 'pending')
+            start.assert_called_once_with(layer.pk)
+
+            # Stalling again fails the layer instead of looping
+            MapLayer.objects.filter(pk=layer.pk).update(processing_status='processing',
+                                                        processing_heartbeat=timezone.now() - timedelta(hours=1))
+            response = self.client.get(f'/api/layer/{layer.id}/data/')
+            self.assertNotEqual(response.status_code, 503)
+            self.assertEqual(start.call_count, 1)
+        layer.refresh_from_db()
+        self.assertEqual(layer.processing_status, 'failed')
+        self.assertIn('stopped responding', layer.processing_error)
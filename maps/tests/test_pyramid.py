@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+
+import shapefile
+from django.test import SimpleTestCase
+
+from maps.pyramid import (
+    ZOOM_BANDS, build_pyramid, get_pyramid_offsets_path, get_pyramid_path, get_zoom_band, iter_pyramid_geojson,
+)
+from maps.tests.fixtures import circle, write_shapefile
+
+
+class PyramidTest(SimpleTestCase):
+    """Test case for the per-zoom generalization pyramid."""
+
+    def setUp(self):
+        """Write a shapefile with a grid of finely sampled circles."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.shapefile_path = os.path.join(self.temp_dir.name, 'zones.shp')
+        write_shapefile(self.shapefile_path, shapefile.POLYGON, [('NAME', 'C')],
+                        [([circle(0.008, 200, -73.6 + i * 0.02, 45.5 + j * 0.02)], [f"zone_{i}_{j}"])
+                         for i in range(10) for j in range(10)])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_zoom_bands(self):
+        """Test that zoom levels map to the band at or above them."""
+        self.assertEqual([get_zoom_band(z) for z in (3, 8, 9, 12, 15, 16, 19)], [8, 8, 10, 12, 16, 16, 16])
+
+    def test_levels_get_coarser(self):
+        """Test that lower bands store fewer vertices."""
+        build_pyramid(self.shapefile_path)
+        vertex_counts = []
+        for band in ZOOM_BANDS:
+            data = json.loads(''.join(iter_pyramid_geojson(self.shapefile_path, band)))
+            self.assertEqual(len(data['features']), 100)
+            vertex_counts.append(sum(len(f['geometry']['coordinates'][0]) for f in data['features']))
+        self.assertEqual(vertex_counts, sorted(vertex_counts))
+        self.assertLess(vertex_counts[0], vertex_counts[-1])
+
+    def test_max_features_sampling(self):
+        """Test that max_features takes every n-th record like a live conversion."""
+        build_pyramid(self.shapefile_path)
+        data = json.loads(''.join(iter_pyramid_geojson(self.shapefile_path, 12, max_features=10, style={'color': 'red'})))
+        names = [f['properties']['NAME'] for f in data['features']]
+        self.assertEqual(names, [f"zone_{i}_0" for i in range(10)])
+        self.assertEqual(data['info']['included_features'], 10)
+        self.assertEqual(data['style'], {'color': 'red'})
+
+    def test_sampling_reads_only_kept_lines(self):
+        """Test that a sampled request seeks to the records it keeps instead of scanning the level."""
+        build_pyramid(self.shapefile_path)
+        path = get_pyramid_path(self.shapefile_path, 12)
+        with open(path, 'rb') as f:
+            lines = f.readlines()
+        # Overwrite the lines of the records the sampling skips, keeping every offset
+        with open(path, 'wb') as f:
+            f.write(lines[0])
+            for line in lines[1:]:
+                index = int(line.split(b'\t', 1)[0])
+                f.write(line if index % 10 == 0 else b'x' * (len(line) - 1) + b'\n')
+
+        data = json.loads(''.join(iter_pyramid_geojson(self.shapefile_path, 12, max_features=10)))
+        self.assertEqual([f['properties']['NAME'] for f in data['features']], [f"zone_{i}_0" for i in range(10)])
+
+    def test_missing_or_stale_level(self):
+        """Test that missing or outdated levels are not served."""
+        self.assertIsNone(iter_pyramid_geojson(self.shapefile_path, 12))
+        build_pyramid(self.shapefile_path)
+        mtime = os.path.getmtime(self.shapefile_path)
+        os.utime(self.shapefile_path, (mtime + 10, mtime + 10))
+        self.assertIsNone(iter_pyramid_geojson(self.shapefile_path, 12))
+        self.assertTrue(os.path.exists(get_pyramid_path(self.shapefile_path, 12)))
+
+        # Levels of an older format have no offsets
+        os.utime(self.shapefile_path, (mtime, mtime))
+        self.assertIsNotNone(iter_pyramid_geojson(self.shapefile_path, 12))
+        os.remove(get_pyramid_offsets_path(self.shapefile_path, 12))
+        self.assertIsNone(iter_pyramid_geojson(self.shapefile_path, 12))
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, Client
+
+from maps.caching import FILE_CACHE_EXPIRY, get_cache_key, get_file_cache_path, layer_cache
+from maps.models import MapLayer
+from maps.revalidation import revalidate
+from maps.single_flight import KeyLock
+from maps.tests.fixtures import write_points
+
+
+class RevalidateTest(SimpleTestCase):
+    """Test case for scheduling background rebuilds of expired entries."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch('maps.caching.FILE_CACHE_DIR', self.temp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_rebuilt_once(self):
+        """Test that an entry already being rebuilt isn't scheduled again."""
+        started, finish = threading.Event(), threading.Event()
+        rebuilds = []
+
+        def rebuild(value):
+            started.set()
+            finish.wait(10)
+            rebuilds.append(value)
+
+        future = revalidate('entry', rebuild, 'first')
+        self.assertTrue(started.wait(10))
+        self.assertIsNone(revalidate('entry', rebuild, 'second'))
+        finish.set()
+        self.assertTrue(future.result(10))
+        self.assertEqual(rebuilds, ['first'])
+
+        # Once done, a later expiry is rebuilt again
+        self.assertTrue(revalidate('entry', rebuild, 'third').result(10))
+        self.assertEqual(rebuilds, ['first', 'third'])
+
+    def test_skipped_while_converting(self):
+        """Test that an entry another request is converting, or has refreshed, isn't rebuilt."""
+        rebuild = mock.Mock()
+        with KeyLock('entry'):
+            self.assertFalse(revalidate('entry', rebuild).result(10))
+        layer_cache.set('entry', 'fresh', compress=False)
+        self.assertFalse(revalidate('entry', rebuild).result(10))
+        rebuild.assert_not_called()
+
+
+class StaleWhileRevalidateTest(TestCase):
+    """Test case for serving expired layer data while it is rebuilt."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        write_points(os.path.join(self.temp_dir.name, 'wells.shp'), [f"well {i}" for i in range(50)])
+        self.layer = MapLayer.objects.create(name='Wells', layer_type='shapefile', shapefile_dir=self.temp_dir.name)
+        self.cache_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch('maps.caching.FILE_CACHE_DIR', self.cache_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(layer_cache.memory.clear)
+        self.client = Client()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+        self.temp_dir.cleanup()
+
+    def get_data(self):
+        response = self.client.get(f'/api/layer/{self.layer.id}/data/',
+                                   {'simplify': '0.01', 'max_features': '5000', 'zoom': '9'})
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response['X-Cache'], body
+
+    def test_expired_entry_served_then_rebuilt(self):
+        """Test that an expired entry is served at once and refreshed in the background."""
+        status, body = self.get_data()
+        self.assertEqual(status, 'MISS')
+
+        # Expire the entry in every tier
+        layer_cache.memory.clear()
+        cache_file = get_file_cache_path(get_cache_key(self.layer.id, self.layer.get_content_version(), '0.01', 5000,
+                                                       '9'))
+        expired = time.time() - FILE_CACHE_EXPIRY - 60
+        for suffix in ('', '.gz', '.br'):
+            if os.path.exists(cache_file + suffix):
+                os.utime(cache_file + suffix, (expired, expired))
+
+        futures = []
+        with mock.patch('maps.views.revalidate', side_effect=lambda *args: futures.append(revalidate(*args))):
+            self.assertEqual(self.get_data(), ('STALE', body))
+        self.assertEqual(len(futures), 1)
+        self.assertTrue(futures[0].result(30))
+
+        self.assertGreater(os.path.getmtime(cache_file), expired)
+        self.assertEqual(self.get_data(), ('FILE-HIT', body))
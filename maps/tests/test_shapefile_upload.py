@@ -3,7 +3,7 @@ import tempfile
 from io import BytesIO
 from zipfile import ZipFile
 
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth.models import User
 from django.urls import reverse
@@ -11,6 +11,7 @@ from django.urls import reverse
 from maps.models import MapLayer, Region
 
 
+@override_settings(LAYER_PROCESSING_ASYNC=False)
 class ShapefileUploadTest(TestCase):
     """Test case for shapefile upload functionality."""
     
@@ -76,12 +77,13 @@ class ShapefileUploadTest(TestCase):
         # Add the file to the request
         post_data['file'] = self.temp_shapefile
         
-        # Make the request
-        response = self.client.post(
-            reverse('add_map_layer'),
-            post_data,
-            follow=True
-        )
+        # Make the request, running the processing queued on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('add_map_layer'),
+                post_data,
+                follow=True
+            )
         
         # Check that the layer was created
         self.assertEqual(MapLayer.objects.count(), initial_count + 1)
@@ -0,0 +1,73 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from maps.simplification import (
+    douglas_peucker_mask, resolve_tolerance, simplify_geometry, tolerance_for_zoom, visvalingam_mask,
+    zoom_for_extent,
+)
+from maps.tests.fixtures import circle
+
+
+class SimplificationTest(SimpleTestCase):
+    """Test case for the tolerance-based simplification engine."""
+
+    def test_douglas_peucker_keeps_corners(self):
+        """Test that collinear vertices are dropped and corners kept."""
+        points = np.array([(0, 0), (1, 0.001), (2, 0), (3, 0), (3, 1), (3, 2)], dtype=float)
+        keep = douglas_peucker_mask(points, 0.01)
+        self.assertEqual(points[keep].tolist(), [[0, 0], [3, 0], [3, 2]])
+
+    def test_visvalingam_keeps_corners(self):
+        """Test that small triangles are removed first."""
+        points = np.array([(0, 0), (1, 0.001), (2, 0), (3, 0), (3, 1), (3, 2)], dtype=float)
+        keep = visvalingam_mask(points, 0.1)
+        self.assertEqual(points[keep].tolist(), [[0, 0], [3, 0], [3, 2]])
+
+    def test_polygon_holes_are_simplified(self):
+        """Test that exterior rings and holes are all simplified."""
+        geometry = {
+            'type': 'Polygon',
+            'coordinates': [circle(1.0, 1000), list(reversed(circle(0.5, 1000)))],
+        }
+        simplified = simplify_geometry(geometry, 0.01)
+        self.assertEqual(len(simplified['coordinates']), 2)
+        for ring in simplified['coordinates']:
+            self.assertLess(len(ring), 100)
+            self.assertEqual(ring[0], ring[-1])
+
+    def test_collapsed_parts(self):
+        """Test that tiny holes are dropped while small exteriors stay visible."""
+        geometry = {
+            'type': 'MultiPolygon',
+            'coordinates': [
+                [circle(1.0, 200), list(reversed(circle(0.001, 50)))],
+                [circle(0.001, 50, cx=5)],
+            ],
+        }
+        simplified = simplify_geometry(geometry, 0.01)
+        self.assertEqual(len(simplified['coordinates']), 2)
+        self.assertEqual(len(simplified['coordinates'][0]), 1)
+        self.assertEqual(len(simplified['coordinates'][1][0]), 4)
+
+    def test_tolerance_shrinks_with_zoom(self):
+        """Test that each zoom level halves the tolerance."""
+        self.assertAlmostEqual(tolerance_for_zoom(10, 45) / tolerance_for_zoom(11, 45), 2.0)
+        self.assertGreater(tolerance_for_zoom(10, 0), tolerance_for_zoom(10, 60))
+
+    def test_auto_tolerance_from_extent(self):
+        """Test that 'auto' without a zoom level uses the zoom fitting the layer's extent."""
+        city, province = (-73.9, 45.4, -73.4, 45.7), (-79.8, 45.0, -57.1, 62.6)
+        self.assertEqual(zoom_for_extent(city), 11)
+        self.assertEqual(zoom_for_extent(province), 5)
+        self.assertEqual(resolve_tolerance('auto', 200000, latitude=45.55, extent=city), tolerance_for_zoom(11, 45.55))
+        self.assertGreater(resolve_tolerance('auto', 200000, latitude=53.8, extent=province),
+                           resolve_tolerance('auto', 200000, latitude=45.55, extent=city))
+        # Small layers stay unsimplified, and a zoom level or an explicit tolerance takes precedence
+        self.assertIsNone(resolve_tolerance('auto', 5000, latitude=45.55, extent=city))
+        self.assertEqual(resolve_tolerance('auto', 200000, 14, 45.55, city), tolerance_for_zoom(14, 45.55))
+        self.assertEqual(resolve_tolerance('0.002', 200000, latitude=45.55, extent=city), 0.002)
+
+    def test_points_untouched(self):
+        """Test that point geometries pass through unchanged."""
+        geometry = {'type': 'Point', 'coordinates': (1.0, 2.0)}
+        self.assertIs(simplify_geometry(geometry, 1.0), geometry)
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from maps.single_flight import KeyLock, ReleasingIterator
+
+
+def convert_once(directory, key):
+    """Convert an entry unless a concurrent caller did, recording each conversion."""
+    result_path = os.path.join(directory, f"{key}.result")
+    with KeyLock(key) as flight:
+        if flight.waited and os.path.exists(result_path):
+            return 'coalesced'
+        time.sleep(0.3)  # The conversion
+        with open(os.path.join(directory, 'conversions'), 'a') as f:
+            f.write(f"{os.getpid()}\n")
+        with open(result_path, 'w') as f:
+            f.write('done')
+    return 'converted'
+
+
+class SingleFlightTest(SimpleTestCase):
+    """Test case for coalescing concurrent conversions of one cache key."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch('maps.caching.FILE_CACHE_DIR', self.temp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def is_free(self, key):
+        lock = KeyLock(key)
+        try:
+            return lock.acquire(timeout=0)
+        finally:
+            lock.release()
+
+    def conversions(self):
+        with open(os.path.join(self.temp_dir.name, 'conversions')) as f:
+            return f.read().split()
+
+    def test_threads_coalesce(self):
+        """Test that concurrent requests of a process convert once."""
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(convert_once(self.temp_dir.name, 'layer')))
+                   for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), ['coalesced'] * 5 + ['converted'])
+        self.assertEqual(len(self.conversions()), 1)
+
+    def test_processes_coalesce(self):
+        """Test that concurrent requests of several processes convert once, through the lock file."""
+        with ProcessPoolExecutor(max_workers=3) as pool:
+            results = list(pool.map(convert_once, [self.temp_dir.name] * 3, ['layer'] * 3))
+        self.assertEqual(sorted(results), ['coalesced'] * 2 + ['converted'])
+        self.assertEqual(len(self.conversions()), 1)
+
+    def test_wait_timeout(self):
+        """Test that waiting gives up after the timeout, and other keys don't wait."""
+        holder = KeyLock('layer')
+        self.assertTrue(holder.acquire())
+        try:
+            waiter = KeyLock('layer')
+            self.assertFalse(waiter.acquire(timeout=0.1))
+            self.assertTrue(waiter.waited)
+            other = KeyLock('other layer')
+            self.assertTrue(other.acquire(timeout=0))
+            other.release()
+        finally:
+            holder.release()
+        self.assertTrue(waiter.acquire(timeout=0))
+        waiter.release()
+
+    def test_stream_releases_lock(self):
+        """Test that a streamed conversion holds the lock until the stream ends or is closed unread."""
+        flight = KeyLock('layer')
+        flight.acquire()
+        stream = ReleasingIterator(iter(['a', 'b']), flight)
+        self.assertEqual(next(stream), 'a')
+        self.assertFalse(self.is_free('layer'))
+        self.assertEqual(list(stream), ['b'])
+        self.assertTrue(self.is_free('layer'))
+
+        flight = KeyLock('unread')
+        flight.acquire()
+        ReleasingIterator(iter(['a']), flight).close()
+        self.assertTrue(self.is_free('unread'))
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import threading
+
+import numpy as np
+import shapefile
+from django.test import SimpleTestCase
+
+from maps.spatial_index import (
+    PackedRTree, build_spatial_index, get_index_path, get_spatial_index, read_shape_bboxes,
+)
+from maps.tests.fixtures import square, write_shapefile
+
+
+class SpatialIndexTest(SimpleTestCase):
+    """Test case for the packed R-tree spatial index."""
+
+    def setUp(self):
+        """Write a shapefile with a grid of polygons and a null shape."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.shapefile_path = os.path.join(self.temp_dir.name, 'parcels.shp')
+
+        features = [([square(i * 0.01, j * 0.01, 0.01)], [f"parcel_{i}_{j}"]) for i in range(30) for j in range(30)]
+        write_shapefile(self.shapefile_path, shapefile.POLYGON, [('NAME', 'C')], features + [(None, ['empty'])])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_read_shape_bboxes(self):
+        """Test that record header bboxes match the ones parsed by pyshp."""
+        ids, boxes = read_shape_bboxes(self.shapefile_path)
+        reader = shapefile.Reader(self.shapefile_path)
+        expected = np.array([shape.bbox for shape in reader.shapes()[:900]])
+        reader.close()
+
+        # The trailing null shape is not indexed
+        self.assertEqual(list(ids), list(range(900)))
+        np.testing.assert_allclose(boxes, expected)
+
+    def test_query_matches_brute_force(self):
+        """Test that tree queries return exactly the overlapping boxes."""
+        rng = np.random.default_rng(42)
+        corners = rng.random((5000, 2)) * 100
+        boxes = np.hstack([corners, corners + rng.random((5000, 2))])
+        tree = PackedRTree.build(np.arange(5000), boxes)
+
+        for _ in range(20):
+            x, y = rng.random(2) * 100
+            bbox = (x, y, x + 5, y + 3)
+            expected = np.nonzero(
+                (boxes[:, 0] <= bbox[2]) & (boxes[:, 2] >= bbox[0]) &
+                (boxes[:, 1] <= bbox[3]) & (boxes[:, 3] >= bbox[1])
+            )[0]
+            np.testing.assert_array_equal(tree.query(bbox), expected)
+
+    def test_sidecar_round_trip(self):
+        """Test that the saved sidecar loads back and answers queries."""
+        build_spatial_index(self.shapefile_path)
+        self.assertTrue(os.path.exists(get_index_path(self.shapefile_path)))
+
+        tree = get_spatial_index(self.shapefile_path, build_if_missing=False)
+        self.assertEqual(len(tree), 900)
+        np.testing.assert_allclose(tree.bbox, (0, 0, 0.3, 0.3))
+        self.assertEqual(len(tree.query((0.105, 0.105, 0.115, 0.115))), 4)
+        self.assertEqual(len(tree.query((5, 5, 6, 6))), 0)
+
+    def test_concurrent_saves(self):
+        """Test that saves racing for the same sidecar each write their own temporary file."""
+        index_path = get_index_path(self.shapefile_path)
+        # A save in progress elsewhere is left alone
+        with open(index_path + '.tmp', 'wb') as f:
+            f.write(b'partial')
+        tree = PackedRTree.build(*read_shape_bboxes(self.shapefile_path))
+        errors = []
+
+        def save():
+            try:
+                tree.save(index_path)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=save) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(PackedRTree.load(index_path)), 900)
+        with open(index_path + '.tmp', 'rb') as f:
+            self.assertEqual(f.read(), b'partial')
+        self.assertEqual([name for name in os.listdir(self.temp_dir.name) if name.endswith('.tmp')],
+                         ['parcels.rtree.npz.tmp'])
@@ -0,0 +1,60 @@
+import os
+import tempfile
+
+import numpy as np
+import shapefile
+from django.core.management import call_command
+from django.test import TestCase
+
+from maps import spatial_join
+from maps.models import MapLayer, Property, PropertyLayerFeature, Region
+from maps.spatial_join import NO_FEATURE, join_points_to_polygons
+from maps.tests.fixtures import square, write_shapefile
+
+
+class SpatialJoinTest(TestCase):
+    """Test case for joining properties to the polygons of a layer."""
+
+    def setUp(self):
+        """Create a 4x4 grid of zones, the first one with a hole."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'zones.shp')
+        zones = [([square(col, row, 1)], [f"Z{row}{col}"]) for row in range(4) for col in range(4)]
+        zones[0][0].append(square(0.25, 0.25, 0.5, clockwise=False))
+        write_shapefile(self.path, shapefile.POLYGON, [('ZONE', 'C')], zones)
+        self.layer = MapLayer.objects.create(name='Zones', layer_type='shapefile', shapefile_dir=self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_join_points_to_polygons(self):
+        """Test the record numbers found for points, in blocks and across processes."""
+        rng = np.random.default_rng(0)
+        xs, ys = rng.uniform(-0.5, 4.5, 2000), rng.uniform(-0.5, 4.5, 2000)
+        expected = np.where((xs >= 0) & (xs < 4) & (ys >= 0) & (ys < 4),
+                            np.floor(ys) * 4 + np.floor(xs), NO_FEATURE).astype(np.int64)
+        expected[(xs > 0.25) & (xs < 0.75) & (ys > 0.25) & (ys < 0.75)] = NO_FEATURE  # The hole
+
+        original_block_size = spatial_join.JOIN_BLOCK_SIZE
+        spatial_join.JOIN_BLOCK_SIZE = 300
+        try:
+            self.assertEqual(join_points_to_polygons(self.path, xs, ys, workers=1).tolist(), expected.tolist())
+            self.assertEqual(join_points_to_polygons(self.path, xs, ys, workers=2).tolist(), expected.tolist())
+        finally:
+            spatial_join.JOIN_BLOCK_SIZE = original_block_size
+
+    def test_join_properties_command(self):
+        """Test that the join table is rebuilt with the polygon attributes."""
+        region = Region.objects.create(name='Test', center_latitude=2, center_longitude=2)
+        inside = Property.objects.create(lot_number='1', region=region, longitude=2.5, latitude=1.5)
+        in_hole = Property.objects.create(lot_number='2', region=region, longitude=0.5, latitude=0.5)
+        Property.objects.create(lot_number='3', region=region)
+
+        call_command('join_properties', self.layer.id, workers=1, stdout=open(os.devnull, 'w'))
+        call_command('join_properties', self.layer.id, workers=1, stdout=open(os.devnull, 'w'))
+
+        memberships = PropertyLayerFeature.objects.filter(layer=self.layer)
+        self.assertEqual(memberships.count(), 1)
+        membership = inside.layer_features.get(layer=self.layer)
+        self.assertEqual((membership.feature_id, membership.properties), (6, {'ZONE': 'Z12'}))
+        self.assertFalse(in_hole.layer_features.exists())
@@ -0,0 +1,73 @@
+import json
+
+from django.test import SimpleTestCase
+
+from maps.topojson import geojson_to_topojson, geojson_to_topology
+from maps.tests.fixtures import square
+
+
+def decode_ring(topology, arc_ids):
+    """Rebuild absolute grid positions of a ring from its arc references."""
+    arcs = []
+    for arc in topology['arcs']:
+        x = y = 0
+        points = []
+        for dx, dy in arc:
+            x, y = x + dx, y + dy
+            points.append((x, y))
+        arcs.append(points)
+
+    ring = []
+    for arc_id in arc_ids:
+        points = arcs[arc_id] if arc_id >= 0 else arcs[~arc_id][::-1]
+        ring.extend(points if not ring else points[1:])
+    return ring
+
+
+class TopoJSONTest(SimpleTestCase):
+    """Test case for TopoJSON encoding with shared arcs."""
+
+    def setUp(self):
+        self.collection = {
+            'type': 'FeatureCollection',
+            'features': [
+                {'type': 'Feature', 'id': i * 10 + j, 'properties': {'NAME': f"{i}_{j}"},
+                 'geometry': {'type': 'Polygon', 'coordinates': [square(i, j, 1)]}}
+                for i in range(10) for j in range(10)
+            ],
+            'info': {'total_features': 100},
+        }
+
+    def test_shared_borders_are_stored_once(self):
+        """Test that every grid edge becomes exactly one arc."""
+        topology = geojson_to_topology(self.collection, quantization=1001)
+        # 10 x 10 cells have 2 * 10 * 11 distinct edges; at each outer corner
+        # the two edges are not a junction and form a single arc
+        self.assertEqual(len(topology['arcs']), 216)
+        self.assertEqual(topology['info'], {'total_features': 100})
+
+    def test_rings_round_trip(self):
+        """Test that decoding the arcs gives back every ring."""
+        topology = geojson_to_topology(self.collection, quantization=1001)
+        geometries = topology['objects']['features']['geometries']
+        for feature, geometry in zip(self.collection['features'], geometries):
+            self.assertEqual(geometry['id'], feature['id'])
+            self.assertEqual(geometry['properties'], feature['properties'])
+            ring = decode_ring(topology, geometry['arcs'][0])
+            self.assertEqual(ring[0], ring[-1])
+            # Same grid positions as the source ring, possibly starting elsewhere
+            expected = {(x * 100, y * 100) for x, y in feature['geometry']['coordinates'][0]}
+            self.assertEqual(set(ring), expected)
+            self.assertEqual(len(ring), 5)
+
+    def test_points_and_lines(self):
+        """Test that points keep absolute positions and lines reference arcs."""
+        collection = {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {}, 'geometry': {'type': 'Point', 'coordinates': [0, 0]}},
+            {'type': 'Feature', 'properties': {}, 'geometry': {'type': 'LineString', 'coordinates': [[0, 0], [10, 10]]}},
+        ]}
+        topology = json.loads(geojson_to_topojson(json.dumps(collection), 'layer_1', quantization=1001))
+        point, line = topology['objects']['layer_1']['geometries']
+        self.assertEqual(point['coordinates'], [0, 0])
+        self.assertEqual(line['arcs'], [0])
+        self.assertEqual(topology['arcs'], [[[0, 0], [1000, 1000]]])
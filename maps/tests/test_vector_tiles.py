@@ -0,0 +1,95 @@
+import os
+import tempfile
+
+import shapefile
+from django.test import SimpleTestCase
+
+from maps.vector_tiles import (
+    GEOM_POLYGON, build_tile, clip_ring, encode_geometry, is_valid_tile,
+    lonlat_to_tile_pixel, shape_to_tile_geometry, tile_bbox, tile_pixel_to_lonlat,
+)
+from maps.simplification import tolerance_for_zoom
+from maps.tests.fixtures import square, write_shapefile
+
+
+class VectorTileTest(SimpleTestCase):
+    """Test case for Mapbox Vector Tile generation."""
+
+    def setUp(self):
+        """Write a small grid of square parcels to a temporary shapefile."""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.shapefile_path = os.path.join(self.temp_dir.name, 'parcels')
+
+        write_shapefile(self.shapefile_path, shapefile.POLYGON, [('NAME', 'C')],
+                        [([square(-73.6 + i * 0.01, 45.5 + j * 0.01, 0.01)], [f"parcel_{i}_{j}"])
+                         for i in range(5) for j in range(5)])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_tile_coordinate_round_trip(self):
+        """Test that projecting to tile units and back is lossless."""
+        px, py = lonlat_to_tile_pixel(-73.55, 45.52, 14, 4844, 5860)
+        lon, lat = tile_pixel_to_lonlat(px, py, 14, 4844, 5860)
+        self.assertAlmostEqual(lon, -73.55)
+        self.assertAlmostEqual(lat, 45.52)
+
+    def test_is_valid_tile(self):
+        """Test tile coordinate validation."""
+        self.assertTrue(is_valid_tile(0, 0, 0))
+        self.assertTrue(is_valid_tile(3, 7, 7))
+        self.assertFalse(is_valid_tile(3, 8, 0))
+        self.assertFalse(is_valid_tile(-1, 0, 0))
+
+    def test_clip_ring(self):
+        """Test that rings are clipped to the tile rectangle."""
+        ring = [(-10, -10), (-10, 10), (10, 10), (10, -10), (-10, -10)]
+        clipped = clip_ring(ring, 0, 0, 20, 20)
+        self.assertEqual(clipped[0], clipped[-1])
+        self.assertEqual(set(clipped), {(0, 0), (0, 10), (10, 10), (10, 0)})
+
+    def test_encode_polygon_geometry(self):
+        """Test polygon encoding against the example from the MVT specification."""
+        commands = encode_geometry(GEOM_POLYGON, [[(3, 6), (8, 12), (20, 34), (3, 6)]])
+        self.assertEqual(commands, [9, 6, 12, 18, 10, 12, 24, 44, 15])
+
+    def test_build_tile(self):
+        """Test that tiles contain the parcels they cover and nothing else."""
+        z, x, y = 14, 4844, 5860
+        west, south, east, north = tile_bbox(z, x, y)
+        self.assertLess(west, -73.55)
+        self.assertGreater(east, -73.55)
+
+        tile = build_tile(self.shapefile_path + '.shp', z, x, y, layer_name='parcels')
+        self.assertTrue(tile)
+        self.assertIn(b'parcels', tile)
+        self.assertIn(b'parcel_', tile)
+
+        # A tile on the other side of the world is empty
+        self.assertEqual(build_tile(self.shapefile_path + '.shp', z, 0, 0), b'')
+
+    def test_small_features_dropped_at_low_zoom(self):
+        """Test that parcels smaller than a pixel are left out and the feature cap samples the rest."""
+        path = self.shapefile_path + '.shp'
+        # The 0.01 degree parcels are under a pixel wide at zoom 6, and several pixels at zoom 9
+        self.assertEqual(build_tile(path, 6, 18, 22), b'')
+        tile = build_tile(path, 9, 151, 183)
+        self.assertEqual(tile.count(b'parcel_'), 25)
+        tile = build_tile(path, 9, 151, 183, max_features=5)
+        self.assertEqual(tile.count(b'parcel_'), 5)
+
+    def test_simplified_per_zoom(self):
+        """Test that detail smaller than a pixel is simplified away before quantizing."""
+        # A parcel whose left edge zigzags by a fifth of a pixel at zoom 12
+        ring = [(-73.6 + (k % 2) * 0.00005, 45.5 + k * 0.0001) for k in range(101)]
+        ring += [(-73.59, 45.51), (-73.59, 45.5), (-73.6, 45.5)]
+        path = write_shapefile(os.path.join(self.temp_dir.name, 'dense.shp'), shapefile.POLYGON, [('NAME', 'C')],
+                               [([ring], ['dense'])])
+        with shapefile.Reader(path) as reader:
+            shape = reader.shape(0)
+
+        z, x, y = 12, 1210, 1465
+        _, full = shape_to_tile_geometry(shape, z, x, y)
+        _, simplified = shape_to_tile_geometry(shape, z, x, y, tolerance=tolerance_for_zoom(z, 45.5))
+        self.assertGreater(len(full[0]), 50)
+        self.assertEqual(len(simplified[0]), 5)
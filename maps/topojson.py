@@ -0,0 +1,273 @@
+"""
+TopoJSON encoding of GeoJSON feature collections.
+
+Coordinates are quantized to an integer grid, lines and rings are cut at the
+junctions where neighbouring geometries meet, and every arc is stored once:
+adjacent parcels reference the shared border instead of repeating it. Arcs are
+delta-encoded, so most positions become small integers.
+"""
+
+import json
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Encoding configuration
+DEFAULT_QUANTIZATION = 100000  # Grid positions along each axis of the data extent
+MIN_QUANTIZATION = 1000
+MAX_QUANTIZATION = 10000000
+TOPOJSON_CONTENT_TYPE = 'application/json'
+
+
+class _Quantizer:
+    """Maps coordinates onto an integer grid covering the data extent."""
+
+    def __init__(self, bbox, quantization):
+        x_min, y_min, x_max, y_max = bbox
+        self.translate = (x_min, y_min)
+        self.scale = (
+            (x_max - x_min) / (quantization - 1) if x_max > x_min else 1.0,
+            (y_max - y_min) / (quantization - 1) if y_max > y_min else 1.0,
+        )
+
+    def point(self, position):
+        return (int(round((position[0] - self.translate[0]) / self.scale[0])),
+                int(round((position[1] - self.translate[1]) / self.scale[1])))
+
+    def line(self, positions):
+        """Quantize a line, dropping consecutive positions that fall on the same cell."""
+        result = []
+        for position in positions:
+            point = self.point(position)
+            if not result or point != result[-1]:
+                result.append(point)
+        return result
+
+
+def _geometry_bbox(geometries):
+    x_min = y_min = float('inf')
+    x_max = y_max = float('-inf')
+
+    def visit(coordinates):
+        nonlocal x_min, y_min, x_max, y_max
+        if coordinates and isinstance(coordinates[0], (int, float)):
+            x, y = coordinates[0], coordinates[1]
+            x_min, y_min = min(x_min, x), min(y_min, y)
+            x_max, y_max = max(x_max, x), max(y_max, y)
+        else:
+            for child in coordinates:
+                visit(child)
+
+    for geometry in geometries:
+        if geometry:
+            visit(geometry.get('coordinates') or [])
+    if x_min > x_max:
+        return (0.0, 0.0, 0.0, 0.0)
+    return (x_min, y_min, x_max, y_max)
+
+
+def _find_junctions(lines, rings):
+    """
+    Find the points where arcs must be cut
+
+    A point is a junction when it is reached with different neighbours by
+    different lines or rings, i.e. where shared borders start or end. Line
+    endpoints are always junctions.
+    """
+    neighbours = {}
+    junctions = set()
+
+    def visit(point, previous, following):
+        pair = (previous, following)
+        seen = neighbours.get(point)
+        if seen is None:
+            neighbours[point] = pair
+        elif seen != pair and seen != (following, previous):
+            junctions.add(point)
+
+    for line in lines:
+        junctions.add(line[0])
+        junctions.add(line[-1])
+        for k in range(1, len(line) - 1):
+            visit(line[k], line[k - 1], line[k + 1])
+
+    for ring in rings:
+        count = len(ring) - 1  # The closing point repeats the first
+        for k in range(count):
+            visit(ring[k], ring[k - 1], ring[k + 1])
+
+    return junctions
+
+
+class _ArcBuilder:
+    """Cuts lines and rings at junctions and stores each distinct arc once."""
+
+    def __init__(self, junctions):
+        self.junctions = junctions
+        self.arcs = []
+        self.index = {}
+
+    def add_arc(self, points):
+        key = tuple(points)
+        if key in self.index:
+            return self.index[key]
+        reverse_key = key[::-1]
+        if reverse_key in self.index:
+            return ~self.index[reverse_key]
+        self.index[key] = len(self.arcs)
+        self.arcs.append(points)
+        return self.index[key]
+
+    def cut(self, points):
+        arcs = []
+        start = 0
+        for k in range(1, len(points) - 1):
+            if points[k] in self.junctions:
+                arcs.append(self.add_arc(points[start:k + 1]))
+                start = k
+        arcs.append(self.add_arc(points[start:]))
+        return arcs
+
+    def line(self, points):
+        return self.cut(points)
+
+    def ring(self, points):
+        body = points[:-1]
+        cut_at = [k for k, point in enumerate(body) if point in self.junctions]
+        if cut_at:
+            # Start the ring at a junction so arcs end where neighbours meet
+            start = cut_at[0]
+        else:
+            # Rings without junctions start at their smallest point, so a ring
+            # matches an equal ring in either direction
+            start = min(range(len(body)), key=body.__getitem__)
+        rotated = body[start:] + body[:start] + [body[start]]
+        return self.cut(rotated)
+
+
+def _delta_encode(arc):
+    encoded = [list(arc[0])]
+    for k in range(1, len(arc)):
+        encoded.append([arc[k][0] - arc[k - 1][0], arc[k][1] - arc[k - 1][1]])
+    return encoded
+
+
+def _quantized_parts(geometry, quantizer):
+    """Quantize a geometry into ('line', points)/('ring', points) parts per polygon."""
+    geom_type = geometry.get('type')
+    coordinates = geometry.get('coordinates')
+
+    def rings_of(polygon):
+        rings = []
+        for ring in polygon:
+            points = quantizer.line(ring)
+            if points and points[0] != points[-1]:
+                points.append(points[0])
+            # A ring needs three distinct positions once quantized
+            if len(points) >= 4:
+                rings.append(points)
+            elif not rings:
+                return None  # The exterior collapsed
+        return rings
+
+    if geom_type == 'LineString':
+        line = quantizer.line(coordinates)
+        return [line] if len(line) >= 2 else []
+    if geom_type == 'MultiLineString':
+        return [line for line in (quantizer.line(part) for part in coordinates) if len(line) >= 2]
+    if geom_type == 'Polygon':
+        rings = rings_of(coordinates)
+        return [rings] if rings else []
+    if geom_type == 'MultiPolygon':
+        return [rings for rings in (rings_of(polygon) for polygon in coordinates) if rings]
+    return None
+
+
+def geojson_to_topology(feature_collection, object_name='features', quantization=DEFAULT_QUANTIZATION):
+    """
+    Encode a GeoJSON FeatureCollection as a TopoJSON topology
+
+    Args:
+        feature_collection: GeoJSON FeatureCollection dict
+        object_name: Name of the GeometryCollection in the topology's objects
+        quantization: Number of grid positions along each axis
+
+    Returns:
+        dict: TopoJSON Topology with quantized, delta-encoded arcs. The
+              collection's "style" and "info" members are carried over.
+    """
+    features = feature_collection.get('features', [])
+    quantization = max(MIN_QUANTIZATION, min(MAX_QUANTIZATION, int(quantization)))
+    bbox = _geometry_bbox([feature.get('geometry') for feature in features])
+    quantizer = _Quantizer(bbox, quantization)
+
+    # First pass: quantize every geometry
+    quantized = []
+    lines, rings = [], []
+    for feature in features:
+        geometry = feature.get('geometry')
+        parts = _quantized_parts(geometry, quantizer) if geometry else None
+        quantized.append(parts)
+        if not parts:
+            continue
+        if geometry['type'] in ('LineString', 'MultiLineString'):
+            lines.extend(parts)
+        else:
+            for polygon in parts:
+                rings.extend(polygon)
+
+    # Second pass: cut at junctions and deduplicate the arcs
+    builder = _ArcBuilder(_find_junctions(lines, rings))
+    geometries = []
+    for feature, parts in zip(features, quantized):
+        geometry = feature.get('geometry')
+        geom_type = geometry.get('type') if geometry else None
+        output = {}
+
+        if geom_type == 'Point':
+            output = {'type': 'Point', 'coordinates': list(quantizer.point(geometry['coordinates']))}
+        elif geom_type == 'MultiPoint':
+            output = {'type': 'MultiPoint',
+                      'coordinates': [list(quantizer.point(p)) for p in geometry['coordinates']]}
+        elif parts and geom_type in ('LineString', 'MultiLineString'):
+            arcs = [builder.line(line) for line in parts]
+            output = ({'type': 'LineString', 'arcs': arcs[0]} if len(arcs) == 1
+                      else {'type': 'MultiLineString', 'arcs': arcs})
+        elif parts and geom_type in ('Polygon', 'MultiPolygon'):
+            arcs = [[builder.ring(ring) for ring in polygon] for polygon in parts]
+            output = ({'type': 'Polygon', 'arcs': arcs[0]} if len(arcs) == 1
+                      else {'type': 'MultiPolygon', 'arcs': arcs})
+        else:
+            output = {'type': None}
+
+        if 'id' in feature:
+            output['id'] = feature['id']
+        if feature.get('properties'):
+            output['properties'] = feature['properties']
+        geometries.append(output)
+
+    topology = {
+        'type': 'Topology',
+        'transform': {'scale': list(quantizer.scale), 'translate': list(quantizer.translate)},
+        'bbox': list(bbox),
+        'objects': {object_name: {'type': 'GeometryCollection', 'geometries': geometries}},
+        'arcs': [_delta_encode(arc) for arc in builder.arcs],
+    }
+    for member in ('style', 'info'):
+        if member in feature_collection:
+            topology[member] = feature_collection[member]
+
+    logger.info(f"Encoded {len(features)} features as TopoJSON with {len(builder.arcs)} arcs")
+    return topology
+
+
+def geojson_to_topojson(geojson_data, object_name='features', quantization=DEFAULT_QUANTIZATION):
+    """
+    Convert a GeoJSON string to a compact TopoJSON string
+
+    Returns:
+        str: TopoJSON text
+    """
+    topology = geojson_to_topology(json.loads(geojson_data), object_name, quantization)
+    return json.dumps(topology, separators=(',', ':'))
@@ -133,4 +133,7 @@ urlpatterns = [
     path('api/region/<int:region_id>/properties/', views.region_properties, name='region_properties'),
     path('api/layers/', views.map_layers_list, name='map_layers_list'),
     path('api/layer/<int:layer_id>/data/', views.map_layer_data, name='map_layer_data'),
+    path('api/layer/<int:layer_id>/status/', views.map_layer_status, name='map_layer_status'),
+    path('api/layer/<int:layer_id>/tiles/<int:z>/<int:x>/<int:y>.pbf', views.map_layer_tile, name='map_layer_tile'),
+    path('api/identify/', views.identify, name='identify'),
 ]
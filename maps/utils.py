@@ -1,4 +1,5 @@
 import json
+import multiprocessing
 from django.core.serializers import serialize
 from django.core.serializers.json import DjangoJSONEncoder
 
@@ -121,3 +122,21 @@ def get_color_for_value(value, min_value, max_value, color_scheme='viridis'):
         b = 0
         
         return f'#{r:02x}{g:02x}{b:02x}'
+
+
+def get_pool_context():
+    """
+    Get the multiprocessing context for process pools started by the web process.
+    
+    Forking a process whose threads (cache sweeper, revalidation, layer
+    processing) may hold a lock can deadlock the child, so pool workers start
+    from a fork server instead (spawned where fork servers are unavailable).
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def setup_pool_worker():
+    """Set up Django in a pool worker, which starts from a fresh interpreter."""
+    import django
+    django.setup()
@@ -0,0 +1,440 @@
+"""
+Mapbox Vector Tile (MVT) generation for shapefile layers.
+
+Tiles are cut directly from a layer's shapefile: features are selected by the
+tile's bounding box, simplified to the tile's zoom, projected to Web Mercator
+tile coordinates, clipped to the (buffered) tile extent and quantized to the
+integer tile grid before being encoded following the Mapbox Vector Tile 2.1
+specification. Lines and polygons smaller than a pixel are left out, and a
+tile holds at most MAX_TILE_FEATURES features, sampled evenly over the tile.
+
+The protobuf encoding is done by hand (maps/protobuf.py) so no extra
+dependency is required.
+"""
+
+import math
+import struct
+import logging
+from datetime import date, datetime
+
+import numpy as np
+import shapefile
+
+from .protobuf import WIRE_FIXED64, WIRE_VARINT, bytes_field, field_key, packed_field, varint, zigzag
+from .simplification import simplify_line, simplify_ring, tolerance_for_zoom
+from .spatial_index import get_spatial_index
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Tile configuration
+TILE_EXTENT = 4096
+TILE_BUFFER = 64  # Extra tile units kept around the tile edge to hide seams
+MAX_TILE_ZOOM = 24
+MAX_LATITUDE = 85.0511287798
+MVT_CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+MAX_TILE_FEATURES = 20000  # Features kept per tile, sampled evenly when more intersect it
+
+# MVT geometry types
+GEOM_POINT = 1
+GEOM_LINESTRING = 2
+GEOM_POLYGON = 3
+
+# MVT geometry commands
+CMD_MOVE_TO = 1
+CMD_LINE_TO = 2
+CMD_CLOSE_PATH = 7
+
+# Shapefile shape types grouped by the MVT geometry they map to
+POINT_SHAPE_TYPES = (shapefile.POINT, shapefile.POINTZ, shapefile.POINTM,
+                     shapefile.MULTIPOINT, shapefile.MULTIPOINTZ, shapefile.MULTIPOINTM)
+LINE_SHAPE_TYPES = (shapefile.POLYLINE, shapefile.POLYLINEZ, shapefile.POLYLINEM)
+POLYGON_SHAPE_TYPES = (shapefile.POLYGON, shapefile.POLYGONZ, shapefile.POLYGONM)
+
+
+def is_valid_tile(z, x, y):
+    """Check that tile coordinates address an existing tile."""
+    if z < 0 or z > MAX_TILE_ZOOM:
+        return False
+    n = 2 ** z
+    return 0 <= x < n and 0 <= y < n
+
+
+def tile_pixel_to_lonlat(px, py, z, x, y, extent=TILE_EXTENT):
+    """Convert a position in tile units to longitude/latitude."""
+    world_size = extent * (2 ** z)
+    wx = x * extent + px
+    wy = y * extent + py
+    lon = wx / world_size * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * wy / world_size))))
+    return lon, lat
+
+
+def lonlat_to_tile_pixel(lon, lat, z, x, y, extent=TILE_EXTENT):
+    """Convert longitude/latitude to (fractional) tile units of tile z/x/y."""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    world_size = extent * (2 ** z)
+    wx = (lon + 180.0) / 360.0 * world_size
+    sin_lat = math.sin(math.radians(lat))
+    wy = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * world_size
+    return wx - x * extent, wy - y * extent
+
+
+def tile_bbox(z, x, y, buffer=0, extent=TILE_EXTENT):
+    """
+    Get the longitude/latitude bounding box of a tile
+
+    Args:
+        z, x, y: Tile coordinates
+        buffer: Extra margin in tile units added on every side
+        extent: Tile extent in tile units
+
+    Returns:
+        tuple: (x_min, y_min, x_max, y_max)
+    """
+    west, north = tile_pixel_to_lonlat(-buffer, -buffer, z, x, y, extent)
+    east, south = tile_pixel_to_lonlat(extent + buffer, extent + buffer, z, x, y, extent)
+    return (west, south, east, north)
+
+
+def ring_area(ring):
+    """Signed area of a ring using the surveyor's formula (positive = exterior in MVT)."""
+    area = 0
+    for i in range(len(ring) - 1):
+        area += ring[i][0] * ring[i + 1][1] - ring[i + 1][0] * ring[i][1]
+    return area / 2.0
+
+
+def clip_ring(ring, x_min, y_min, x_max, y_max):
+    """Clip a closed ring to a rectangle (Sutherland-Hodgman)."""
+    def clip_edge(points, inside, intersect):
+        output = []
+        if not points:
+            return output
+        prev = points[-1]
+        for point in points:
+            if inside(point):
+                if not inside(prev):
+                    output.append(intersect(prev, point))
+                output.append(point)
+            elif inside(prev):
+                output.append(intersect(prev, point))
+            prev = point
+        return output
+
+    def x_intersect(bound):
+        def intersect(p1, p2):
+            t = (bound - p1[0]) / (p2[0] - p1[0])
+            return (bound, p1[1] + t * (p2[1] - p1[1]))
+        return intersect
+
+    def y_intersect(bound):
+        def intersect(p1, p2):
+            t = (bound - p1[1]) / (p2[1] - p1[1])
+            return (p1[0] + t * (p2[0] - p1[0]), bound)
+        return intersect
+
+    points = ring[:-1] if len(ring) > 1 and ring[0] == ring[-1] else list(ring)
+    points = clip_edge(points, lambda p: p[0] >= x_min, x_intersect(x_min))
+    points = clip_edge(points, lambda p: p[0] <= x_max, x_intersect(x_max))
+    points = clip_edge(points, lambda p: p[1] >= y_min, y_intersect(y_min))
+    points = clip_edge(points, lambda p: p[1] <= y_max, y_intersect(y_max))
+    if points:
+        points.append(points[0])
+    return points
+
+
+def clip_line(line, x_min, y_min, x_max, y_max):
+    """Clip a polyline to a rectangle, returning the list of pieces inside it (Liang-Barsky)."""
+    pieces = []
+    current = []
+    for i in range(len(line) - 1):
+        (x0, y0), (x1, y1) = line[i], line[i + 1]
+        dx, dy = x1 - x0, y1 - y0
+        t0, t1 = 0.0, 1.0
+        visible = True
+        for p, q in ((-dx, x0 - x_min), (dx, x_max - x0), (-dy, y0 - y_min), (dy, y_max - y0)):
+            if p == 0:
+                if q < 0:
+                    visible = False
+                    break
+                continue
+            t = q / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+            if t0 > t1:
+                visible = False
+                break
+        if not visible:
+            if current:
+                pieces.append(current)
+                current = []
+            continue
+        start = (x0 + t0 * dx, y0 + t0 * dy)
+        end = (x0 + t1 * dx, y0 + t1 * dy)
+        if not current:
+            current = [start]
+        current.append(end)
+        if t1 < 1.0:
+            # The segment leaves the rectangle, close the current piece
+            pieces.append(current)
+            current = []
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def quantize(points):
+    """Round points to the integer tile grid, dropping consecutive duplicates."""
+    result = []
+    for px, py in points:
+        point = (int(round(px)), int(round(py)))
+        if not result or result[-1] != point:
+            result.append(point)
+    return result
+
+
+def shape_to_tile_geometry(shape, z, x, y, extent=TILE_EXTENT, buffer=TILE_BUFFER, tolerance=None):
+    """
+    Simplify, project, clip and quantize a pyshp Shape for a tile
+
+    Args:
+        shape: pyshp Shape object in longitude/latitude
+        z, x, y: Tile coordinates
+        extent: Tile extent in tile units
+        buffer: Clip buffer in tile units
+        tolerance: Simplification tolerance in degrees, or None to keep every vertex
+
+    Returns:
+        tuple: (MVT geometry type, list of parts) or (None, None) if nothing remains
+    """
+    if shape is None or not shape.points:
+        return None, None
+
+    lo, hi = -buffer, extent + buffer
+
+    def project(points):
+        return [lonlat_to_tile_pixel(p[0], p[1], z, x, y, extent) for p in points]
+
+    if shape.shapeType in POINT_SHAPE_TYPES:
+        points = [p for p in quantize(project(shape.points)) if lo <= p[0] <= hi and lo <= p[1] <= hi]
+        return (GEOM_POINT, [points]) if points else (None, None)
+
+    parts = list(shape.parts) + [len(shape.points)]
+    source_parts = [shape.points[parts[i]:parts[i + 1]] for i in range(len(parts) - 1)]
+    if tolerance:
+        if shape.shapeType in LINE_SHAPE_TYPES:
+            source_parts = [simplify_line(part, tolerance) for part in source_parts]
+        else:
+            # Clockwise rings are exteriors in lon/lat; holes that collapse are dropped
+            source_parts = [simplify_ring(part, tolerance, is_exterior=ring_area(part) <= 0)
+                            for part in source_parts]
+            source_parts = [part for part in source_parts if part is not None]
+    source_parts = [project(part) for part in source_parts]
+
+    if shape.shapeType in LINE_SHAPE_TYPES:
+        lines = []
+        for part in source_parts:
+            for piece in clip_line(part, lo, lo, hi, hi):
+                piece = quantize(piece)
+                if len(piece) >= 2:
+                    lines.append(piece)
+        return (GEOM_LINESTRING, lines) if lines else (None, None)
+
+    if shape.shapeType in POLYGON_SHAPE_TYPES:
+        rings = []
+        keep_holes = False
+        for part in source_parts:
+            # Shapefile exterior rings are clockwise in lon/lat, which becomes a
+            # positive area once the y axis is flipped to tile coordinates
+            is_exterior = ring_area(part) > 0
+            clipped = quantize(clip_ring(part, lo, lo, hi, hi))
+            if len(clipped) < 4 or ring_area(clipped) == 0:
+                if is_exterior:
+                    keep_holes = False
+                continue
+            if is_exterior:
+                keep_holes = True
+            elif not keep_holes:
+                continue
+            rings.append(clipped)
+        if not rings:
+            return None, None
+        if ring_area(rings[0]) < 0:
+            # Counter-clockwise source data, reverse every ring so the first is exterior
+            rings = [list(reversed(r)) for r in rings]
+        return GEOM_POLYGON, rings
+
+    return None, None
+
+
+def _command(command_id, count):
+    return (command_id & 0x7) | (count << 3)
+
+
+def encode_geometry(geom_type, parts):
+    """Encode tile geometry parts as an MVT command stream."""
+    commands = []
+    cursor_x, cursor_y = 0, 0
+
+    def move(px, py):
+        nonlocal cursor_x, cursor_y
+        commands.extend((zigzag(px - cursor_x), zigzag(py - cursor_y)))
+        cursor_x, cursor_y = px, py
+
+    if geom_type == GEOM_POINT:
+        points = parts[0]
+        commands.append(_command(CMD_MOVE_TO, len(points)))
+        for px, py in points:
+            move(px, py)
+        return commands
+
+    for part in parts:
+        # Polygon rings are closed with ClosePath instead of repeating the first point
+        vertices = part[:-1] if geom_type == GEOM_POLYGON else part
+        commands.append(_command(CMD_MOVE_TO, 1))
+        move(*vertices[0])
+        commands.append(_command(CMD_LINE_TO, len(vertices) - 1))
+        for px, py in vertices[1:]:
+            move(px, py)
+        if geom_type == GEOM_POLYGON:
+            commands.append(_command(CMD_CLOSE_PATH, 1))
+    return commands
+
+
+def encode_value(value):
+    """Encode an attribute value as an MVT Value message."""
+    if isinstance(value, bool):
+        return field_key(7, WIRE_VARINT) + varint(int(value))
+    if isinstance(value, int):
+        if value < 0:
+            return field_key(6, WIRE_VARINT) + varint(zigzag(value))
+        return field_key(5, WIRE_VARINT) + varint(value)
+    if isinstance(value, float):
+        return field_key(3, WIRE_FIXED64) + struct.pack('<d', value)
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    elif isinstance(value, bytes):
+        try:
+            value = value.decode('utf-8')
+        except UnicodeDecodeError:
+            value = str(value)
+    return bytes_field(1, str(value).encode('utf-8'))
+
+
+def encode_layer(name, features, extent=TILE_EXTENT):
+    """
+    Encode a single MVT layer
+
+    Args:
+        name: Layer name
+        features: Iterable of (geometry type, parts, properties dict, feature id)
+        extent: Tile extent in tile units
+
+    Returns:
+        bytes: Encoded Layer message
+    """
+    keys, key_index = [], {}
+    values, value_index = [], {}
+    encoded_features = []
+
+    for geom_type, parts, properties, feature_id in features:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            if key not in key_index:
+                key_index[key] = len(keys)
+                keys.append(key)
+            encoded = encode_value(value)
+            if encoded not in value_index:
+                value_index[encoded] = len(values)
+                values.append(encoded)
+            tags.extend((key_index[key], value_index[encoded]))
+
+        feature = b''
+        if feature_id is not None:
+            feature += field_key(1, WIRE_VARINT) + varint(feature_id)
+        if tags:
+            feature += packed_field(2, tags)
+        feature += field_key(3, WIRE_VARINT) + varint(geom_type)
+        feature += packed_field(4, encode_geometry(geom_type, parts))
+        encoded_features.append(bytes_field(2, feature))
+
+    layer = field_key(15, WIRE_VARINT) + varint(2)
+    layer += bytes_field(1, name.encode('utf-8'))
+    layer += b''.join(encoded_features)
+    layer += b''.join(bytes_field(3, k.encode('utf-8')) for k in keys)
+    layer += b''.join(bytes_field(4, v) for v in values)
+    layer += field_key(5, WIRE_VARINT) + varint(extent)
+    return layer
+
+
+def build_tile(shapefile_path, z, x, y, layer_name='layer', extent=TILE_EXTENT, buffer=TILE_BUFFER,
+               max_features=MAX_TILE_FEATURES):
+    """
+    Cut a single vector tile out of a shapefile
+
+    Args:
+        shapefile_path: Path to the source shapefile (longitude/latitude coordinates)
+        z, x, y: Tile coordinates
+        layer_name: Name of the MVT layer inside the tile
+        extent: Tile extent in tile units
+        buffer: Clip buffer in tile units
+        max_features: Maximum number of features in the tile, or None for no limit
+
+    Returns:
+        bytes: Encoded tile (empty when no feature intersects the tile)
+    """
+    bbox = tile_bbox(z, x, y, buffer=buffer, extent=extent)
+    # A pixel of the tile in degrees, measured at its center
+    tolerance = tolerance_for_zoom(z, latitude=(bbox[1] + bbox[3]) / 2)
+    reader = shapefile.Reader(shapefile_path)
+    try:
+        field_names = [field[0] for field in reader.fields[1:]]
+        # Points have no size, lines and polygons smaller than a pixel wouldn't be visible
+        min_size = None if reader.shapeType in POINT_SHAPE_TYPES else tolerance
+        features = []
+        index = get_spatial_index(shapefile_path)
+        if index is not None:
+            # Only read the records whose bounding box touches the tile
+            record_ids = index.query(bbox, min_size=min_size)
+            if max_features and len(record_ids) > max_features:
+                record_ids = record_ids[np.linspace(0, len(record_ids) - 1, max_features).astype(np.int64)]
+            shape_records = (reader.shapeRecord(int(i)) for i in record_ids)
+        else:
+            shape_records = reader.iterShapeRecords(bbox=bbox)
+        for shape_rec in shape_records:
+            shape = shape_rec.shape
+            if min_size and hasattr(shape, 'bbox') and (shape.bbox[2] - shape.bbox[0] < min_size and
+                                                        shape.bbox[3] - shape.bbox[1] < min_size):
+                continue
+            geom_type, parts = shape_to_tile_geometry(shape, z, x, y, extent, buffer, tolerance)
+            if geom_type is None:
+                continue
+            properties = dict(zip(field_names, shape_rec.record))
+            features.append((geom_type, parts, properties, shape_rec.record.oid))
+    finally:
+        reader.close()
+
+    logger.info(f"Built tile {z}/{x}/{y} for {shapefile_path} with {len(features)} features")
+
+    if not features:
+        return b''
+    return bytes_field(3, encode_layer(layer_name, features, extent))
+
+
+def build_layer_tile(layer, z, x, y):
+    """
+    Build the vector tile z/x/y for a shapefile MapLayer
+
+    Returns:
+        bytes: Encoded tile, or None if the layer has no readable shapefile
+    """
+    shapefile_path = layer.get_shapefile_path()
+    if not shapefile_path:
+        logger.error(f"No shapefile available for layer {layer.id}")
+        return None
+    return build_tile(shapefile_path, z, x, y, layer_name=f"layer_{layer.id}")
@@ -2,10 +2,12 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.core.paginator import Paginator
-from django.http import JsonResponse, HttpResponse, FileResponse
+from django.http import JsonResponse, HttpResponse, FileResponse, StreamingHttpResponse, HttpResponseNotModified
 from django.db.models import Q
 from django.views.decorators.cache import cache_page
+from django.views.decorators.vary import vary_on_headers
 from django.urls import reverse
+from django.utils.http import parse_etags, quote_etag
 from django.views.decorators.csrf import csrf_exempt
 import math  # Required for Haversine formula in radius search
 import json
@@ -17,6 +19,23 @@ from .forms import PropertySearchForm, FileUploadForm, MapLayerForm
 from .services import process_property_file
 from .ml_models import predict_property_height, predict_property_quality
 from .onedrive import get_onedrive_client
+from .caching import (
+    get_cache_expiry, get_cache_key, get_tile_cache_key, get_accepted_encodings, layer_cache, STREAMING_SIZE_THRESHOLD,
+    COMPRESSED_SUFFIXES,
+)
+from .vector_tiles import build_layer_tile, is_valid_tile, MVT_CONTENT_TYPE
+from .chunking import process_layer_in_chunks
+from .pyramid import iter_pyramid_geojson
+from .attribute_index import AttributeFilterError, check_where
+from .identify import (
+    identify_features, DEFAULT_PIXEL_TOLERANCE, DEFAULT_ZOOM as DEFAULT_IDENTIFY_ZOOM, MAX_FEATURES_PER_LAYER,
+)
+from .topojson import geojson_to_topojson, DEFAULT_QUANTIZATION, TOPOJSON_CONTENT_TYPE
+from .geobuf import accepts_geobuf, encode_layer as encode_layer_geobuf, GEOBUF_CONTENT_TYPE
+from .processing import get_progress_percent, recover_stale_layer
+from .single_flight import KeyLock, ReleasingIterator
+from .cache_warming import render_layer
+from .revalidation import revalidate
 
 import logging
 logger = logging.getLogger(__name__)
@@ -173,6 +192,7 @@ def property_detail(request, property_id):
         'property': property,
         'neighbors': neighbors,
         'attributes': property.attributes.all(),
+        'layer_features': property.layer_features.select_related('layer').order_by('layer__name'),
     }
     return render(request, 'maps/property_detail.html', context)
 
@@ -319,21 +339,339 @@ def map_layers_list(request):
     return JsonResponse({'layers': layers})
 
 
+def parse_bbox(value):
+    """Parse a 'west,south,east,north' bbox parameter, returning None if invalid."""
+    try:
+        west, south, east, north = [float(v) for v in value.split(',')]
+    except (ValueError, AttributeError):
+        return None
+    if west > east or south > north:
+        return None
+    if not all(math.isfinite(v) for v in (west, south, east, north)):
+        return None
+    return (west, south, east, north)
+
+
+def parse_fields(value, field_names):
+    """
+    Parse a comma-separated 'fields' projection parameter
+    
+    Args:
+        value: Requested attribute names
+        field_names: Attribute names of the layer, or None if unknown
+        
+    Returns:
+        tuple: (fields, unknown) with the requested names in layer order
+               (fields is None when no projection was asked for)
+    """
+    requested = [name.strip() for name in (value or '').split(',') if name.strip()]
+    if not requested:
+        return None, []
+    if field_names is None:
+        return list(dict.fromkeys(requested)), []
+    unknown = [name for name in requested if name not in field_names]
+    # Layer order keeps one cache entry per projection, whatever the request order
+    return [name for name in field_names if name in requested], unknown
+
+
+def should_stream_layer(layer, stream=None):
+    """
+    Decide whether a shapefile layer's GeoJSON should be streamed
+    
+    Args:
+        layer: MapLayer instance
+        stream: Value of the 'stream' query parameter; '1'/'true' forces
+                streaming, '0'/'false' disables it
+        
+    Returns:
+        bool: True when the response should be streamed
+    """
+    if stream in ('1', 'true'):
+        return True
+    if stream in ('0', 'false'):
+        return False
+    
+    shapefile_path = layer.get_shapefile_path()
+    return bool(shapefile_path) and os.path.getsize(shapefile_path) > STREAMING_SIZE_THRESHOLD
+
+
+def cached_response(entry, content_type):
+    """Build a response serving a layer cache entry, with its content encoding."""
+    if entry.tier != 'file':
+        response = HttpResponse(entry.data, content_type=content_type)
+        response['X-Cache'] = 'HIT' if entry.tier == 'memory' else 'SHARED-HIT'
+    else:
+        # Stream the file instead of reading it into memory
+        response = FileResponse(entry.file, content_type=content_type)
+        response['X-Cache'] = 'FILE-HIT'
+    if entry.stale:
+        # Served while a rebuild refreshes it in the background
+        response['X-Cache'] = 'STALE'
+    if entry.encoding:
+        response['Content-Encoding'] = entry.encoding
+    return response
+
+
+def layer_geojson_cached_response(entry, zoom):
+    """Serve a cached GeoJSON entry, kept by browsers for less time when zoom-specific."""
+    response = cached_response(entry, 'application/json')
+    response['Cache-Control'] = 'max-age=1800' if zoom else 'max-age=3600'
+    return response
+
+
+def cache_layer_topojson(layer, cache_key, simplify, max_features, zoom_level, quantization=DEFAULT_QUANTIZATION,
+                         fields=None, where=None):
+    """
+    Encode a layer as TopoJSON into the layer cache
+    
+    Returns:
+        str: TopoJSON text, or None if the layer couldn't be converted
+    """
+    geojson_data = None
+    shapefile_path = layer.get_shapefile_path() if layer.layer_type == 'shapefile' else None
+    if zoom_level is not None and shapefile_path and simplify not in ('', 'none', 'false', '0'):
+        chunks = iter_pyramid_geojson(shapefile_path, zoom_level, max_features, layer.style, fields, where)
+        if chunks is not None:
+            geojson_data = ''.join(chunks)
+    if geojson_data is None:
+        geojson_data = layer.get_geojson_data(simplify=simplify, max_features=max_features, zoom=zoom_level,
+                                              fields=fields, where=where)
+    if not geojson_data:
+        return None
+    
+    topojson_data = geojson_to_topojson(geojson_data, f"layer_{layer.id}", quantization)
+    logger.info(f"TopoJSON for layer {layer.id}: {len(topojson_data) / 1024:.1f} KB "
+                f"(GeoJSON {len(geojson_data) / 1024:.1f} KB)")
+    layer_cache.set(cache_key, topojson_data, get_cache_expiry(zoom_level), compress=False, persist=False)
+    return topojson_data
+
+
+def layer_topojson_response(layer, simplify, max_features, zoom, quantization=DEFAULT_QUANTIZATION, fields=None,
+                            where=None):
+    """
+    Serve a layer as TopoJSON, with borders shared between features stored once
+    
+    Args:
+        layer: MapLayer instance (shapefile or GeoJSON layer)
+        simplify, max_features, zoom: Same parameters as the GeoJSON output
+        quantization: Number of integer grid positions along each axis
+        fields: Attribute names to include (all when None)
+        where: Attribute filter selecting the features (all when None)
+        
+    Returns:
+        HttpResponse: TopoJSON response, or a JSON error response
+    """
+    data_key = get_cache_key(layer.id, layer.get_content_version(), simplify, max_features, zoom, fields, where)
+    cache_key = f"topojson_{data_key}_{quantization}"
+    
+    try:
+        zoom_level = int(zoom) if zoom else None
+    except ValueError:
+        zoom_level = None
+    
+    # Expired entries are served while they are rebuilt in the background
+    cached = layer_cache.get(cache_key, stale=True)
+    if cached:
+        logger.info(f"Using {'stale ' * cached.stale}cached TopoJSON for layer {layer.id}")
+        if cached.stale:
+            revalidate(cache_key, cache_layer_topojson, layer, cache_key, simplify, max_features, zoom_level,
+                       quantization, fields, where)
+        response = cached_response(cached, TOPOJSON_CONTENT_TYPE)
+        response['Cache-Control'] = 'max-age=1800' if zoom else 'max-age=3600'
+        return response
+    
+    try:
+        topojson_data = cache_layer_topojson(layer, cache_key, simplify, max_features, zoom_level, quantization,
+                                             fields, where)
+        if not topojson_data:
+            return JsonResponse({'error': 'Could not process layer'}, status=500)
+    except Exception as e:
+        logger.exception(f"Error encoding layer {layer.id} as TopoJSON: {str(e)}")
+        return JsonResponse({'error': f'Error encoding TopoJSON: {str(e)}'}, status=500)
+    
+    response = HttpResponse(topojson_data, content_type=TOPOJSON_CONTENT_TYPE)
+    response['Cache-Control'] = 'max-age=1800' if zoom else 'max-age=3600'
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+def cache_layer_geobuf(layer, cache_key, simplify, max_features, zoom_level, fields=None, where=None):
+    """
+    Encode a shapefile layer as Geobuf into the layer cache
+    
+    Returns:
+        bytes: Geobuf data, or None if the shapefile is unavailable
+    """
+    shapefile_path = layer.get_local_shapefile()
+    if not shapefile_path:
+        return None
+    
+    geobuf_data = encode_layer_geobuf(shapefile_path, simplify=simplify, max_features=max_features, zoom=zoom_level,
+                                      fields=fields, where=where)
+    layer_cache.set(cache_key, geobuf_data, get_cache_expiry(zoom_level), compress=False, persist=False)
+    return geobuf_data
+
+
+def layer_geobuf_response(layer, simplify, max_features, zoom, fields=None, where=None):
+    """
+    Serve a shapefile layer in the compact Geobuf binary encoding
+    
+    Args:
+        layer: Shapefile MapLayer instance
+        simplify, max_features, zoom, fields, where: Same parameters as the GeoJSON output
+        
+    Returns:
+        HttpResponse: Geobuf response, or a JSON error response
+    """
+    data_key = get_cache_key(layer.id, layer.get_content_version(), simplify, max_features, zoom, fields, where)
+    cache_key = f"geobuf_{data_key}"
+    
+    try:
+        zoom_level = int(zoom) if zoom else None
+    except ValueError:
+        zoom_level = None
+    
+    # Expired entries are served while they are rebuilt in the background
+    cached = layer_cache.get(cache_key, stale=True)
+    if cached:
+        logger.info(f"Using {'stale ' * cached.stale}cached Geobuf for layer {layer.id}")
+        if cached.stale:
+            revalidate(cache_key, cache_layer_geobuf, layer, cache_key, simplify, max_features, zoom_level, fields,
+                       where)
+        response = cached_response(cached, GEOBUF_CONTENT_TYPE)
+        response['Cache-Control'] = 'max-age=1800' if zoom else 'max-age=3600'
+        return response
+    
+    try:
+        geobuf_data = cache_layer_geobuf(layer, cache_key, simplify, max_features, zoom_level, fields, where)
+        if geobuf_data is None:
+            return JsonResponse({'error': 'Could not process shapefile'}, status=500)
+    except Exception as e:
+        logger.exception(f"Error encoding layer {layer.id} as Geobuf: {str(e)}")
+        return JsonResponse({'error': f'Error encoding Geobuf: {str(e)}'}, status=500)
+    
+    response = HttpResponse(geobuf_data, content_type=GEOBUF_CONTENT_TYPE)
+    response['Cache-Control'] = 'max-age=1800' if zoom else 'max-age=3600'
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+def get_layer_data_etag(layer, request):
+    """
+    Build the strong ETag of a layer data response
+    
+    Args:
+        layer: MapLayer instance
+        request: The request, whose parameters select the representation
+        
+    Returns:
+        str: Quoted ETag for the uncompressed representation
+    """
+    import hashlib
+    
+    params = sorted((key, value) for key, value in request.GET.items() if key != 'stream')
+    representation = 'geobuf' if accepts_geobuf(request.META.get('HTTP_ACCEPT')) else 'json'
+    tag_source = f"{layer.id}:{layer.get_content_version()}:{representation}:{params}"
+    return quote_etag(hashlib.md5(tag_source.encode()).hexdigest())
+
+
+def match_etag(if_none_match, etag):
+    """
+    Check an If-None-Match header against an ETag and its encoded variants
+    
+    Returns:
+        str: The matching tag from the header, or None
+    """
+    if not if_none_match:
+        return None
+    tags = parse_etags(if_none_match)
+    if '*' in tags:
+        return etag
+    # The plain tag, or the tag of one of its compressed variants (see map_layer_data)
+    base = etag.strip('"')
+    variants = {etag} | {quote_etag(f"{base}-{encoding}") for encoding in COMPRESSED_SUFFIXES}
+    for tag in tags:
+        if tag in variants:
+            return tag
+    return None
+
+
+def layer_processing_response(layer):
+    """Return a 503 response while a layer's upload is still being processed, else None."""
+    # A layer whose job was lost with its process is processed again rather than answering 503 for good
+    recover_stale_layer(layer)
+    if layer.processing_status not in ('pending', 'processing'):
+        return None
+    response = JsonResponse({
+        'error': 'Layer is still being processed',
+        'status': layer.processing_status,
+        'stage': layer.processing_stage,
+        'progress': get_progress_percent(layer.processing_progress),
+    }, status=503)
+    response['Retry-After'] = '5'
+    return response
+
+
+def map_layer_status(request, layer_id):
+    """API endpoint reporting the progress of a layer's background processing."""
+    layer = get_object_or_404(MapLayer, id=layer_id)
+    recover_stale_layer(layer)
+    
+    response = JsonResponse({
+        'id': layer.id,
+        'name': layer.name,
+        'status': layer.processing_status,
+        'stage': layer.processing_stage,
+        'progress': get_progress_percent(layer.processing_progress),
+        'stages': layer.processing_progress,
+        'error': layer.processing_error,
+        'stats': layer.stats,
+    })
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@vary_on_headers('Accept', 'Accept-Encoding')
 def map_layer_data(request, layer_id):
     """API endpoint to get the data for a specific map layer."""
+    layer = get_object_or_404(MapLayer, id=layer_id, is_active=True)
+    
+    processing_response = layer_processing_response(layer)
+    if processing_response:
+        return processing_response
+    
+    # Answer revalidations before any cache lookup or conversion
+    etag = get_layer_data_etag(layer, request)
+    matched_etag = match_etag(request.META.get('HTTP_IF_NONE_MATCH'), etag)
+    if matched_etag:
+        response = HttpResponseNotModified()
+        response['ETag'] = matched_etag
+        response['Cache-Control'] = 'max-age=1800' if request.GET.get('zoom') else 'max-age=3600'
+        return response
+    
+    response = layer_data_response(request, layer)
+    if response.status_code == 200:
+        # Compressed bytes are a different representation, so they get their own tag
+        encoding = response.get('Content-Encoding')
+        response['ETag'] = quote_etag(etag.strip('"') + '-' + encoding) if encoding else etag
+    return response
+
+
+def layer_data_response(request, layer):
+    """Build the data response for a map layer (see map_layer_data)."""
     import logging
-    import hashlib
     import os
-    from django.core.cache import cache
     
     logger = logging.getLogger(__name__)
     
-    layer = get_object_or_404(MapLayer, id=layer_id, is_active=True)
+    layer_id = layer.id
     
     # Get simplification parameter for large datasets
     simplify = request.GET.get('simplify', 'auto')
     max_features = request.GET.get('max_features')
     zoom = request.GET.get('zoom')
+    bbox = request.GET.get('bbox')
+    response_format = request.GET.get('format', 'geojson')
     
     if max_features:
         try:
@@ -341,86 +679,169 @@ def map_layer_data(request, layer_id):
         except ValueError:
             max_features = None
     
+    if response_format not in ('geojson', 'topojson'):
+        return JsonResponse({'error': 'Invalid format, expected geojson or topojson'}, status=400)
+    
+    try:
+        quantization = int(request.GET.get('quantization', DEFAULT_QUANTIZATION))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid quantization'}, status=400)
+    
+    # Attribute projection: only the requested .dbf columns are decoded and sent
+    fields = None
+    if layer.layer_type == 'shapefile' and request.GET.get('fields'):
+        fields, unknown = parse_fields(request.GET['fields'], layer.get_field_names())
+        if unknown:
+            return JsonResponse({'error': f"Unknown fields: {', '.join(unknown)}"}, status=400)
+    
+    # Attribute filter, answered from the layer's column indexes
+    where = None
+    if layer.layer_type == 'shapefile' and request.GET.get('where', '').strip():
+        where = request.GET['where'].strip()
+        shapefile_path = layer.get_shapefile_path()
+        if not shapefile_path:
+            return JsonResponse({'error': 'Could not process shapefile'}, status=500)
+        # Only checked here; the records are selected by the conversion, on a cache miss
+        try:
+            check_where(shapefile_path, where)
+        except AttributeFilterError as e:
+            return JsonResponse({'error': f'Invalid where filter: {str(e)}'}, status=400)
+    
     # Handle different layer types
+    if layer.layer_type == 'shapefile' and bbox:
+        # Viewport mode: only serve the chunks covering the visible extent
+        view_bbox = parse_bbox(bbox)
+        if view_bbox is None:
+            return JsonResponse({'error': 'Invalid bbox, expected west,south,east,north'}, status=400)
+        try:
+            zoom_level = int(zoom) if zoom else 12
+        except ValueError:
+            return JsonResponse({'error': 'Invalid zoom level'}, status=400)
+        
+        try:
+            geojson_data = process_layer_in_chunks(layer, view_bbox, zoom_level, simplify=simplify,
+                                                   max_features=max_features, fields=fields, where=where)
+        except Exception as e:
+            logger.exception(f"Error serving viewport of shapefile layer {layer_id}: {str(e)}")
+            return JsonResponse({'error': f'Error processing shapefile: {str(e)}'}, status=500)
+        
+        if not geojson_data:
+            return JsonResponse({'error': 'Could not process shapefile'}, status=500)
+        
+        if response_format == 'topojson':
+            response = HttpResponse(geojson_to_topojson(geojson_data, f"layer_{layer.id}", quantization),
+                                    content_type=TOPOJSON_CONTENT_TYPE)
+        else:
+            response = HttpResponse(geojson_data, content_type='application/json')
+        response['Cache-Control'] = 'max-age=1800'
+        return response
+    
+    if response_format == 'topojson' and layer.layer_type in ('shapefile', 'geojson'):
+        return layer_topojson_response(layer, simplify, max_features, zoom, quantization, fields, where)
+    
+    if layer.layer_type == 'shapefile' and accepts_geobuf(request.META.get('HTTP_ACCEPT')):
+        return layer_geobuf_response(layer, simplify, max_features, zoom, fields, where)
+    
     if layer.layer_type == 'shapefile':
         # For shapefiles, convert to GeoJSON
         try:
             # Generate cache key based on parameters
-            cache_params = f"{layer_id}:{simplify}:{max_features}:{zoom}"
-            cache_key = f"shapefile_data_{hashlib.md5(cache_params.encode()).hexdigest()}"
+            cache_key = get_cache_key(layer_id, layer.get_content_version(), simplify, max_features, zoom, fields, where)
             
-            # Try to get from cache first
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                logger.info(f"Using cached GeoJSON for layer {layer_id} with params: {simplify}, {max_features}, zoom={zoom}")
-                response = HttpResponse(cached_data, content_type='application/json')
-                if zoom:
-                    response['Cache-Control'] = f'max-age=1800'  # Cache for 30 minutes when zoom-specific
-                else:
-                    response['Cache-Control'] = 'max-age=3600'  # Cache for 1 hour otherwise
-                response['X-Cache'] = 'HIT'
-                return response
-                
-            # Also try file-based cache for very large files
-            cache_dir = os.path.join('media', 'cache', 'shapefiles')
-            os.makedirs(cache_dir, exist_ok=True)
-            cache_file = os.path.join(cache_dir, f"{cache_key}.geojson")
+            # Compressed cache variants are served as they are
+            encodings = get_accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING'))
             
-            if os.path.exists(cache_file):
-                logger.info(f"Using file-cached GeoJSON for layer {layer_id}")
-                with open(cache_file, 'r') as f:
-                    cached_data = f.read()
-                response = HttpResponse(cached_data, content_type='application/json')
-                if zoom:
-                    response['Cache-Control'] = f'max-age=1800'
-                else:
-                    response['Cache-Control'] = 'max-age=3600'
-                response['X-Cache'] = 'FILE-HIT'
-                return response
-                
-            # Not in cache, generate the data
-            logger.info(f"Cache miss for layer {layer_id}, generating GeoJSON")
-            
-            # Store the request temporarily on the model instance for access to zoom parameter
-            layer._current_request = request
-            
-            geojson_data = layer.get_geojson_data(simplify=simplify, max_features=max_features)
+            try:
+                zoom_level = int(zoom) if zoom else None
+            except ValueError:
+                zoom_level = None
             
-            # Clean up the temporary reference
-            delattr(layer, '_current_request')
+            # Try the memory tier, then the tiers shared by all workers; expired entries are served while
+            # they are rebuilt in the background
+            cached = layer_cache.get(cache_key, encodings, stale=True)
+            if cached:
+                logger.info(f"Using {'stale ' * cached.stale}{cached.tier}-cached GeoJSON for layer {layer_id} "
+                            f"with params: {simplify}, {max_features}, zoom={zoom}")
+                if cached.stale:
+                    revalidate(cache_key, render_layer, layer, cache_key, simplify, max_features, zoom_level, fields,
+                               where)
+                return layer_geojson_cached_response(cached, zoom)
             
-            if geojson_data:
-                # Cache the result (in memory for smaller results, file for larger)
-                data_size = len(geojson_data)
-                if data_size < 1024 * 1024 * 5:  # 5MB limit for memory cache
-                    # Cache time varies by zoom level - longer cache for less detailed views
-                    if zoom and int(zoom) < 12:
-                        cache_time = 60 * 60 * 24  # 24 hours for far-out zooms
-                    elif zoom:
-                        cache_time = 60 * 60 * 2   # 2 hours for closer zooms
+            # Not in cache: one request converts, concurrent ones for the same key wait for its result
+            flight = KeyLock(cache_key)
+            if not flight.acquire():
+                logger.warning(f"Timed out waiting for the conversion of {cache_key}, converting again")
+            try:
+                if flight.waited:
+                    cached = layer_cache.get(cache_key, encodings)
+                    if cached:
+                        logger.info(f"Using GeoJSON of layer {layer_id} converted by a concurrent request")
+                        return layer_geojson_cached_response(cached, zoom)
+                
+                logger.info(f"Cache miss for layer {layer_id}, generating GeoJSON")
+                
+                # Zoom-dependent requests can be served from the pregeneralized pyramid
+                pyramid_chunks = None
+                shapefile_path = layer.get_shapefile_path()
+                if zoom_level is not None and shapefile_path and simplify not in ('', 'none', 'false', '0'):
+                    pyramid_chunks = iter_pyramid_geojson(shapefile_path, zoom_level, max_features, layer.style, fields, where)
+                
+                if should_stream_layer(layer, request.GET.get('stream')):
+                    # Large layer: serialize feature by feature and write the file cache as we go
+                    chunks = pyramid_chunks
+                    if chunks is None:
+                        chunks = layer.stream_geojson_data(simplify=simplify, max_features=max_features, zoom=zoom_level,
+                                                           fields=fields, where=where)
+                    if chunks is None:
+                        logger.error(f"Failed to stream GeoJSON data for layer {layer_id}")
+                        return JsonResponse({'error': 'Could not process shapefile'}, status=500)
+                
+                    logger.info(f"Streaming GeoJSON for layer {layer_id}")
+                    # The lock is held until the stream has written the cache entry
+                    response = StreamingHttpResponse(ReleasingIterator(layer_cache.stream(cache_key, chunks), flight),
+                                                     content_type='application/json')
+                    flight = None
+                    if zoom:
+                        response['Cache-Control'] = f'max-age=1800'
                     else:
-                        cache_time = 60 * 60 * 12  # 12 hours default
-                    
-                    cache.set(cache_key, geojson_data, cache_time)
-                    logger.info(f"Cached {data_size/1024/1024:.2f}MB of GeoJSON in memory for {cache_time/60/60:.1f} hours")
+                        response['Cache-Control'] = 'max-age=3600'
+                    response['X-Cache'] = 'MISS' if pyramid_chunks is None else 'PYRAMID'
+                    return response
+                
+                # Store the request temporarily on the model instance for access to zoom parameter
+                layer._current_request = request
+                
+                if pyramid_chunks is not None:
+                    geojson_data = ''.join(pyramid_chunks)
                 else:
-                    # For very large results, use file-based caching
-                    with open(cache_file, 'w') as f:
-                        f.write(geojson_data)
-                    logger.info(f"Cached {data_size/1024/1024:.2f}MB of GeoJSON to file: {cache_file}")
+                    geojson_data = layer.get_geojson_data(simplify=simplify, max_features=max_features, fields=fields,
+                                                          where=where)
                 
-                # Enable gzip compression for large responses
-                response = HttpResponse(geojson_data, content_type='application/json')
-                # Add cache headers for better performance - use shorter cache for dynamic zoom-dependent data
-                if zoom:
-                    response['Cache-Control'] = f'max-age=1800'  # Cache for 30 minutes when zoom-specific
+                # Clean up the temporary reference
+                delattr(layer, '_current_request')
+                
+                if geojson_data:
+                    # Cache the result in the tiers it fits, and send the variant the client accepts
+                    stored = layer_cache.set(cache_key, geojson_data, get_cache_expiry(zoom_level), encodings)
+                    if stored and stored.tier == 'file':
+                        response = FileResponse(stored.file, content_type='application/json')
+                    else:
+                        response = HttpResponse(stored.data if stored else geojson_data, content_type='application/json')
+                    if stored and stored.encoding:
+                        response['Content-Encoding'] = stored.encoding
+                    # Add cache headers for better performance - use shorter cache for dynamic zoom-dependent data
+                    if zoom:
+                        response['Cache-Control'] = f'max-age=1800'  # Cache for 30 minutes when zoom-specific
+                    else:
+                        response['Cache-Control'] = 'max-age=3600'  # Cache for 1 hour otherwise
+                    response['X-Cache'] = 'MISS' if pyramid_chunks is None else 'PYRAMID'
+                    return response
                 else:
-                    response['Cache-Control'] = 'max-age=3600'  # Cache for 1 hour otherwise
-                response['X-Cache'] = 'MISS'
-                return response
-            else:
-                logger.error(f"Failed to get GeoJSON data for layer {layer_id}")
-                return JsonResponse({'error': 'Could not process shapefile'}, status=500)
+                    logger.error(f"Failed to get GeoJSON data for layer {layer_id}")
+                    return JsonResponse({'error': 'Could not process shapefile'}, status=500)
+            finally:
+                if flight is not None:
+                    flight.release()
         except Exception as e:
             logger.exception(f"Error serving shapefile layer {layer_id}: {str(e)}")
             return JsonResponse({'error': f'Error processing shapefile: {str(e)}'}, status=500)
@@ -445,6 +866,109 @@ def map_layer_data(request, layer_id):
         })
 
 
+def cache_layer_tile(layer, cache_key, z, x, y):
+    """
+    Cut a vector tile of a shapefile layer into the layer cache
+    
+    Returns:
+        bytes: The tile, or None if the shapefile is unavailable
+    """
+    tile = build_layer_tile(layer, z, x, y)
+    if tile is not None:
+        layer_cache.set(cache_key, tile, get_cache_expiry(z), compress=False, persist=False)
+    return tile
+
+
+def map_layer_tile(request, layer_id, z, x, y):
+    """API endpoint serving a Mapbox Vector Tile cut from a shapefile layer."""
+    layer = get_object_or_404(MapLayer, id=layer_id, is_active=True)
+    
+    if layer.layer_type != 'shapefile':
+        return JsonResponse({'error': 'Vector tiles are only available for shapefile layers'}, status=400)
+    
+    if not is_valid_tile(z, x, y):
+        return JsonResponse({'error': f'Invalid tile coordinates {z}/{x}/{y}'}, status=404)
+    
+    processing_response = layer_processing_response(layer)
+    if processing_response:
+        return processing_response
+    
+    cache_key = get_tile_cache_key(layer_id, layer.get_content_version(), z, x, y)
+    # Expired tiles are served while they are rebuilt in the background
+    cached = layer_cache.get(cache_key, stale=True)
+    tile = cached.data if cached else None
+    cache_status = 'SHARED-HIT' if cached and cached.tier == 'shared' else 'HIT'
+    if cached and cached.stale:
+        cache_status = 'STALE'
+        revalidate(cache_key, cache_layer_tile, layer, cache_key, z, x, y)
+    
+    if tile is None:
+        cache_status = 'MISS'
+        try:
+            tile = cache_layer_tile(layer, cache_key, z, x, y)
+        except Exception as e:
+            logger.exception(f"Error building tile {z}/{x}/{y} for layer {layer_id}: {str(e)}")
+            return JsonResponse({'error': f'Error building tile: {str(e)}'}, status=500)
+        
+        if tile is None:
+            return JsonResponse({'error': 'Could not process shapefile'}, status=500)
+    
+    response = HttpResponse(tile, content_type=MVT_CONTENT_TYPE)
+    response['Cache-Control'] = 'max-age=3600'
+    response['X-Cache'] = cache_status
+    return response
+
+
+def identify(request):
+    """
+    API endpoint returning the features of map layers at a clicked point
+    
+    Query parameters: lat, lng, layers (comma-separated layer ids), and
+    optionally zoom (default 12), pixels (search distance, default 5),
+    limit (features per layer, default 10) and fields.
+    """
+    try:
+        lat = float(request.GET['lat'])
+        lng = float(request.GET['lng'])
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'lat and lng are required numbers'}, status=400)
+    if not (math.isfinite(lat) and math.isfinite(lng) and -90 <= lat <= 90 and -180 <= lng <= 180):
+        return JsonResponse({'error': 'lat or lng out of range'}, status=400)
+    
+    try:
+        layer_ids = [int(value) for value in request.GET.get('layers', '').split(',') if value.strip()]
+    except ValueError:
+        return JsonResponse({'error': 'layers must be a comma-separated list of layer ids'}, status=400)
+    if not layer_ids:
+        return JsonResponse({'error': 'layers is required'}, status=400)
+    
+    try:
+        zoom = min(max(int(request.GET.get('zoom', DEFAULT_IDENTIFY_ZOOM)), 0), 24)
+        pixels = min(max(float(request.GET.get('pixels', DEFAULT_PIXEL_TOLERANCE)), 0.0), 50.0)
+        limit = min(max(int(request.GET.get('limit', MAX_FEATURES_PER_LAYER)), 1), 100)
+    except ValueError:
+        return JsonResponse({'error': 'zoom, pixels and limit must be numbers'}, status=400)
+    
+    results = []
+    layers = MapLayer.objects.filter(id__in=layer_ids, is_active=True, layer_type='shapefile')
+    for layer in sorted(layers, key=lambda layer: layer_ids.index(layer.id)):
+        shapefile_path = layer.get_shapefile_path()
+        if not shapefile_path:
+            continue
+        fields = None
+        if request.GET.get('fields'):
+            fields, _ = parse_fields(request.GET['fields'], layer.get_field_names())
+        try:
+            features = identify_features(shapefile_path, lng, lat, zoom, pixels, limit, fields)
+        except Exception as e:
+            logger.exception(f"Error identifying features of layer {layer.id}: {str(e)}")
+            results.append({'id': layer.id, 'name': layer.name, 'error': str(e), 'features': []})
+            continue
+        results.append({'id': layer.id, 'name': layer.name, 'features': features})
+    
+    return JsonResponse({'lat': lat, 'lng': lng, 'layers': results})
+
+
 @login_required
 def map_layer_list(request):
     """List all map layers with management options."""
@@ -672,17 +1196,21 @@ def add_map_layer(request):
                             form.add_error('file', 'File is required even when using OneDrive storage')
                             raise ValueError("Missing required file for shapefile layer with OneDrive storage")
                 
-                # Save the model to generate an ID and process the file
+                # Save the model to generate an ID and queue the file for processing
                 layer.save()
                 
-                # Process shapefile if necessary (will be called in the model's save method)
-                
                 # Clear any pending layer data from session after successful upload
                 if 'pending_layer_data' in request.session:
                     logger.info("Clearing pending layer data from session after successful upload")
                     request.session.pop('pending_layer_data', None)
                     request.session.modified = True
                 
+                if layer.processing_status in ('pending', 'processing'):
+                    # The layer form shows the background processing progress
+                    messages.success(request, f"Map layer '{layer.name}' successfully added. "
+                                              "The shapefile is being processed in the background.")
+                    return redirect('edit_map_layer', layer_id=layer.id)
+                
                 messages.success(request, f"Map layer '{layer.name}' successfully added.")
                 return redirect('map_layer_list')
             else:
@@ -827,6 +1355,11 @@ def edit_map_layer(request, layer_id):
                     layer_obj.z_index = 0
                 layer_obj.save()
                 
+                if layer_obj.processing_status in ('pending', 'processing'):
+                    messages.success(request, f"Map layer '{layer.name}' successfully updated. "
+                                              "The shapefile is being processed in the background.")
+                    return redirect('edit_map_layer', layer_id=layer_obj.id)
+                
                 messages.success(request, f"Map layer '{layer.name}' successfully updated.")
                 return redirect('map_layer_list')
             else:
@@ -162,10 +162,13 @@ for directory in [SHAPEFILES_DIR, MAP_LAYERS_DIR, PROPERTY_FILES_DIR]:
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Cache settings
+# Shared by the worker processes of a node through a SQLite file (see maps.shared_cache).
+# Its values are pickled, so the file is kept out of MEDIA_ROOT, where uploads are written
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'property-mapper-cache',
+        'BACKEND': 'maps.shared_cache.SharedSQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'django.sqlite3'),
+        'OPTIONS': {'MAX_BYTES': 64 * 1024 * 1024},  # 64MB
     }
 }
 
@@ -177,6 +180,33 @@ FILE_UPLOAD_HANDLERS = [
     'django.core.files.uploadhandler.TemporaryFileUploadHandler',
 ]  # Force all uploads to disk to handle large files
 
+# Shapefile post-processing (see maps.processing): run in background threads
+# after the upload request, or inline when LAYER_PROCESSING_ASYNC is False.
+# Jobs live in the web process, so a restart loses the queued ones: production
+# deployments should run `python manage.py process_layers --unfinished` at startup.
+# A layer whose running job stops sending heartbeats for LAYER_PROCESSING_STALE_AFTER
+# seconds is processed again when its status or data is requested
+LAYER_PROCESSING_ASYNC = True
+LAYER_PROCESSING_WORKERS = 1
+LAYER_PROCESSING_STALE_AFTER = 60 * 5
+
+# Processes extracting the uncached chunks of viewport requests in parallel
+# (maps.chunking), per web process: every web worker starts its own pool
+CHUNK_EXTRACTION_WORKERS = 2
+
+# Layer data cache (maps.caching.layer_cache): byte budgets of the in-process
+# memory tier, of the SQLite store shared by the workers of a node and of the
+# file tier, least recently used entries are evicted
+LAYER_CACHE_MEMORY_BYTES = 64 * 1024 * 1024  # 64MB per process
+LAYER_CACHE_MEMORY_MAX_ENTRY_BYTES = 1024 * 1024  # Larger entries are only kept in the shared tiers
+LAYER_CACHE_SHARED_BYTES = 512 * 1024 * 1024  # 512MB for all processes
+LAYER_CACHE_SHARED_MAX_ENTRY_BYTES = 32 * 1024 * 1024
+LAYER_CACHE_FILE_BYTES = 10 * 1024 * 1024 * 1024  # 10GB disk quota
+LAYER_CACHE_SWEEP_INTERVAL = 60 * 10  # Seconds between background sweeps of the file tier, 0 disables them
+LAYER_CACHE_COALESCE_TIMEOUT = 120  # Seconds a cache miss waits for the same conversion in flight elsewhere
+LAYER_CACHE_STALE_SECONDS = 60 * 60 * 24 * 7  # Seconds expired entries are still served while rebuilt
+LAYER_CACHE_REVALIDATION_WORKERS = 1  # Background rebuild threads per process
+
 # GIS libraries configuration (temporarily commented out)
 # Note: Using standard PostgreSQL instead of PostGIS while we resolve GeoDjango configuration issues
 """